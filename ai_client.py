@@ -0,0 +1,201 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from io import BytesIO
+from typing import Dict, List, Iterator, Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+from config import Config
+from tracing import tracer, SPAN_KIND_CLIENT
+
+class AIServiceClient:
+    """Pooled HTTP client for the standalone AI server, mirroring AIService"""
+
+    def __init__(self, base_url: str = None, pool_size: int = None, timeout: float = None):
+        config = Config.get_server_config()
+        self.base_url = (base_url or config["url"]).rstrip("/")
+        self.timeout = timeout or config["client_timeout"]
+
+        # Keep-alive connections shared by every Streamlit session in the process
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size or config["client_pool_size"], pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if config["token"]:
+            self.session.headers["Authorization"] = f"Bearer {config['token']}"
+
+    @staticmethod
+    def _error(message: str) -> Tuple[str, Dict]:
+        """Build the same apology/source shape AIService returns on failure"""
+
+        return (
+            f"I apologize, but I encountered an error: {message}. Please try again.",
+            {
+                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "sources": [],
+                "confidence": "N/A",
+                "error": message,
+                "real_time": True,
+                "trace_id": tracer.current_trace_id()
+            }
+        )
+
+    def _post(self, path: str, **kwargs) -> Tuple[str, Dict]:
+        with tracer.span(f"POST {path}", kind=SPAN_KIND_CLIENT, server=self.base_url) as span:
+            try:
+                response = self.session.post(f"{self.base_url}{path}", timeout=self.timeout, headers=tracer.headers(), **kwargs)
+                if span:
+                    span.set(status_code=response.status_code)
+                if response.status_code == 503:
+                    return self._error("the AI server is busy")
+                response.raise_for_status()
+                data = response.json()
+                return data["response"], data["sources"]
+            except (requests.RequestException, ValueError, KeyError) as e:
+                if span:
+                    span.error = str(e)
+                return self._error(str(e))
+
+    @staticmethod
+    def _history(conversation_history: Optional[List[Dict]]) -> Optional[List[Dict]]:
+        """Make history JSON-safe (datetimes become strings)"""
+
+        if conversation_history is None:
+            return None
+        return json.loads(json.dumps(conversation_history, default=str))
+
+    def get_ai_response(self,
+                        prompt: str,
+                        image: Optional[Image.Image] = None,
+                        include_sources: bool = True,
+                        conversation_history: List[Dict] = None,
+                        priority: str = "interactive",
+                        user_id: str = None,
+                        supersede_key: str = None) -> Tuple[str, Dict]:
+        """Get AI response from the server"""
+
+        scheduling = self._scheduling(priority, user_id, supersede_key)
+        if image is not None:
+            return self.analyze_image(image, prompt, **scheduling)
+        return self._post("/api/chat", json={
+            "prompt": prompt,
+            "include_sources": include_sources,
+            "conversation_history": self._history(conversation_history),
+            **scheduling
+        })
+
+    @staticmethod
+    def _scheduling(priority: str, user_id: Optional[str], supersede_key: Optional[str]) -> Dict[str, str]:
+        """Scheduler fields the server passes on to its request scheduler"""
+
+        fields = {"priority": priority, "user_id": user_id, "supersede_key": supersede_key}
+        return {key: value for key, value in fields.items() if value is not None}
+
+    def analyze_image(self,
+                      image: Image.Image,
+                      question: str = None,
+                      priority: str = "interactive",
+                      user_id: str = None,
+                      supersede_key: str = None) -> Tuple[str, Dict]:
+        """Upload an image for analysis as multipart form data"""
+
+        buffered = BytesIO()
+        image.convert("RGB").save(buffered, format="JPEG")
+        return self._post(
+            "/api/image",
+            files={"image": ("image.jpg", buffered.getvalue(), "image/jpeg")},
+            data={"question": question or "", **self._scheduling(priority, user_id, supersede_key)}
+        )
+
+    def analyze_images(self,
+                       images: List[Tuple[str, bytes]],
+                       question: str = None,
+                       max_concurrency: int = None,
+                       user_id: str = None) -> Iterator[Dict]:
+        """Analyze a batch of (name, raw bytes) images on the server, yielding results as they finish"""
+
+        def analyze(name: str, data: bytes) -> Dict:
+            start = time.perf_counter()
+            response, sources = self._post(
+                "/api/image",
+                files={"image": (name, data)},
+                data={"question": question or "", **self._scheduling("batch", user_id, None)}
+            )
+            return {
+                "name": name,
+                "response": response,
+                "sources": sources,
+                "error": sources.get("error"),
+                "attempts": 1,
+                "elapsed": round(time.perf_counter() - start, 3)
+            }
+
+        with ThreadPoolExecutor(max_workers=max_concurrency or Config.BATCH_MAX_CONCURRENCY) as pool:
+            futures = [pool.submit(tracer.bind(analyze), name, data) for name, data in images]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def process_voice_query(self, text: str, conversation_history: List[Dict] = None, user_id: str = None) -> Tuple[str, Dict]:
+        """Process voice query on the server"""
+
+        return self._post("/api/voice", json={
+            "text": text,
+            "conversation_history": self._history(conversation_history),
+            **self._scheduling("voice", user_id, None)
+        })
+
+    def stream_ai_response(self,
+                           prompt: str,
+                           include_sources: bool = True,
+                           conversation_history: List[Dict] = None,
+                           voice: bool = False) -> Iterator[Dict]:
+        """Yield server-sent {"delta"} events followed by a {"done"} event"""
+
+        try:
+            with self.session.post(
+                f"{self.base_url}/api/chat/stream",
+                json={
+                    "prompt": prompt,
+                    "include_sources": include_sources,
+                    "conversation_history": self._history(conversation_history),
+                    "voice": voice
+                },
+                stream=True,
+                timeout=self.timeout,
+                headers=tracer.headers()
+            ) as response:
+                response.raise_for_status()
+                for line in response.iter_lines(decode_unicode=True):
+                    if line and line.startswith("data: "):
+                        yield json.loads(line[len("data: "):])
+        except (requests.RequestException, ValueError) as e:
+            response_text, sources = self._error(str(e))
+            yield {"delta": response_text}
+            yield {"done": True, "response": response_text, "sources": sources}
+
+    def warm(self, connections: int = None) -> str:
+        """Open keep-alive connections to the server ahead of traffic (a warm-up step)"""
+
+        connections = connections or Config.WARMUP_CONNECTIONS
+        with ThreadPoolExecutor(max_workers=connections) as pool:
+            responses = list(pool.map(lambda _: self.session.get(f"{self.base_url}/ready", timeout=10), range(connections)))
+        warming = 0
+        for response in responses:
+            # /ready answers 503 until the server has finished its own warm-up; the connection is still open
+            if response.status_code == 503:
+                warming += 1
+                continue
+            response.raise_for_status()
+        return f"{connections} connections, server {'still warming up' if warming else 'ready'}"
+
+    def get_system_status(self) -> Dict:
+        """Get the server's system status"""
+
+        try:
+            response = self.session.get(f"{self.base_url}/status", timeout=10)
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, ValueError) as e:
+            return {"status": "unreachable", "error": str(e)}
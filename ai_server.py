@@ -0,0 +1,405 @@
+"""Standalone async AI backend exposing AIService over HTTP, SSE and WebSocket
+
+Run with:
+
+    python ai_server.py [--host 127.0.0.1] [--port 8600]
+
+and point the Streamlit app at it with AI_SERVER_URL=http://localhost:8600.
+
+The API relays to the operator's OpenAI account, so it listens on loopback
+by default. With AI_SERVER_TOKEN set, ``/api/*``, ``/ws`` and ``/status``
+require ``Authorization: Bearer <token>``; binding any other address needs
+the token, or AI_SERVER_ALLOW_OPEN=true to serve it unauthenticated.
+
+Requests carrying a W3C ``traceparent`` header (or, on the WebSocket, a
+``traceparent`` field per message) continue the caller's trace.
+"""
+import argparse
+import asyncio
+import base64
+import hmac
+import ipaddress
+import json
+import logging
+from io import BytesIO
+from typing import Dict, Any, Awaitable, Callable, Optional
+from aiohttp import web, WSCloseCode, WSMsgType
+from PIL import Image
+from ai_service import ai_service
+from config import Config
+from tracing import tracer, SPAN_KIND_SERVER
+from warmup import warmup
+
+logger = logging.getLogger(__name__)
+
+class QueueFullError(Exception):
+    """Raised when the request queue is at capacity"""
+
+class ShuttingDownError(Exception):
+    """Raised when the server no longer accepts new work"""
+
+class RequestQueue:
+    """Bounded job queue drained by a fixed pool of worker tasks"""
+
+    def __init__(self, workers: int, maxsize: int):
+        self.workers = workers
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._tasks = []
+        self.closing = False
+        self.stats = {"accepted": 0, "rejected": 0, "completed": 0, "failed": 0, "active": 0}
+
+    def start(self):
+        """Start the worker tasks on the running loop"""
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, job: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        """Queue a job; raises QueueFullError instead of waiting when saturated"""
+
+        if self.closing:
+            raise ShuttingDownError("Server is shutting down")
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            # Worker tasks do not inherit the caller's context; carry its span along
+            self._queue.put_nowait((tracer.bind(job), future))
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            raise QueueFullError("Request queue is full")
+        self.stats["accepted"] += 1
+        return future
+
+    async def _worker(self):
+        while True:
+            job, future = await self._queue.get()
+            try:
+                if future.cancelled():
+                    continue
+                self.stats["active"] += 1
+                task = asyncio.ensure_future(job())
+                # A caller that goes away cancels the work it queued
+                future.add_done_callback(lambda f, t=task: t.cancel() if f.cancelled() else None)
+                try:
+                    result = await task
+                    if not future.done():
+                        future.set_result(result)
+                    self.stats["completed"] += 1
+                except asyncio.CancelledError:
+                    if not task.cancelled():
+                        raise
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    if not future.done():
+                        future.set_exception(e)
+                finally:
+                    self.stats["active"] -= 1
+            finally:
+                self._queue.task_done()
+
+    async def drain(self, timeout: float):
+        """Stop accepting work, finish queued jobs, then stop the workers"""
+
+        self.closing = True
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("shutdown timeout reached with %d queued jobs", self._queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue depth and counters"""
+
+        return {
+            "queued": self._queue.qsize(),
+            "capacity": self._queue.maxsize,
+            "workers": self.workers,
+            "closing": self.closing,
+            **self.stats
+        }
+
+def _busy_response(error: Exception) -> web.Response:
+    """503 telling clients to back off and retry"""
+
+    return web.json_response({"error": str(error)}, status=503, headers={"Retry-After": "1"})
+
+def _decode_image(data: bytes) -> Image.Image:
+    image = Image.open(BytesIO(data))
+    image.load()
+    return image
+
+async def _read_json(request: web.Request) -> Dict[str, Any]:
+    try:
+        return await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise web.HTTPBadRequest(text="Request body must be JSON")
+
+async def _run(request: web.Request, job: Callable[[], Awaitable[Any]]):
+    """Queue a job and wait for its result, mapping saturation to 503"""
+
+    queue: RequestQueue = request.app["queue"]
+    try:
+        return await queue.submit(job)
+    except (QueueFullError, ShuttingDownError) as e:
+        raise web.HTTPServiceUnavailable(
+            text=json.dumps({"error": str(e)}),
+            content_type="application/json",
+            headers={"Retry-After": "1"}
+        )
+
+def _scheduling(request: web.Request, data, default_priority: str = "interactive") -> Dict[str, Any]:
+    """Scheduler priority, fair-queuing user and supersede key for a request"""
+
+    return {
+        "priority": data.get("priority") or default_priority,
+        "user_id": data.get("user_id") or request.remote or "anonymous",
+        "supersede_key": data.get("supersede_key") or None
+    }
+
+async def handle_chat(request: web.Request) -> web.Response:
+    data = await _read_json(request)
+    response, sources = await _run(request, lambda: ai_service.get_ai_response(
+        data.get("prompt", ""),
+        include_sources=data.get("include_sources", True),
+        conversation_history=data.get("conversation_history"),
+        **_scheduling(request, data)
+    ))
+    return web.json_response({"response": response, "sources": sources})
+
+async def handle_voice(request: web.Request) -> web.Response:
+    data = await _read_json(request)
+    response, sources = await _run(request, lambda: ai_service.process_voice_query(
+        data.get("text", ""),
+        conversation_history=data.get("conversation_history"),
+        user_id=_scheduling(request, data)["user_id"]
+    ))
+    return web.json_response({"response": response, "sources": sources})
+
+async def handle_image(request: web.Request) -> web.Response:
+    """Analyze an image sent as multipart (image, question) or JSON with base64"""
+
+    if request.content_type.startswith("multipart/"):
+        form = await request.post()
+        upload = form.get("image")
+        if upload is None or not hasattr(upload, "file"):
+            raise web.HTTPBadRequest(text="Missing image file")
+        raw = upload.file.read()
+        question = form.get("question")
+        data = form
+    else:
+        data = await _read_json(request)
+        raw = base64.b64decode(data.get("image", ""))
+        question = data.get("question")
+
+    if len(raw) > Config.MAX_FILE_SIZE:
+        raise web.HTTPRequestEntityTooLarge(max_size=Config.MAX_FILE_SIZE, actual_size=len(raw))
+    try:
+        image = await asyncio.to_thread(_decode_image, raw)
+    except Exception:
+        raise web.HTTPBadRequest(text="Could not decode image")
+
+    response, sources = await _run(request, lambda: ai_service.analyze_image(image, question or None, **_scheduling(request, data)))
+    return web.json_response({"response": response, "sources": sources})
+
+async def _stream_job(data: Dict[str, Any], events: asyncio.Queue, scheduling: Dict[str, Any]):
+    """Run a streamed chat request, forwarding its events to a handler queue"""
+
+    try:
+        prompt = data.get("prompt") or data.get("text", "")
+        if data.get("voice"):
+            prompt = f"[Voice Query] {prompt}"
+        async for event in ai_service.stream_ai_response(
+            prompt,
+            include_sources=data.get("include_sources", True),
+            conversation_history=data.get("conversation_history"),
+            # Streams hold their slot until read to the end, so they take no supersede key
+            priority=scheduling["priority"],
+            user_id=scheduling["user_id"]
+        ):
+            await events.put(event)
+    finally:
+        events.put_nowait(None)
+
+async def handle_chat_stream(request: web.Request) -> web.StreamResponse:
+    """Stream a chat response as server-sent events"""
+
+    data = await _read_json(request)
+    events: asyncio.Queue = asyncio.Queue()
+    queue: RequestQueue = request.app["queue"]
+    try:
+        scheduling = _scheduling(request, data, default_priority="voice" if data.get("voice") else "interactive")
+        future = queue.submit(lambda: _stream_job(data, events, scheduling))
+    except (QueueFullError, ShuttingDownError) as e:
+        return _busy_response(e)
+
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache"
+    })
+    await response.prepare(request)
+    try:
+        while (event := await events.get()) is not None:
+            await response.write(f"data: {json.dumps(event, default=str)}\n\n".encode())
+        await future
+    except (asyncio.CancelledError, ConnectionResetError):
+        future.cancel()
+        raise
+    await response.write_eof()
+    return response
+
+async def _ws_request(request: web.Request, ws: web.WebSocketResponse, queue: RequestQueue, data: Dict[str, Any]):
+    """Serve one WebSocket request message, streaming events tagged with its id"""
+
+    request_id = data.get("id")
+    kind = data.get("type", "chat")
+    scheduling = _scheduling(request, data, default_priority="voice" if kind == "voice" else "interactive")
+
+    with tracer.span(f"WS {kind}", kind=SPAN_KIND_SERVER, traceparent=data.get("traceparent") or ""):
+        try:
+            if kind == "image":
+                image = await asyncio.to_thread(_decode_image, base64.b64decode(data.get("image", "")))
+                response, sources = await queue.submit(lambda: ai_service.analyze_image(image, data.get("question"), **scheduling))
+                await ws.send_json({"id": request_id, "done": True, "response": response, "sources": sources})
+                return
+
+            events: asyncio.Queue = asyncio.Queue()
+            future = queue.submit(lambda: _stream_job(dict(data, voice=kind == "voice"), events, scheduling))
+            try:
+                while (event := await events.get()) is not None:
+                    await ws.send_json(dict(event, id=request_id), dumps=lambda o: json.dumps(o, default=str))
+                await future
+            except (asyncio.CancelledError, ConnectionResetError):
+                future.cancel()
+                raise
+        except (QueueFullError, ShuttingDownError) as e:
+            await ws.send_json({"id": request_id, "error": str(e), "retry_after": 1})
+        except Exception as e:
+            if not ws.closed:
+                await ws.send_json({"id": request_id, "error": str(e)})
+
+async def handle_ws(request: web.Request) -> web.WebSocketResponse:
+    """Multiplex chat, voice and image requests over one WebSocket"""
+
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    request.app["websockets"].add(ws)
+    tasks = set()
+
+    try:
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            try:
+                data = json.loads(msg.data)
+            except json.JSONDecodeError:
+                await ws.send_json({"error": "Messages must be JSON"})
+                continue
+            task = asyncio.create_task(_ws_request(request, ws, request.app["queue"], data))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        for task in tasks:
+            task.cancel()
+        request.app["websockets"].discard(ws)
+    return ws
+
+@web.middleware
+async def auth_middleware(request: web.Request, handler):
+    """Require the shared token on the API, WebSocket and status routes when one is configured"""
+
+    token = request.app["config"]["token"]
+    if token and (request.path.startswith("/api/") or request.path in ("/ws", "/status")):
+        supplied = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(supplied.encode(), f"Bearer {token}".encode()):
+            raise web.HTTPUnauthorized(text="Missing or invalid token")
+    return await handler(request)
+
+@web.middleware
+async def trace_middleware(request: web.Request, handler):
+    """Serve each API request inside a server span continuing the caller's trace"""
+
+    if not request.path.startswith("/api/"):
+        return await handler(request)
+    with tracer.span(f"{request.method} {request.path}", kind=SPAN_KIND_SERVER,
+                     traceparent=request.headers.get("traceparent", "")) as span:
+        response = await handler(request)
+        if span:
+            span.set(status_code=response.status)
+        return response
+
+async def handle_health(request: web.Request) -> web.Response:
+    queue: RequestQueue = request.app["queue"]
+    status = "draining" if queue.closing else "ok"
+    return web.json_response({"status": status}, status=503 if queue.closing else 200)
+
+async def handle_ready(request: web.Request) -> web.Response:
+    """503 until the background warm-up has finished, so a load balancer can hold traffic"""
+
+    queue: RequestQueue = request.app["queue"]
+    ready = warmup.ready and not queue.closing
+    return web.json_response(warmup.get_status(), status=200 if ready else 503)
+
+async def handle_status(request: web.Request) -> web.Response:
+    status = ai_service.get_system_status()
+    status["queue"] = request.app["queue"].get_stats()
+    return web.json_response(status, dumps=lambda o: json.dumps(o, default=str))
+
+async def _on_startup(app: web.Application):
+    app["queue"].start()
+    warmup.start(ai_service)
+
+async def _on_shutdown(app: web.Application):
+    # Stop taking work and tell WebSocket clients to reconnect elsewhere
+    app["queue"].closing = True
+    for ws in list(app["websockets"]):
+        await ws.close(code=WSCloseCode.GOING_AWAY, message=b"Server shutdown")
+
+async def _on_cleanup(app: web.Application):
+    await app["queue"].drain(app["config"]["shutdown_timeout"])
+
+def create_app(config: Dict[str, Any] = None) -> web.Application:
+    """Build the aiohttp application"""
+
+    config = config or Config.get_server_config()
+    app = web.Application(client_max_size=Config.MAX_FILE_SIZE + 1024 * 1024, middlewares=[auth_middleware, trace_middleware])
+    app["config"] = config
+    app["queue"] = RequestQueue(config["workers"], config["queue_size"])
+    app["websockets"] = set()
+
+    app.router.add_post("/api/chat", handle_chat)
+    app.router.add_post("/api/chat/stream", handle_chat_stream)
+    app.router.add_post("/api/voice", handle_voice)
+    app.router.add_post("/api/image", handle_image)
+    app.router.add_get("/ws", handle_ws)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/ready", handle_ready)
+    app.router.add_get("/status", handle_status)
+
+    app.on_startup.append(_on_startup)
+    app.on_shutdown.append(_on_shutdown)
+    app.on_cleanup.append(_on_cleanup)
+    return app
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def main(argv: Optional[list] = None):
+    config = Config.get_server_config()
+    parser = argparse.ArgumentParser(description="AI ChatBot Pro backend server")
+    parser.add_argument("--host", default=config["host"])
+    parser.add_argument("--port", type=int, default=config["port"])
+    args = parser.parse_args(argv)
+    if not _is_loopback(args.host) and not config["token"] and not config["allow_open"]:
+        parser.error(f"refusing to serve {args.host} without AI_SERVER_TOKEN; "
+                     "set a token, or AI_SERVER_ALLOW_OPEN=true to expose the API unauthenticated")
+
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(create_app(config), host=args.host, port=args.port, shutdown_timeout=config["shutdown_timeout"])
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,40 @@
 import openai
 import requests
+from requests.adapters import HTTPAdapter
 import json
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Dict, List, Any, Optional, Tuple, AsyncIterator
 from datetime import datetime
 import base64
 from io import BytesIO
 from PIL import Image
 import asyncio
 import aiohttp
+import contextlib
+import sqlite3
+import time
 from config import Config
+from image_analysis import LocalImageAnalyzer
+from image_cache import ImageResultCache
+from media_workers import media_pool, encode_jpeg, prepare_image
+from model_router import ModelRouter
+from profiler import profiled
+from request_scheduler import request_scheduler, RequestDroppedError
+from resilience import ResilientCaller, CircuitOpenError
+from shared_state import shared_state, SharedResponseCache
+from tracing import tracer, traced
+from vector_index import ConversationMemory
+from warmup import warmup
+
+class _SharedSession(requests.Session):
+    """Keep-alive pool shared by every thread's openai calls
+
+    openai 0.28 closes a thread's session after a few minutes and asks for
+    a new one; closing this one would drop connections other threads are
+    using, so close() is a no-op and the same pool is handed back.
+    """
+
+    def close(self):
+        pass
 
 class AIService:
     """AI Service for handling OpenAI integration and real-time information"""
@@ -21,49 +47,145 @@ class AIService:
             self.openai_available = True
         else:
             self.openai_available = False
+        
+        # One keep-alive pool for every thread calling the API (openai otherwise opens a session per
+        # thread), so connections opened by warm-up or an earlier request are reused. No transport
+        # retries: ResilientCaller owns retrying, and extra attempts would skew its latency and breaker stats
+        self.upstream_session = _SharedSession()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.config.SCHEDULER_MAX_CONCURRENCY)
+        self.upstream_session.mount("https://", adapter)
+        self.upstream_session.mount("http://", adapter)
+        openai.requestssession = self.upstream_session
+        
+        # Local retrieval memory over past conversations and documents
+        self.memory = ConversationMemory() if self.config.RAG_ENABLED else None
+        
+        # Retries, hedging and circuit breaking around upstream model calls
+        self.resilience = ResilientCaller()
+        
+        # Picks model and max_tokens per request from Config.MODEL_ROUTES
+        self.router = ModelRouter()
+        
+        # Cheap on-device image features attached to (or answering) vision prompts
+        self.image_analyzer = LocalImageAnalyzer(self.config.LOCAL_ANALYSIS_SIZE) if self.config.LOCAL_IMAGE_ANALYSIS else None
+        
+        # Reuses answers for re-uploaded or near-identical photos (keyed by pHash/dHash)
+        self.image_cache = ImageResultCache() if self.config.IMAGE_CACHE_ENABLED and self.image_analyzer else None
     
-    def encode_image(self, image: Image.Image) -> str:
-        """Encode PIL Image to base64 string"""
-        buffered = BytesIO()
-        image.save(buffered, format="JPEG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+    async def encode_image(self, image: Image.Image) -> str:
+        """Encode PIL Image to base64 string, JPEG-encoding it in the media worker pool without blocking the loop"""
+        jpeg = await media_pool.run_async(encode_jpeg, image, quality=75)
+        img_str = base64.b64encode(jpeg).decode()
         return f"data:image/jpeg;base64,{img_str}"
     
+    @profiled("get_ai_response")
+    @traced("ai_service.get_ai_response")
     async def get_ai_response(self, 
                             prompt: str, 
                             image: Optional[Image.Image] = None,
                             include_sources: bool = True,
-                            conversation_history: List[Dict] = None) -> Tuple[str, Dict]:
-        """Get AI response with optional image analysis and real-time information"""
+                            conversation_history: List[Dict] = None,
+                            priority: str = "interactive",
+                            user_id: str = "default",
+                            deadline: float = None,
+                            supersede_key: str = None,
+                            record: bool = True) -> Tuple[str, Dict]:
+        """Get AI response with optional image analysis and real-time information
+
+        The upstream call waits for a request_scheduler slot in the given
+        priority class; see RequestScheduler.slot for deadline and supersede_key.
+        With record=False (warm-up traffic) the shared cache is bypassed and
+        the call is left out of shared metrics and routing latency.
+        """
         
+        # Text answers are shared by every worker process through the shared cache
+        cache_key = SharedResponseCache.make_key(prompt, conversation_history) if shared_state and image is None and record else None
+        if cache_key:
+            cached = self._shared_cache_get(cache_key)
+            if cached:
+                response, sources = cached
+                sources.update(cached=True, trace_id=tracer.current_trace_id())
+                return response, sources
+        
+        start = time.perf_counter()
         try:
-            if self.openai_available:
-                return await self._get_openai_response(prompt, image, include_sources, conversation_history)
-            else:
-                return await self._get_simulated_response(prompt, image, include_sources)
+            queued_ns = time.time_ns()
+            async with request_scheduler.slot(priority, user_id, deadline, supersede_key):
+                tracer.record_span("scheduler.wait", tracer.current_span(), queued_ns, time.time_ns(), priority=priority)
+                if self.openai_available:
+                    try:
+                        response, sources = await self._get_openai_response(prompt, image, include_sources, conversation_history, user_id, record)
+                    except CircuitOpenError:
+                        # Upstream is unhealthy; degrade to the simulated backend
+                        response, sources = await self._get_simulated_response(prompt, image, include_sources)
+                        sources["fallback"] = "simulated"
+                else:
+                    response, sources = await self._get_simulated_response(prompt, image, include_sources)
+        except RequestDroppedError as e:
+            return self._dropped_response(e)
         except Exception as e:
             error_response = f"I apologize, but I encountered an error: {str(e)}. Please try again."
             return error_response, self._create_source_info(error=str(e))
+        
+        if record:
+            self._shared_record(cache_key, response, sources, time.perf_counter() - start, image is not None)
+        return response, sources
     
-    async def _get_openai_response(self, 
-                                 prompt: str, 
-                                 image: Optional[Image.Image] = None,
-                                 include_sources: bool = True,
-                                 conversation_history: List[Dict] = None) -> Tuple[str, Dict]:
-        """Get response from OpenAI API"""
+    def _dropped_response(self, error: RequestDroppedError) -> Tuple[str, Dict]:
+        """Reply for a request the scheduler dropped before it reached the model"""
+        
+        if error.reason == "superseded":
+            message = "This request was replaced by a newer one."
+        else:
+            message = "The AI service is busy right now and this request timed out in the queue. Please try again."
+        sources = self._create_source_info(error=str(error))
+        sources["dropped"] = error.reason
+        return message, sources
+    
+    def _shared_cache_get(self, key: str) -> Optional[Tuple[str, Dict]]:
+        """Look up the cross-worker response cache; failures count as a miss"""
+        
+        try:
+            return shared_state.cache.get(key)
+        except sqlite3.Error:
+            return None
+    
+    def _shared_record(self, cache_key: Optional[str], response: str, sources: Dict, elapsed: float, has_image: bool):
+        """Publish latency to the shared metrics and cache good text answers"""
+        
+        if not shared_state:
+            return
+        try:
+            shared_state.metrics.record("image_response_seconds" if has_image else "text_response_seconds", elapsed)
+            if cache_key and not sources.get('error') and not sources.get('fallback') and not sources.get('personal_context'):
+                shared_state.cache.put(cache_key, response, sources)
+        except sqlite3.Error:
+            # Shared state is an optimization; a busy or missing database must not fail the request
+            pass
+    
+    async def _build_request(self,
+                       prompt: str,
+                       image: Optional[Image.Image] = None,
+                       conversation_history: List[Dict] = None,
+                       user_id: str = "default") -> Tuple[List[Dict], Dict]:
+        """Build the chat messages and pick a model route for a request
+
+        The route's "context" is the number of memory snippets added to the
+        system prompt; those come from user_id's own history and documents.
+        """
         
         messages = []
+        recent = conversation_history[-5:] if conversation_history else []
         
         # Add conversation history if provided
-        if conversation_history:
-            for msg in conversation_history[-5:]:  # Last 5 messages for context
-                role = "user" if msg['type'] == 'user' else "assistant"
-                messages.append({"role": role, "content": msg['content']})
+        for msg in recent:  # Last 5 messages for context
+            role = "user" if msg['type'] == 'user' else "assistant"
+            messages.append({"role": role, "content": msg['content']})
         
         # Prepare the current message
         if image:
             # Vision model request
-            image_data = self.encode_image(image)
+            image_data = await self.encode_image(image)
             message_content = [
                 {"type": "text", "text": prompt},
                 {"type": "image_url", "image_url": {"url": image_data}}
@@ -78,16 +200,47 @@ class AIService:
             "role": "system", 
             "content": "You are an advanced AI assistant with capabilities for text, voice, and visual analysis. Provide detailed, helpful, and accurate responses. When analyzing images, describe what you see in detail."
         }
+        
+        # Retrieve relevant snippets beyond the recent window
+        snippets = self._retrieve_context(prompt, conversation_history, recent, user_id)
+        if snippets:
+            context = "\n".join(f"- {snippet['text']}" for snippet in snippets)
+            system_message["content"] += f"\n\nRelevant context from earlier conversations and documents:\n{context}"
         messages.insert(0, system_message)
         
-        # Make API call
-        response = await asyncio.to_thread(
+        # Route by modality, prompt length and history size
+        modality = "image" if image else ("voice" if prompt.startswith("[Voice Query]") else "text")
+        route = dict(self.router.route(modality, prompt, history_size=len(recent)), context=len(snippets))
+        
+        return messages, route
+    
+    @traced("ai_service.openai")
+    async def _get_openai_response(self, 
+                                 prompt: str, 
+                                 image: Optional[Image.Image] = None,
+                                 include_sources: bool = True,
+                                 conversation_history: List[Dict] = None,
+                                 user_id: str = "default",
+                                 record: bool = True) -> Tuple[str, Dict]:
+        """Get response from OpenAI API; record=False keeps the latency out of routing decisions"""
+        
+        messages, route = await self._build_request(prompt, image, conversation_history, user_id)
+        span = tracer.current_span()
+        if span:
+            span.set(model=route["model"], max_tokens=route["max_tokens"])
+        
+        # Make API call with retries, optional hedging and circuit breaking
+        response, attempt_seconds = await self.resilience.call_timed(
             openai.ChatCompletion.create,
-            model=self.config.OPENAI_MODEL if image else "gpt-4",
+            model=route["model"],
             messages=messages,
-            max_tokens=1000,
-            temperature=0.7
+            max_tokens=route["max_tokens"],
+            temperature=0.7,
+            request_timeout=self.config.REQUEST_TIMEOUT
         )
+        # Only the successful attempt counts; retry backoff and Retry-After waits say nothing about the model
+        if record:
+            self.router.record_latency(route["model"], attempt_seconds)
         
         ai_response = response.choices[0].message.content
         
@@ -96,8 +249,110 @@ class AIService:
         if include_sources:
             sources = await self._get_real_time_info(prompt)
         
-        return ai_response, self._create_source_info(sources=sources.get('sources', []))
+        source_info = self._create_source_info(sources=sources.get('sources', []))
+        if route["context"]:
+            # Built from this user's memory, so never shared with other users
+            source_info["personal_context"] = True
+        return ai_response, source_info
+    
+    @profiled("stream_ai_response")
+    @traced("ai_service.stream_ai_response")
+    async def stream_ai_response(self,
+                               prompt: str,
+                               image: Optional[Image.Image] = None,
+                               include_sources: bool = True,
+                               conversation_history: List[Dict] = None,
+                               priority: str = "interactive",
+                               user_id: str = "default",
+                               deadline: float = None) -> AsyncIterator[Dict]:
+        """Stream an AI response as {"delta": text} events, ending with a {"done": True, ...} event"""
+        
+        if not self.openai_available:
+            async for event in self._stream_complete_response(prompt, image, include_sources, conversation_history, priority, user_id, deadline):
+                yield event
+            return
+        
+        parts = []
+        try:
+            messages, route = await self._build_request(prompt, image, conversation_history, user_id)
+            
+            # The slot is held until the stream has been read to the end
+            async with request_scheduler.slot(priority, user_id, deadline):
+                # Retries and breaker cover opening the stream, not resuming it midway
+                try:
+                    stream, open_seconds = await self.resilience.call_timed(
+                        openai.ChatCompletion.create,
+                        model=route["model"],
+                        messages=messages,
+                        max_tokens=route["max_tokens"],
+                        temperature=0.7,
+                        request_timeout=self.config.REQUEST_TIMEOUT,
+                        stream=True
+                    )
+                except CircuitOpenError:
+                    stream = None
+                
+                if stream is not None:
+                    opened = time.perf_counter()
+                    loop = asyncio.get_running_loop()
+                    chunks: asyncio.Queue = asyncio.Queue()
+                    
+                    def pump():
+                        try:
+                            for chunk in stream:
+                                delta = chunk.choices[0].delta.get("content")
+                                if delta:
+                                    loop.call_soon_threadsafe(chunks.put_nowait, delta)
+                        finally:
+                            loop.call_soon_threadsafe(chunks.put_nowait, None)
+                    
+                    pump_task = asyncio.ensure_future(asyncio.to_thread(pump))
+                    while (delta := await chunks.get()) is not None:
+                        parts.append(delta)
+                        yield {"delta": delta}
+                    await pump_task
+                    self.router.record_latency(route["model"], open_seconds + time.perf_counter() - opened)
+            
+            if stream is None:
+                # Upstream is unhealthy; get_ai_response degrades to the simulated backend
+                async for event in self._stream_complete_response(prompt, image, include_sources, conversation_history, priority, user_id, deadline):
+                    yield event
+                return
+            
+            sources = {}
+            if include_sources:
+                sources = await self._get_real_time_info(prompt)
+            yield {"done": True, "response": "".join(parts), "sources": self._create_source_info(sources=sources.get('sources', []))}
+        except RequestDroppedError as e:
+            response, sources = self._dropped_response(e)
+            yield {"delta": response}
+            yield {"done": True, "response": response, "sources": sources}
+        except Exception as e:
+            error_response = f"I apologize, but I encountered an error: {str(e)}. Please try again."
+            if not parts:
+                yield {"delta": error_response}
+            yield {"done": True, "response": "".join(parts) or error_response, "sources": self._create_source_info(error=str(e))}
     
+    async def _stream_complete_response(self,
+                                      prompt: str,
+                                      image: Optional[Image.Image] = None,
+                                      include_sources: bool = True,
+                                      conversation_history: List[Dict] = None,
+                                      priority: str = "interactive",
+                                      user_id: str = "default",
+                                      deadline: float = None) -> AsyncIterator[Dict]:
+        """Stream a non-streaming response as word chunks"""
+        
+        response, sources = await self.get_ai_response(
+            prompt, image, include_sources, conversation_history,
+            priority=priority, user_id=user_id, deadline=deadline
+        )
+        words = response.split(" ")
+        for i in range(0, len(words), 4):
+            yield {"delta": " ".join(words[i:i + 4]) + (" " if i + 4 < len(words) else "")}
+        yield {"done": True, "response": response, "sources": sources}
+    
+    @traced("ai_service.simulated")
     async def _get_simulated_response(self, 
                                     prompt: str, 
                                     image: Optional[Image.Image] = None,
@@ -132,6 +387,7 @@ class AIService:
         
         return response, self._create_source_info(sources=sources)
     
+    @traced("ai_service.real_time_info")
     async def _get_real_time_info(self, query: str) -> Dict:
         """Fetch real-time information from web sources"""
         
@@ -152,6 +408,30 @@ class AIService:
         except Exception as e:
             return {"error": str(e), "sources": []}
     
+    def _retrieve_context(self, prompt: str, conversation_history: List[Dict], recent: List[Dict], user_id: str) -> List[Dict]:
+        """Index new history messages and retrieve top-k snippets for the prompt from user_id's own memory"""
+        
+        if not self.memory:
+            return []
+        
+        try:
+            if conversation_history:
+                self.memory.add_messages(conversation_history, user_id)
+            exclude = [ConversationMemory.message_key(msg, user_id) for msg in recent]
+            return self.memory.retrieve(prompt, user_id, exclude=exclude)
+        except Exception:
+            # Retrieval is best-effort and must never block a response
+            return []
+    
+    def index_document(self, text: str, source: str, user_id: str = "default") -> int:
+        """Add a document uploaded by user_id to the retrieval memory"""
+        
+        if not self.memory:
+            return 0
+        count = self.memory.add_document(text, source, user_id)
+        self.memory.save()
+        return count
+    
     def _create_source_info(self, sources: List[str] = None, error: str = None) -> Dict:
         """Create source information dictionary"""
         
@@ -160,22 +440,135 @@ class AIService:
             "sources": sources or [],
             "confidence": "95%" if not error else "N/A",
             "error": error,
-            "real_time": True
+            "real_time": True,
+            "trace_id": tracer.current_trace_id()
         }
     
-    async def analyze_image(self, image: Image.Image, question: str = None) -> Tuple[str, Dict]:
+    @profiled("analyze_image")
+    @traced("ai_service.analyze_image")
+    async def analyze_image(self,
+                          image: Image.Image,
+                          question: str = None,
+                          priority: str = "interactive",
+                          user_id: str = "default",
+                          deadline: float = None,
+                          supersede_key: str = None) -> Tuple[str, Dict]:
         """Analyze an image with optional specific question"""
         
         if not question:
             question = "Please analyze this image and describe what you see in detail."
         
-        return await self.get_ai_response(question, image=image, include_sources=False)
+        scheduling = {"priority": priority, "user_id": user_id, "deadline": deadline, "supersede_key": supersede_key}
+        if not self.image_analyzer:
+            return await self.get_ai_response(question, image=image, include_sources=False, **scheduling)
+        
+        features = await asyncio.to_thread(self.image_analyzer.analyze, image)
+        
+        # Questions purely about colors, blur, exposure or faces are answered locally
+        if self.config.LOCAL_SHORT_CIRCUIT:
+            local_answer = self.image_analyzer.answer(question, features)
+            if local_answer:
+                sources = self._create_source_info()
+                sources.update(local_analysis=True, image_features=features)
+                return local_answer, sources
+        
+        if self.image_cache:
+            cached = self.image_cache.get(features["phash"], features["dhash"], question)
+            if cached:
+                response, sources, distance = cached
+                sources.update(cached=True, cache_distance=distance, image_features=features, trace_id=tracer.current_trace_id())
+                return response, sources
+        
+        prompt = f"{question}\n\n[Local image analysis] {self.image_analyzer.summarize(features)}"
+        response, sources = await self.get_ai_response(prompt, image=image, include_sources=False, **scheduling)
+        
+        if self.image_cache and not sources.get('error') and not sources.get('fallback'):
+            self.image_cache.put(features["phash"], features["dhash"], question, response, sources)
+        
+        sources["image_features"] = features
+        return response, sources
     
-    async def process_voice_query(self, text: str, conversation_history: List[Dict] = None) -> Tuple[str, Dict]:
+    @profiled("analyze_image_bytes")
+    @traced("ai_service.analyze_image_bytes")
+    async def analyze_image_bytes(self,
+                                  name: str,
+                                  data: bytes,
+                                  question: str = None,
+                                  max_retries: int = None,
+                                  user_id: str = "default",
+                                  semaphore: asyncio.Semaphore = None) -> Dict:
+        """Preprocess and analyze one raw image of a batch with retries
+
+        Returns a result dict with name, response, sources, error, attempts
+        and elapsed. The upstream call runs in the "batch" priority class,
+        inside ``semaphore`` when one is given.
+        """
+
+        max_retries = self.config.BATCH_MAX_RETRIES if max_retries is None else max_retries
+        semaphore = semaphore or contextlib.nullcontext()
+        start = time.perf_counter()
+        result = {"name": name, "response": None, "sources": None, "error": None, "attempts": 0}
+
+        try:
+            prepared = await media_pool.run_async(prepare_image, data, self.config.BATCH_MODEL_IMAGE_SIZE)
+            image = Image.open(BytesIO(prepared))
+        except Exception as e:
+            result["error"] = f"Could not read image: {e}"
+            result["elapsed"] = round(time.perf_counter() - start, 3)
+            return result
+
+        async with semaphore:
+            for attempt in range(max_retries + 1):
+                result["attempts"] = attempt + 1
+                response, sources = await self.analyze_image(image, question, priority="batch", user_id=user_id)
+                result.update(response=response, sources=sources, error=sources.get('error'))
+                if not result["error"]:
+                    break
+                if attempt < max_retries:
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+
+        result["elapsed"] = round(time.perf_counter() - start, 3)
+        return result
+
+    async def analyze_images(self,
+                           images: List[Tuple[str, bytes]],
+                           question: str = None,
+                           max_concurrency: int = None,
+                           max_retries: int = None,
+                           user_id: str = "default") -> AsyncIterator[Dict]:
+        """Analyze a batch of (name, raw bytes) images, yielding each result as it finishes
+
+        Upstream calls run in the scheduler's lowest ("batch") priority class.
+        """
+
+        semaphore = asyncio.Semaphore(max_concurrency or self.config.BATCH_MAX_CONCURRENCY)
+        max_retries = self.config.BATCH_MAX_RETRIES if max_retries is None else max_retries
+
+        tasks = [
+            asyncio.create_task(self.analyze_image_bytes(name, data, question, max_retries, user_id, semaphore))
+            for name, data in images
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @profiled("process_voice_query")
+    @traced("ai_service.process_voice_query")
+    async def process_voice_query(self,
+                                text: str,
+                                conversation_history: List[Dict] = None,
+                                user_id: str = "default",
+                                deadline: float = None) -> Tuple[str, Dict]:
         """Process voice query with conversation context"""
         
         voice_prompt = f"[Voice Query] {text}"
-        return await self.get_ai_response(voice_prompt, conversation_history=conversation_history)
+        return await self.get_ai_response(
+            voice_prompt, conversation_history=conversation_history,
+            priority="voice", user_id=user_id, deadline=deadline
+        )
     
     def get_system_status(self) -> Dict:
         """Get system status information"""
@@ -184,8 +577,26 @@ class AIService:
             "openai_available": self.openai_available,
             "model": self.config.OPENAI_MODEL,
             "timestamp": datetime.now().isoformat(),
-            "status": "online" if self.openai_available else "demo_mode"
+            "status": ("degraded" if self.resilience.breaker.state == "open" else "online") if self.openai_available else "demo_mode",
+            "ready": warmup.ready,
+            "warmup": warmup.get_status(),
+            "memory": self.memory.get_stats() if self.memory else None,
+            "upstream": self.resilience.get_state(),
+            "routing": self.router.get_stats(),
+            "image_cache": self.image_cache.get_stats() if self.image_cache else None,
+            "media_workers": media_pool.get_stats(),
+            "scheduler": request_scheduler.get_stats(),
+            "shared_state": self._shared_stats(),
+            "tracing": tracer.get_stats()
         }
+    
+    def _shared_stats(self) -> Optional[Dict]:
+        if not shared_state:
+            return None
+        try:
+            return shared_state.get_stats()
+        except sqlite3.Error as e:
+            return {"error": str(e)}
 
 # Global AI service instance
 ai_service = AIService()
\ No newline at end of file
@@ -0,0 +1,321 @@
+"""Offline batch processing of prompt files and image directories
+
+Reads prompts from JSONL or CSV files and images from directories as a
+stream, answers them through AIService with bounded concurrency and writes
+one JSON line per item to the output file as soon as it finishes. The output
+file doubles as the checkpoint: rerunning the same command skips every item
+that already has a successful result, so an interrupted run resumes where
+it stopped.
+
+Run with:
+
+    python batch_cli.py --prompts nightly.jsonl --images photos/ --output results.jsonl
+
+JSONL lines and CSV rows take the fields ``id`` (optional; defaults to the
+file name and line number), ``prompt`` and ``image`` (optional path; the
+prompt is then asked about the image). Image directories are analyzed with
+``--question``. Upstream calls run in the scheduler's "batch" priority
+class, go through the resilience layer's retries and, when
+SHARED_STATE_PATH (or ``--shared-state``) is set, the shared response cache
+and rate limiter used by the app.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+from collections import deque
+from typing import Dict, Any, Iterator, Optional, Set, Tuple
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp")
+
+def _parse_jsonl(f) -> Iterator[Tuple[int, Any]]:
+    """(line number, parsed value) per non-blank line; a malformed line yields its ValueError instead"""
+
+    for number, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield number, ValueError(f"line {number} is not valid JSON: {e}")
+            continue
+        yield number, row if isinstance(row, dict) else ValueError(f"line {number} is a JSON {type(row).__name__}, not an object")
+
+def iter_prompt_file(path: str) -> Iterator[Dict]:
+    """Yield work items from a JSONL or CSV file, one line at a time
+
+    A line that cannot be read as an item becomes an item carrying only an
+    ``error``, so it is reported in the output without stopping the run.
+    """
+
+    base = os.path.basename(path)
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith(".csv"):
+            rows = enumerate(csv.DictReader(f), start=2)
+        else:
+            rows = _parse_jsonl(f)
+        for number, row in rows:
+            if isinstance(row, ValueError):
+                yield {"id": f"{base}:{number}", "prompt": "", "image": None, "error": str(row)}
+                continue
+            image = row.get("image") or None
+            if image and not os.path.isabs(image):
+                image = os.path.join(os.path.dirname(path), image)
+            yield {
+                "id": str(row.get("id") or f"{base}:{number}"),
+                "prompt": row.get("prompt") or "",
+                "image": image
+            }
+
+def iter_image_dir(path: str, question: Optional[str]) -> Iterator[Dict]:
+    """Yield one work item per image file under a directory"""
+
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                image = os.path.join(root, name)
+                yield {"id": os.path.relpath(image, os.path.dirname(path.rstrip(os.sep)) or "."), "prompt": question, "image": image}
+
+def load_checkpoint(output_path: str, retry_failed: bool = True) -> Set[str]:
+    """Ids already completed in a previous run of this output file
+
+    A line cut short by an interruption is ignored. With retry_failed, items
+    whose last result was an error are run again.
+    """
+
+    done: Set[str] = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if result.get("error") and retry_failed:
+                done.discard(result["id"])
+            else:
+                done.add(result["id"])
+    return done
+
+class BatchRateLimiter:
+    """Waits until a request fits max_requests per window
+
+    Uses the shared SQLite limiter when multi-worker state is configured, so
+    the batch job and the app share one budget; otherwise a local sliding
+    window.
+    """
+
+    def __init__(self, max_requests: int, window_seconds: float, client_id: str = "batch-cli"):
+        from shared_state import shared_state
+        self.shared = shared_state
+        self.max_requests = max_requests
+        self.window_seconds = window_seconds
+        self.client_id = client_id
+        self._times = deque(maxlen=max_requests)
+        self._lock = asyncio.Lock()
+        self.waited = 0.0
+
+    def _local_delay(self, now: float) -> float:
+        """Take a slot in the local window, or return how long until one frees up"""
+
+        while self._times and self._times[0] <= now - self.window_seconds:
+            self._times.popleft()
+        if len(self._times) < self.max_requests:
+            self._times.append(now)
+            return 0.0
+        return self._times[0] + self.window_seconds - now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if self.shared:
+                    try:
+                        delay = 0.0 if self.shared.rate_limiter.check(self.client_id, self.max_requests, self.window_seconds) else 1.0
+                    except sqlite3.Error:
+                        delay = self._local_delay(now)  # shared store busy or missing
+                else:
+                    delay = self._local_delay(now)
+                if not delay:
+                    return
+                self.waited += delay
+                await asyncio.sleep(delay)
+
+class BatchRunner:
+    """Streams work items through AIService and appends results to a JSONL file"""
+
+    def __init__(self, service, output_path: str, concurrency: int, max_retries: int,
+                 rate_limiter: Optional[BatchRateLimiter] = None, user_id: str = "batch-cli", retry_failed: bool = True):
+        self.service = service
+        self.output_path = output_path
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.rate_limiter = rate_limiter
+        self.user_id = user_id
+        self.completed = load_checkpoint(output_path, retry_failed)
+        self.stats = {"skipped": 0, "succeeded": 0, "failed": 0, "cached": 0}
+        self._started = time.perf_counter()
+
+    async def _throttle(self):
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire()
+
+    async def _answer(self, item: Dict) -> Dict:
+        start = time.perf_counter()
+        if item["image"]:
+            try:
+                with open(item["image"], "rb") as f:
+                    data = f.read()
+            except OSError as e:
+                return {"response": None, "sources": None, "error": f"Could not read image: {e}", "attempts": 0,
+                        "elapsed": round(time.perf_counter() - start, 3)}
+            await self._throttle()
+            result = await self.service.analyze_image_bytes(
+                item["id"], data, item["prompt"] or None, self.max_retries, self.user_id
+            )
+            result.pop("name", None)
+            return result
+
+        result = {"response": None, "sources": None, "error": None, "attempts": 0}
+        for attempt in range(self.max_retries + 1):
+            await self._throttle()
+            result["attempts"] = attempt + 1
+            response, sources = await self.service.get_ai_response(item["prompt"], priority="batch", user_id=self.user_id)
+            result.update(response=response, sources=sources, error=sources.get('error'))
+            if not result["error"]:
+                break
+            if attempt < self.max_retries:
+                await asyncio.sleep(0.5 * 2 ** attempt)
+        result["elapsed"] = round(time.perf_counter() - start, 3)
+        return result
+
+    def _write(self, out, item: Dict, result: Dict):
+        record = {"id": item["id"], "prompt": item["prompt"], "image": item["image"], **result,
+                  "finished": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        out.flush()
+
+        if result.get("error"):
+            self.stats["failed"] += 1
+        else:
+            self.stats["succeeded"] += 1
+            self.completed.add(item["id"])
+        if (result.get("sources") or {}).get("cached"):
+            self.stats["cached"] += 1
+
+    def progress(self) -> str:
+        processed = self.stats["succeeded"] + self.stats["failed"]
+        rate = processed / max(time.perf_counter() - self._started, 1e-9)
+        return (f"{processed} processed ({self.stats['succeeded']} ok, {self.stats['failed']} failed, "
+                f"{self.stats['cached']} cached), {self.stats['skipped']} skipped, {rate:.1f} items/s")
+
+    async def run(self, items: Iterator[Dict], progress_every: int = 50):
+        """Process items, keeping at most ``concurrency`` in flight"""
+
+        pending = {}
+        with open(self.output_path, "a", encoding="utf-8") as out:
+            try:
+                for item in items:
+                    if item["id"] in self.completed or any(p["id"] == item["id"] for p in pending.values()):
+                        self.stats["skipped"] += 1
+                        continue
+                    if item.get("error"):
+                        # Unreadable input line: record it and move on
+                        self._write(out, item, {"response": None, "sources": None, "error": item.pop("error"), "attempts": 0})
+                        continue
+                    if len(pending) >= self.concurrency:
+                        await self._drain(out, pending, asyncio.FIRST_COMPLETED, progress_every)
+                    pending[asyncio.create_task(self._answer(item))] = item
+                while pending:
+                    await self._drain(out, pending, asyncio.ALL_COMPLETED, progress_every)
+            except Exception:
+                # An input that cannot be read further still lets the items in flight finish and be written
+                while pending:
+                    await self._drain(out, pending, asyncio.ALL_COMPLETED, progress_every)
+                raise
+            finally:
+                for task in pending:
+                    task.cancel()
+                out.flush()
+                os.fsync(out.fileno())
+
+    async def _drain(self, out, pending: Dict, return_when, progress_every: int):
+        done, _ = await asyncio.wait(pending, return_when=return_when)
+        for task in done:
+            item = pending.pop(task)
+            try:
+                result = task.result()
+            except Exception as e:
+                result = {"response": None, "sources": None, "error": str(e), "attempts": 0}
+            self._write(out, item, result)
+            processed = self.stats["succeeded"] + self.stats["failed"]
+            if progress_every and processed % progress_every == 0:
+                print(self.progress(), file=sys.stderr)
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="AI ChatBot Pro offline batch processor")
+    parser.add_argument("--prompts", action="append", default=[], help="JSONL or CSV prompt file (repeatable)")
+    parser.add_argument("--images", action="append", default=[], help="directory of images to analyze (repeatable)")
+    parser.add_argument("--question", default=None, help="question asked about each image from --images")
+    parser.add_argument("--output", required=True, help="JSONL results file; also the resume checkpoint")
+    parser.add_argument("--concurrency", type=int, default=None, help="items in flight (default BATCH_MAX_CONCURRENCY)")
+    parser.add_argument("--retries", type=int, default=None, help="retries per failed item (default BATCH_MAX_RETRIES)")
+    parser.add_argument("--rate-limit", type=int, default=None,
+                        help="max requests per --rate-window minutes (default BATCH_RATE_LIMIT_REQUESTS; 0 means unthrottled)")
+    parser.add_argument("--rate-window", type=float, default=None, help="rate limit window in minutes (default BATCH_RATE_LIMIT_WINDOW_MINUTES)")
+    parser.add_argument("--shared-state", default=None, help="SQLite file for the shared cache and rate limiter")
+    parser.add_argument("--no-retry-failed", action="store_true", help="on resume, skip items that failed before")
+    parser.add_argument("--progress-every", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    if not args.prompts and not args.images:
+        parser.error("give at least one --prompts file or --images directory")
+
+    # Config reads the environment on import
+    if args.shared_state:
+        os.environ["SHARED_STATE_PATH"] = args.shared_state
+    from config import Config
+    from ai_service import ai_service
+
+    def items() -> Iterator[Dict]:
+        for path in args.prompts:
+            yield from iter_prompt_file(path)
+        for path in args.images:
+            yield from iter_image_dir(path, args.question)
+
+    # The UI's per-client limit would stretch a nightly job over many hours, so batch throttling has its own, opt-in limit
+    rate_limit = Config.BATCH_RATE_LIMIT_REQUESTS if args.rate_limit is None else args.rate_limit
+    rate_window = args.rate_window or Config.BATCH_RATE_LIMIT_WINDOW_MINUTES
+
+    async def run():
+        runner = BatchRunner(
+            ai_service,
+            args.output,
+            concurrency=args.concurrency or Config.BATCH_MAX_CONCURRENCY,
+            max_retries=Config.BATCH_MAX_RETRIES if args.retries is None else args.retries,
+            rate_limiter=BatchRateLimiter(rate_limit, rate_window * 60) if rate_limit > 0 else None,
+            retry_failed=not args.no_retry_failed
+        )
+        if runner.completed:
+            print(f"resuming: {len(runner.completed)} items already done in {args.output}", file=sys.stderr)
+        try:
+            await runner.run(items(), args.progress_every)
+        finally:
+            print(runner.progress(), file=sys.stderr)
+        return runner.stats["failed"]
+
+    try:
+        failed = asyncio.run(run())
+    except KeyboardInterrupt:
+        print("interrupted; rerun the same command to resume", file=sys.stderr)
+        sys.exit(130)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
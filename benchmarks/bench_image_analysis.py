@@ -0,0 +1,54 @@
+"""Benchmark per-image cost of local pre-analysis at camera resolution and 4K
+
+Run from the repository root:
+
+    python benchmarks/bench_image_analysis.py [--repeat 30]
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from image_analysis import LocalImageAnalyzer
+
+def synthetic_photo(width, height, seed=0):
+    """Gradient plus noise and a few shapes, closer to a photo than flat color"""
+
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x / width * 255, y / height * 255, (x + y) / (width + height) * 255], axis=-1)
+    noise = rng.normal(0, 12, (height, width, 3))
+    image = np.clip(base + noise, 0, 255).astype(np.uint8)
+    for _ in range(8):
+        cx, cy = rng.integers(0, width), rng.integers(0, height)
+        image[max(0, cy - height // 20):cy + height // 20, max(0, cx - width // 20):cx + width // 20] = rng.integers(0, 255, 3)
+    return Image.fromarray(image)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    analyzer = LocalImageAnalyzer(Config.LOCAL_ANALYSIS_SIZE)
+    sizes = [("camera", Config.CAMERA_WIDTH, Config.CAMERA_HEIGHT), ("4K", 3840, 2160)]
+
+    for label, width, height in sizes:
+        image = synthetic_photo(width, height)
+        analyzer.analyze(image)
+
+        samples = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            analyzer.analyze(image)
+            samples.append(time.perf_counter() - start)
+
+        samples = np.array(samples) * 1000
+        print(f"{label} {width}x{height}: p50={np.percentile(samples, 50):.2f}ms p95={np.percentile(samples, 95):.2f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Benchmark near-duplicate lookups in the image result cache at 100k entries
+
+Run from the repository root:
+
+    python benchmarks/bench_image_cache.py [--entries 100000] [--threshold 6]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_cache import ImageResultCache
+
+def flip_bits(value, count, rng):
+    for bit in rng.sample(range(64), count):
+        value ^= 1 << bit
+    return value
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=100_000)
+    parser.add_argument("--threshold", type=int, default=6)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    cache = ImageResultCache(max_entries=args.entries, ttl_seconds=3600, phash_threshold=args.threshold, dhash_threshold=64)
+    hashes = [rng.getrandbits(64) for _ in range(args.entries)]
+
+    start = time.perf_counter()
+    for value in hashes:
+        cache.put(f"{value:016x}", f"{value:016x}", "describe this image", "cached answer", {})
+    elapsed = time.perf_counter() - start
+    print(f"put: {args.entries} entries in {elapsed:.2f}s ({elapsed / args.entries * 1e6:.1f}us each)")
+
+    for label, make_query in [
+        ("near-duplicate hit", lambda: flip_bits(rng.choice(hashes), rng.randint(0, args.threshold), rng)),
+        ("miss", lambda: rng.getrandbits(64)),
+    ]:
+        queries = [f"{make_query():016x}" for _ in range(args.queries)]
+        samples, hits = [], 0
+        for query in queries:
+            start = time.perf_counter()
+            hits += cache.get(query, query, "Describe this image") is not None
+            samples.append(time.perf_counter() - start)
+        samples = np.array(samples) * 1000
+        print(f"{label}: p50={np.percentile(samples, 50):.3f}ms p99={np.percentile(samples, 99):.3f}ms hit rate={hits / len(queries):.2%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Benchmark: session restore time versus conversation length
+
+Compares rebuilding a chat history by re-parsing a JSON export (the
+"Export History" format) with restoring it from an incremental session
+snapshot, which decodes only the newest blocks. Also reports the snapshot's
+size on disk against the JSON export.
+
+Run from the repository root:
+
+    python benchmarks/bench_session_restore.py [--lengths 100,1000,10000,50000]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def make_history(length: int):
+    start = datetime(2025, 1, 1)
+    for i in range(length):
+        timestamp = start + timedelta(seconds=30 * i)
+        if i % 2 == 0:
+            yield {"type": "user", "content": f"Question {i}: how does feature {i % 37} work with the camera?", "timestamp": timestamp}
+        else:
+            yield {
+                "type": "bot",
+                "content": f"Feature {i % 37} works by combining several steps. " * 6,
+                "timestamp": timestamp,
+                "sources": {
+                    "timestamp": timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+                    "sources": [f"https://example.com/docs/{i % 37}"],
+                    "confidence": "High",
+                    "error": None,
+                    "real_time": True
+                }
+            }
+
+def restore_from_json(path: str, spill_path: str):
+    from session_manager import CompactChatHistory
+    history = CompactChatHistory(spill_path)
+    with open(path) as f:
+        for msg in json.load(f):
+            msg["timestamp"] = datetime.fromisoformat(msg["timestamp"])
+            history.append(msg)
+    return history
+
+def main():
+    from session_manager import CompactChatHistory
+    from session_snapshots import SnapshotStore
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lengths", default="100,1000,10000,50000", help="comma-separated message counts")
+    parser.add_argument("--codec", default="zstd")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    store = SnapshotStore(directory, codec=args.codec)
+    print(f"codec: {'zstd' if store.codec else 'zlib'}, block: {store.block_messages} messages, restore tail: {store.restore_tail}")
+
+    for length in (int(v) for v in args.lengths.split(",")):
+        snapshot_id = f"bench-session-{length:010d}"
+        history = CompactChatHistory(os.path.join(directory, f"{length}.spill"))
+        snapshot = store.open(snapshot_id, history)
+        json_path = os.path.join(directory, f"{length}.json")
+        messages = list(make_history(length))
+
+        # Save incrementally, one user/bot turn at a time, as the app does
+        start = time.perf_counter()
+        for i in range(0, length, 2):
+            for msg in messages[i:i + 2]:
+                history.append(msg)
+            snapshot.save()
+        save_ms = (time.perf_counter() - start) * 1000 / max(1, length // 2)
+        with open(json_path, "w") as f:
+            json.dump(list(history), f, default=lambda value: value.isoformat())
+
+        start = time.perf_counter()
+        restore_from_json(json_path, os.path.join(directory, f"{length}-json.spill"))
+        json_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        restored = CompactChatHistory(os.path.join(directory, f"{length}-snap.spill"))
+        store.open(snapshot_id, restored)
+        recent = restored[-store.restore_tail:]
+        snapshot_ms = (time.perf_counter() - start) * 1000
+        assert len(restored) == length and recent[-1]["content"] == messages[-1]["content"]
+
+        data_path, index_path = store.paths(snapshot_id)
+        snapshot_kb = (os.path.getsize(data_path) + os.path.getsize(index_path)) / 1024
+        print(
+            f"{length:>7} messages: json restore {json_ms:8.1f}ms, snapshot restore {snapshot_ms:6.2f}ms "
+            f"({json_ms / snapshot_ms:.0f}x); json {os.path.getsize(json_path) / 1024:8.0f} KB, "
+            f"snapshot {snapshot_kb:6.0f} KB; save per turn {save_ms:.2f}ms"
+        )
+
+if __name__ == "__main__":
+    main()
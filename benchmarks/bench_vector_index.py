@@ -0,0 +1,69 @@
+"""Benchmark batched index updates and top-k query latency at 100k vectors
+
+Run from the repository root:
+
+    python benchmarks/bench_vector_index.py [--vectors 100000] [--dim 256]
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vector_index import HashingEmbedder, VectorIndex
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q)) * 1000
+
+def time_queries(index, queries, k, nprobe=None):
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, k, nprobe=nprobe)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--batch", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=4)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((args.vectors, args.dim)).astype(np.float32)
+    payloads = [{"key": str(i)} for i in range(args.vectors)]
+
+    index = VectorIndex(args.dim)
+    start = time.perf_counter()
+    for i in range(0, args.vectors, args.batch):
+        index.add_batch(data[i:i + args.batch], payloads[i:i + args.batch])
+    elapsed = time.perf_counter() - start
+    print(f"add_batch: {args.vectors} vectors in {elapsed:.3f}s ({args.vectors / elapsed:,.0f} vectors/s)")
+
+    embedder = HashingEmbedder(args.dim)
+    texts = [f"past conversation message number {i} about topic {i % 97}" for i in range(args.batch)]
+    start = time.perf_counter()
+    embedder.embed_batch(texts)
+    elapsed = time.perf_counter() - start
+    print(f"embed_batch: {len(texts)} texts in {elapsed * 1000:.1f}ms")
+
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    time_queries(index, queries[:10], args.k)
+
+    brute = time_queries(index, queries, args.k)
+    print(f"brute force k={args.k}: p50={percentile_ms(brute, 50):.2f}ms p99={percentile_ms(brute, 99):.2f}ms")
+
+    start = time.perf_counter()
+    index.build_ivf(n_lists=256)
+    print(f"build_ivf: {time.perf_counter() - start:.2f}s")
+
+    approx = time_queries(index, queries, args.k, nprobe=8)
+    print(f"ivf nprobe=8 k={args.k}: p50={percentile_ms(approx, 50):.2f}ms p99={percentile_ms(approx, 99):.2f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Benchmark: record-stop to first-audio latency of the voice reply paths
+
+Compares the sequential path (whole reply, then speech for the whole reply),
+the speculative path (speech for the first sentence starts while the rest
+is still streaming) and a prefetched follow-up. The model streams words at
+a fixed rate after a time-to-first-token delay and speech synthesis costs a
+fixed overhead plus a per-character time, roughly like gTTS over a network.
+
+Run from the repository root:
+
+    python benchmarks/bench_voice_latency.py [--turns 5] [--ttft 0.4] [--word-ms 30]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+REPLY = (
+    "Voice replies are spoken one sentence at a time. "
+    "The first sentence can be synthesized while the model is still writing the rest, "
+    "so the user hears an answer much sooner. Later sentences are synthesized as one clip "
+    "and queued behind the first, which keeps playback continuous without waiting for the "
+    "whole reply. Follow-up questions that are likely to come next are answered in the "
+    "background at the lowest priority, so asking one of them plays audio almost at once."
+)
+
+class StreamingModel:
+    """Stands in for AIService with a model that streams at a fixed word rate"""
+
+    def __init__(self, ttft: float, word_seconds: float):
+        self.ttft = ttft
+        self.word_seconds = word_seconds
+
+    async def stream_ai_response(self, prompt, conversation_history=None, **kwargs):
+        await asyncio.sleep(self.ttft)
+        words = REPLY.split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(self.word_seconds)
+            yield {"delta": word if i == 0 else " " + word}
+        yield {"done": True, "response": REPLY, "sources": {"sources": []}}
+
+    async def get_ai_response(self, prompt, conversation_history=None, **kwargs):
+        await asyncio.sleep(self.ttft + self.word_seconds * len(REPLY.split(" ")))
+        return REPLY, {"sources": []}
+
+    async def process_voice_query(self, text, conversation_history=None, **kwargs):
+        return await self.get_ai_response(f"[Voice Query] {text}", conversation_history)
+
+def fake_tts(text: str) -> bytes:
+    time.sleep(0.2 + 0.004 * len(text))
+    return b"\x00" * len(text)
+
+async def first_audio(events) -> float:
+    async for event in events:
+        if event.get("done"):
+            return event["timings"]["first_audio"]
+
+def main():
+    from speculative import SpeculativeVoicePipeline
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--ttft", type=float, default=0.4, help="model time to first token, seconds")
+    parser.add_argument("--word-ms", type=float, default=30, help="model time per streamed word, ms")
+    args = parser.parse_args()
+
+    pipeline = SpeculativeVoicePipeline(
+        service=StreamingModel(args.ttft, args.word_ms / 1000),
+        synthesize=fake_tts,
+        follow_ups=["Tell me more"]
+    )
+    history = [{"type": "user", "content": "How do voice replies work?"}]
+    results = {"sequential": [], "speculative": [], "prefetched": []}
+
+    for turn in range(args.turns):
+        user_id = f"bench-{turn}"
+        results["sequential"].append(asyncio.run(first_audio(pipeline.respond_sequential("How do voice replies work?", history, user_id))))
+        results["speculative"].append(asyncio.run(first_audio(pipeline.respond("How do voice replies work?", history, user_id))))
+
+        pipeline.prefetch_follow_ups(user_id, history)
+        # Give the background answer time to finish, as a user listening to the reply would
+        time.sleep(args.ttft + args.word_ms / 1000 * len(REPLY.split(" ")) + 0.2 + 0.004 * len(REPLY) + 0.2)
+        results["prefetched"].append(asyncio.run(first_audio(pipeline.respond("Tell me more", history, user_id))))
+
+    baseline = sorted(results["sequential"])[len(results["sequential"]) // 2]
+    print(f"reply: {len(REPLY)} chars, {len(REPLY.split(' '))} words; ttft {args.ttft}s, {args.word_ms:.0f}ms/word")
+    for mode, samples in results.items():
+        median = max(sorted(samples)[len(samples) // 2], 0.001)
+        print(f"{mode:>12}: first audio p50 {median * 1000:.0f}ms ({baseline / median:.1f}x faster than sequential)")
+    print(f"prefetch stats: {pipeline.get_stats()}")
+
+if __name__ == "__main__":
+    main()
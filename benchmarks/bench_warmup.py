@@ -0,0 +1,111 @@
+"""Benchmark: first-request latency in a fresh process, with and without warm-up
+
+Each mode runs in its own new Python process, as after a deploy. The
+"first request" is one voice turn (WAV decode in the media pool, then
+process_voice_query) followed by one photo upload (prepare_image in the
+media pool, local analysis, then the model call). A second turn with a
+different question and photo does the same work again, without hitting
+any cache. The gap between the first and the second turn is the cold-start
+penalty the first user pays.
+
+Without an OpenAI key the model call is the simulated backend, which sleeps
+a fixed 1s in both modes; set OPENAI_API_KEY to include the upstream TLS
+handshake.
+
+Run from the repository root:
+
+    python benchmarks/bench_warmup.py [--runs 3]
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def make_photo(seed: int) -> bytes:
+    import numpy as np
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.fromarray(np.random.default_rng(seed).integers(0, 255, (900, 1200, 3), dtype=np.uint8)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def user_turn(ai_service, media_pool, decode_wav, wav: bytes, photo: bytes, question: str) -> float:
+    import asyncio
+    start = time.perf_counter()
+    media_pool.run(decode_wav, wav)
+    asyncio.run(ai_service.process_voice_query(question, user_id="bench"))
+    result = asyncio.run(ai_service.analyze_image_bytes("photo.png", photo, question, max_retries=0, user_id="bench"))
+    assert not result["error"], result["error"]
+    return time.perf_counter() - start
+
+def child(mode: str):
+    """Measure one fresh process and print the timings as JSON"""
+
+    started = time.perf_counter()
+    from ai_service import ai_service
+    from media_workers import media_pool, decode_wav
+    from warmup import warmup, _silent_wav
+    import_seconds = time.perf_counter() - started
+
+    wav = _silent_wav(1.0)
+    photos = [make_photo(0), make_photo(1)]
+
+    warmup_seconds = None
+    if mode == "warm":
+        warmup.start(ai_service)
+        warmup.wait()
+        warmup_seconds = warmup.ready_seconds
+
+    first = user_turn(ai_service, media_pool, decode_wav, wav, photos[0], "What is in this photo?")
+    second = user_turn(ai_service, media_pool, decode_wav, wav, photos[1], "Describe the colors here")
+    media_pool.shutdown()
+    print(json.dumps({"import": import_seconds, "warmup": warmup_seconds, "first": first, "second": second}))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--child", choices=["cold", "warm"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    env = dict(
+        os.environ,
+        SHARED_STATE_PATH="",
+        WARMUP_HOT_SET_PATH=os.path.join(tempfile.mkdtemp(), "hot_set.json"),
+        TRACING_ENABLED="false",
+        PYTHONPATH=ROOT
+    )
+    results = {"cold": [], "warm": []}
+    for _ in range(args.runs):
+        for mode in ("cold", "warm"):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", mode],
+                env=env, cwd=ROOT, capture_output=True, text=True, check=True
+            ).stdout
+            results[mode].append(json.loads(output.strip().splitlines()[-1]))
+
+    def median(values):
+        values = sorted(values)
+        return values[len(values) // 2]
+
+    for mode, runs in results.items():
+        first = median([run["first"] for run in runs])
+        second = median([run["second"] for run in runs])
+        warmup = median([run["warmup"] for run in runs]) if mode == "warm" else None
+        print(
+            f"{mode:>4}: first turn {first * 1000:7.0f}ms, second turn {second * 1000:7.0f}ms, "
+            f"cold-start penalty {(first - second) * 1000:6.0f}ms"
+            + (f" (warm-up took {warmup * 1000:.0f}ms in the background)" if warmup is not None else "")
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Load test: throughput of the CPU-bound request path as worker processes are added
+
+Each worker process plays one Streamlit worker: it takes requests from a
+shared queue and, for each one, checks the shared rate limiter, looks up
+the shared response cache, decodes and downscales an uploaded photo, runs
+local image analysis and records its latency in the shared metrics, all
+through the same SQLite store the real workers use.
+
+Run from the repository root:
+
+    python benchmarks/load_test_workers.py [--workers 1,2,4] [--requests 200]
+
+Throughput only scales up to the number of CPU cores on the machine.
+"""
+import argparse
+import io
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def make_photo(width: int, height: int) -> bytes:
+    from PIL import Image
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    pixels = np.clip(gradient + rng.normal(0, 30, (height, width, 3)), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+def worker(db_path: str, photo: bytes, jobs, results):
+    from PIL import Image
+    from image_analysis import LocalImageAnalyzer
+    from shared_state import SharedState, SharedResponseCache
+    from media_workers import prepare_image
+
+    state = SharedState(db_path)
+    analyzer = LocalImageAnalyzer()
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        start = time.perf_counter()
+        allowed = state.rate_limiter.check(f"client-{job % 50}", 1_000_000, 3600)
+        key = SharedResponseCache.make_key(f"question {job % 20}")
+        if state.cache.get(key) is None:
+            state.cache.put(key, "answer", {"sources": []})
+        prepared = prepare_image(photo)
+        analyzer.analyze(Image.open(io.BytesIO(prepared)))
+        elapsed = time.perf_counter() - start
+        state.metrics.record("load_test_seconds", elapsed)
+        results.put((allowed, elapsed))
+
+def run(workers: int, requests: int, photo: bytes) -> dict:
+    db_path = os.path.join(tempfile.mkdtemp(), "shared.db")
+    ctx = mp.get_context("spawn")
+    jobs, results = ctx.Queue(), ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(db_path, photo, jobs, results)) for _ in range(workers)]
+    for proc in procs:
+        proc.start()
+
+    # Warm-up: one request per worker so imports and schema creation are not timed
+    for i in range(workers):
+        jobs.put(i)
+    for _ in range(workers):
+        results.get()
+
+    start = time.perf_counter()
+    for i in range(requests):
+        jobs.put(i)
+    latencies = sorted(results.get()[1] for _ in range(requests))
+    wall = time.perf_counter() - start
+
+    for _ in procs:
+        jobs.put(None)
+    for proc in procs:
+        proc.join()
+
+    from shared_state import SharedState
+    summary = SharedState(db_path).metrics.summary()
+    return {
+        "throughput": requests / wall,
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[int(len(latencies) * 0.95)],
+        "workers_reporting": len(summary["workers"])
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--size", default="3000x2000", help="uploaded photo size")
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.split("x"))
+    photo = make_photo(width, height)
+    print(f"cpu cores: {os.cpu_count()}, photo: {width}x{height} ({len(photo) // 1024} KB), requests: {args.requests}")
+
+    baseline = None
+    for count in (int(v) for v in args.workers.split(",")):
+        result = run(count, args.requests, photo)
+        baseline = baseline or result["throughput"]
+        print(
+            f"workers={count}: {result['throughput']:.1f} req/s ({result['throughput'] / baseline:.2f}x), "
+            f"p50 {result['p50'] * 1000:.1f}ms, p95 {result['p95'] * 1000:.1f}ms, "
+            f"{result['workers_reporting']} workers in shared metrics"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""Content-addressed on-disk store for images and audio attached to chat messages
+
+Blobs are keyed by the SHA-256 of their bytes, so a photo or clip is stored
+once however many messages reference it. Chat history entries keep only an
+``attachments`` list of small records carrying the key; the bytes live under
+BLOB_STORE_DIR as ``<key[:2]>/<key>``, written atomically, so every worker
+process can share the directory.
+
+Reads map the file instead of copying it into the heap: ``view`` yields a
+read-only memoryview of the mapping and ``open_image`` lets PIL decode
+straight from it. Images also get a JPEG thumbnail no larger than
+BLOB_THUMBNAIL_SIZE, made in the media pool and kept under ``thumbs/``, so
+the History tab never decodes a full photo.
+
+File mtimes are the LRU clock: each read touches the blob, and when a put
+takes the store past BLOB_STORE_MAX_BYTES (blobs and thumbnails together)
+the least recently used blobs and their thumbnails are deleted. Eviction
+works from the in-memory index, which is rebuilt from disk at most every
+RESCAN_SECONDS to pick up other workers' writes. A message whose blob was
+evicted keeps its text and shows the attachment as missing.
+
+The directory holds users' photos and recordings, so it is private: created
+0700 (files 0600), and refused if another user owns it or can write to it.
+"""
+import hashlib
+import logging
+import mmap
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, Optional, Tuple
+from PIL import Image
+from config import Config
+from media_workers import media_pool, prepare_image
+from session_manager import private_directory
+
+logger = logging.getLogger(__name__)
+
+_KEY = re.compile(r"^[0-9a-f]{64}$")
+
+class BlobStore:
+    """SHA-256 keyed files with LRU eviction and a thumbnail tier for images"""
+
+    RESCAN_SECONDS = 60.0
+
+    def __init__(self,
+                 directory: str = None,
+                 max_bytes: int = None,
+                 thumbnail_size: Tuple[int, int] = None):
+        self.directory = directory or Config.BLOB_STORE_DIR
+        private_directory(self.directory)
+        self.max_bytes = max_bytes or Config.BLOB_STORE_MAX_BYTES
+        self.thumbnail_size = tuple(thumbnail_size or Config.BLOB_THUMBNAIL_SIZE)
+        self._sizes: "OrderedDict[str, int]" = OrderedDict()  # blob plus thumbnail bytes, least recently used first
+        self._total = 0
+        self._scanned_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self.stats = {"puts": 0, "deduplicated": 0, "hits": 0, "misses": 0, "evictions": 0, "thumbnails": 0}
+
+    @staticmethod
+    def valid_key(key: Any) -> bool:
+        return isinstance(key, str) and bool(_KEY.match(key))
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def thumbnail_path(self, key: str) -> str:
+        return os.path.join(self.directory, "thumbs", key[:2], f"{key}.jpg")
+
+    def put(self, data: bytes, thumbnail: bool = False) -> str:
+        """Store data and return its key; storing the same bytes again only marks them used
+
+        With thumbnail=True, data must be an image and a thumbnail is made
+        if there is none yet. A thumbnail that cannot be made is logged and
+        skipped; ``thumbnail`` retries on the next read.
+        """
+
+        key = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self._ensure_scanned()
+            self.stats["puts"] += 1
+            if self._touch(key):
+                self.stats["deduplicated"] += 1
+            else:
+                _write_atomic(self.path(key), data)
+                self._sizes[key] = len(data)
+                self._total += len(data)
+                if self._total > self.max_bytes:
+                    self._evict(keep=key)
+        if thumbnail and not os.path.exists(self.thumbnail_path(key)):
+            self._make_thumbnail(key, data)
+        return key
+
+    def attach(self, data: bytes, kind: str, mime: str, name: str = None) -> Dict[str, Any]:
+        """Store data and return the attachment record a chat entry keeps"""
+
+        return {
+            "sha256": self.put(data, thumbnail=kind == "image"),
+            "kind": kind,
+            "mime": mime,
+            "name": name,
+            "size": len(data)
+        }
+
+    def __contains__(self, key: Any) -> bool:
+        return self.valid_key(key) and os.path.exists(self.path(key))
+
+    @contextmanager
+    def _mapped(self, key: str) -> Iterator[Optional[mmap.mmap]]:
+        """Map a blob read-only for the block (None for an empty blob); KeyError if it is not stored"""
+
+        try:
+            if not self.valid_key(key):
+                raise FileNotFoundError(key)
+            with open(self.path(key), "rb") as f:
+                # The mapping outlives the descriptor, and an eviction meanwhile only unlinks the name
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else None
+        except FileNotFoundError:
+            with self._lock:
+                self.stats["misses"] += 1
+                self._forget(key)
+            raise KeyError(key) from None
+        with self._lock:
+            self.stats["hits"] += 1
+            self._touch(key)
+        try:
+            yield mapping
+        finally:
+            if mapping is not None:
+                mapping.close()
+
+    @contextmanager
+    def view(self, key: str) -> Iterator[memoryview]:
+        """Zero-copy read-only view of a blob, valid only inside the block; KeyError if it is not stored"""
+
+        with self._mapped(key) as mapping:
+            view = memoryview(mapping) if mapping is not None else memoryview(b"")
+            try:
+                yield view
+            finally:
+                view.release()
+
+    def read(self, key: str) -> bytes:
+        """A private copy of a blob's bytes, for consumers that keep them (e.g. st.audio)"""
+
+        with self.view(key) as view:
+            return view.tobytes()
+
+    def open_image(self, key: str, max_size: Tuple[int, int] = None) -> Image.Image:
+        """Decode an image blob straight from its mapping, fitting it within max_size if given"""
+
+        with self._mapped(key) as mapping:
+            if mapping is None:
+                raise ValueError(f"blob {key} is empty")
+            image = Image.open(mapping)
+            if max_size:
+                # JPEGs decode at a reduced DCT scale instead of full size
+                image.draft("RGB", max_size)
+            image.load()
+        if max_size and (image.width > max_size[0] or image.height > max_size[1]):
+            image.thumbnail(max_size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+        return image
+
+    def thumbnail(self, key: str) -> Optional[bytes]:
+        """JPEG thumbnail of an image blob, made now if missing; None once the blob is gone"""
+
+        try:
+            with open(self.thumbnail_path(key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            try:
+                with self.view(key) as view:
+                    source = view.tobytes()
+            except KeyError:
+                return None
+            return self._make_thumbnail(key, source)
+
+        with self._lock:
+            self._touch(key)
+        return data
+
+    def _make_thumbnail(self, key: str, data: bytes) -> Optional[bytes]:
+        try:
+            thumbnail = media_pool.run(prepare_image, data, self.thumbnail_size)
+            _write_atomic(self.thumbnail_path(key), thumbnail)
+        except Exception as e:
+            logger.warning("could not make a thumbnail for blob %s: %s", key, e)
+            return None
+        with self._lock:
+            self.stats["thumbnails"] += 1
+            if key in self._sizes:
+                self._sizes[key] += len(thumbnail)
+                self._total += len(thumbnail)
+        return thumbnail
+
+    def _ensure_scanned(self):
+        if self._scanned_at is None:
+            self._scan()
+
+    def _scan(self):
+        """Rebuild the LRU index from the files on disk, oldest mtime first (lock held)"""
+
+        blobs, thumbnails = {}, {}
+        for directory, found in ((self.directory, blobs), (os.path.join(self.directory, "thumbs"), thumbnails)):
+            try:
+                prefixes = [entry.path for entry in os.scandir(directory) if len(entry.name) == 2 and entry.is_dir()]
+            except FileNotFoundError:
+                prefixes = []
+            for prefix in prefixes:
+                for entry in os.scandir(prefix):
+                    key = entry.name[:-4] if found is thumbnails and entry.name.endswith(".jpg") else entry.name
+                    if not _KEY.match(key):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    found[key] = (stat.st_mtime, stat.st_size)
+        # A thumbnail whose blob is gone still takes space; it ages out with its own mtime
+        entries = sorted(
+            (blobs.get(key, thumbnails.get(key))[0], key,
+             blobs.get(key, (0, 0))[1] + thumbnails.get(key, (0, 0))[1])
+            for key in blobs.keys() | thumbnails.keys()
+        )
+        self._sizes = OrderedDict((key, size) for _, key, size in entries)
+        self._total = sum(self._sizes.values())
+        self._scanned_at = time.monotonic()
+
+    def _touch(self, key: str) -> bool:
+        """Mark a blob most recently used; False if it is not on disk (lock held)"""
+
+        path = self.path(key)
+        try:
+            os.utime(path)
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            self._forget(key)
+            return False
+        if key in self._sizes:
+            self._sizes.move_to_end(key)
+        else:
+            # Written by another worker since the last scan
+            try:
+                size += os.path.getsize(self.thumbnail_path(key))
+            except FileNotFoundError:
+                pass
+            self._sizes[key] = size
+            self._total += size
+        return True
+
+    def _forget(self, key: str):
+        size = self._sizes.pop(key, None)
+        if size is not None:
+            self._total -= size
+
+    def _evict(self, keep: str):
+        """Delete least recently used blobs until the store fits (lock held)"""
+
+        # Other workers write and evict in the same directory; catch up with them now and then,
+        # not on every put, since a scan lists every file in the store
+        if time.monotonic() - self._scanned_at > self.RESCAN_SECONDS:
+            self._scan()
+        for key in list(self._sizes):
+            if self._total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            for path in (self.path(key), self.thumbnail_path(key)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self._forget(key)
+            self.stats["evictions"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Blob count, bytes used against the cap, and hit/dedup/eviction counters"""
+
+        with self._lock:
+            self._ensure_scanned()
+            return {
+                "directory": self.directory,
+                "blobs": len(self._sizes),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                **self.stats
+            }
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+def _create_store() -> Optional[BlobStore]:
+    try:
+        return BlobStore()
+    except PermissionError as e:
+        logger.error("attachment store disabled: %s; set BLOB_STORE_DIR to a private directory", e)
+        return None
+
+# Global blob store shared by every session in the process; None when disabled or the directory is unsafe
+blob_store = _create_store() if Config.BLOB_STORE_ENABLED else None
@@ -0,0 +1,195 @@
+import threading
+import time
+import weakref
+from typing import Dict, List, Any, Optional, Tuple
+import cv2
+import numpy as np
+from config import Config
+
+def media_constraints(width: int, height: int, fps: int) -> Dict[str, Any]:
+    """getUserMedia constraints capping the browser's capture size and rate"""
+
+    return {
+        "video": {
+            "width": {"ideal": width, "max": width},
+            "height": {"ideal": height, "max": height},
+            "frameRate": {"ideal": fps, "max": fps}
+        },
+        "audio": False
+    }
+
+class AdaptiveStream:
+    """Per-stream frame dropping, downscaling and quality stepping
+
+    Each stream starts at the configured camera level of the ladder. Frames
+    arriving faster than the level's fps are dropped, and larger frames are
+    downscaled to the level's size before any processing. Every
+    ``adjust_interval`` seconds the stream's processing cost (CPU seconds per
+    second of video) is compared with the budget the governor grants it: the
+    level steps down when over budget and back up when well under it.
+    """
+
+    def __init__(self, governor: "CaptureGovernor", level: int):
+        self.governor = governor
+        self.level = level
+        self.frames_in = 0
+        self.frames_processed = 0
+        self.frames_dropped = 0
+        self.frames_downscaled = 0
+        self.level_changes = 0
+        self._frame_seconds = 0.0  # EWMA of processing time per frame
+        self._window_start = time.monotonic()
+        self._window_busy = 0.0
+        self._window_processed = 0
+        self._window_in = 0
+        self.cost = 0.0
+        self.input_fps = 0.0
+        self.output_fps = 0.0
+        self._next_due = 0.0
+        self.last_seen = time.monotonic()
+
+    @property
+    def target(self) -> Tuple[int, int, int]:
+        return self.governor.ladder[self.level]
+
+    def admit(self) -> bool:
+        """Whether to process the next frame; False means drop it"""
+
+        now = time.monotonic()
+        self.last_seen = now
+        self.frames_in += 1
+        self._window_in += 1
+        if now < self._next_due:
+            self.frames_dropped += 1
+            return False
+        # Pace to the level's fps, without accumulating credit while idle
+        self._next_due = max(self._next_due + 1.0 / self.target[2], now - 0.5 / self.target[2])
+        return True
+
+    def fit(self, img: np.ndarray) -> np.ndarray:
+        """Downscale a frame to the current level's size if it is larger"""
+
+        width, height, _ = self.target
+        h, w = img.shape[:2]
+        if w <= width and h <= height:
+            return img
+        scale = min(width / w, height / h)
+        self.frames_downscaled += 1
+        return cv2.resize(img, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+
+    def record(self, seconds: float):
+        """Account one processed frame and re-evaluate the level when the window closes"""
+
+        self.frames_processed += 1
+        self._window_processed += 1
+        self._window_busy += seconds
+        self._frame_seconds = seconds if self.frames_processed == 1 else 0.8 * self._frame_seconds + 0.2 * seconds
+
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed >= self.governor.adjust_interval:
+            self.cost = self._window_busy / elapsed
+            self.input_fps = self._window_in / elapsed
+            self.output_fps = self._window_processed / elapsed
+            self._window_start, self._window_busy, self._window_processed, self._window_in = now, 0.0, 0, 0
+            self._adjust()
+
+    def _adjust(self):
+        budget = self.governor.stream_budget()
+        if self.cost > budget and self.level < len(self.governor.ladder) - 1:
+            self.level += 1
+            self.level_changes += 1
+        elif self.cost < budget * 0.5 and self.level > self.governor.start_level:
+            # Cost scales roughly with pixels x fps; only step up if the next level up still fits
+            width, height, fps = self.target
+            up_width, up_height, up_fps = self.governor.ladder[self.level - 1]
+            projected = self._frame_seconds * (up_width * up_height) / (width * height) * up_fps
+            if projected < budget * 0.8:
+                self.level -= 1
+                self.level_changes += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        width, height, fps = self.target
+        return {
+            "level": f"{width}x{height}@{fps}",
+            "input_fps": round(self.input_fps, 1),
+            "output_fps": round(self.output_fps, 1),
+            "frame_ms": round(self._frame_seconds * 1000, 2),
+            "cpu_cost": round(self.cost, 3),
+            "dropped": self.frames_dropped,
+            "downscaled": self.frames_downscaled,
+            "level_changes": self.level_changes
+        }
+
+class CaptureGovernor:
+    """Shares a CPU budget across all live camera streams in the process
+
+    Each stream may use ``stream_budget`` CPU seconds per second of video:
+    the per-stream budget, or an equal share of the total budget when many
+    streams are open. Streams unregister when they end, or are forgotten
+    once no frame has arrived for ``idle_timeout`` seconds.
+    """
+
+    def __init__(self,
+                 ladder: List[Tuple[int, int, int]] = None,
+                 stream_budget: float = None,
+                 total_budget: float = None,
+                 adjust_interval: float = 2.0,
+                 idle_timeout: float = 10.0):
+        self.ladder = [tuple(level) for level in (ladder or Config.CAMERA_LADDER)]
+        self.per_stream_budget = stream_budget or Config.CAMERA_CPU_BUDGET
+        self.total_budget = total_budget or Config.CAMERA_TOTAL_CPU_BUDGET
+        self.adjust_interval = adjust_interval
+        self.idle_timeout = idle_timeout
+        self.start_level = self._level_for(Config.CAMERA_WIDTH, Config.CAMERA_HEIGHT, Config.CAMERA_FPS)
+        self._streams: "weakref.WeakSet[AdaptiveStream]" = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self.stats = {"streams_opened": 0}
+
+    def _level_for(self, width: int, height: int, fps: int) -> int:
+        """Highest-quality ladder level that does not exceed the configured camera settings"""
+
+        for index, (w, h, f) in enumerate(self.ladder):
+            if w <= width and h <= height and f <= fps:
+                return index
+        return len(self.ladder) - 1
+
+    def constraints(self, level: Optional[int] = None) -> Dict[str, Any]:
+        """Capture constraints for a new stream, at the start level unless given"""
+
+        return media_constraints(*self.ladder[self.start_level if level is None else level])
+
+    def open_stream(self, level: Optional[int] = None) -> AdaptiveStream:
+        stream = AdaptiveStream(self, self.start_level if level is None else max(level, self.start_level))
+        with self._lock:
+            self._streams.add(stream)
+            self.stats["streams_opened"] += 1
+        return stream
+
+    def close_stream(self, stream: AdaptiveStream):
+        with self._lock:
+            self._streams.discard(stream)
+
+    def active_streams(self) -> List[AdaptiveStream]:
+        now = time.monotonic()
+        with self._lock:
+            return [s for s in self._streams if now - s.last_seen < self.idle_timeout]
+
+    def stream_budget(self) -> float:
+        return min(self.per_stream_budget, self.total_budget / max(1, len(self.active_streams())))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Live stream count, total processing cost and per-stream detail"""
+
+        streams = self.active_streams()
+        return {
+            "streams": len(streams),
+            "cpu_cost": round(sum(s.cost for s in streams), 3),
+            "stream_budget": round(self.stream_budget(), 3),
+            "total_budget": self.total_budget,
+            "per_stream": [s.get_stats() for s in streams],
+            **self.stats
+        }
+
+# Global governor shared by every camera stream in the process
+capture_governor = CaptureGovernor()
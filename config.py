@@ -1,4 +1,5 @@
 import os
+import tempfile
 from typing import Dict, Any
 
 class Config:
@@ -17,17 +18,49 @@ class Config:
     SPEECH_RECOGNITION_LANGUAGE = "en-US"
     TTS_LANGUAGE = "en"
     TTS_SLOW = False
+    SPECULATIVE_VOICE = os.getenv("SPECULATIVE_VOICE", "true").lower() == "true"
+    SPECULATIVE_MIN_SENTENCE_CHARS = 20  # shortest first sentence spoken before the rest of the reply
+    # Off by default: each voice reply would cost one extra completion and TTS call per follow-up
+    SPECULATIVE_PREFETCH = os.getenv("SPECULATIVE_PREFETCH", "false").lower() == "true"
+    SPECULATIVE_PREFETCH_SESSIONS = 200  # sessions with pre-warmed follow-ups kept
+    # Likely next voice requests, offered as buttons and pre-warmed (answer and audio) when SPECULATIVE_PREFETCH is on
+    VOICE_FOLLOW_UPS = ["Tell me more", "Can you summarize that?", "Give me an example"]
     
     # Camera Configuration
     CAMERA_WIDTH = 640
     CAMERA_HEIGHT = 480
     CAMERA_FPS = 30
+    CAMERA_ADAPTIVE = os.getenv("CAMERA_ADAPTIVE", "true").lower() == "true"  # drop/downscale frames to hold the CPU budget
+    CAMERA_CPU_BUDGET = float(os.getenv("CAMERA_CPU_BUDGET", "0.15"))  # CPU seconds per second each stream may use
+    CAMERA_TOTAL_CPU_BUDGET = float(os.getenv("CAMERA_TOTAL_CPU_BUDGET", str((os.cpu_count() or 1) * 0.5)))  # shared by all streams
+    CAMERA_LADDER = [  # (width, height, fps), best first; streams step along it under load
+        (1280, 720, 30), (960, 540, 30), (640, 480, 30), (640, 480, 15), (480, 360, 15), (320, 240, 10)
+    ]
     
     # App Configuration
     APP_TITLE = "AI ChatBot Pro"
     APP_ICON = "🤖"
     MAX_CHAT_HISTORY = 100
     SESSION_TIMEOUT = 3600  # 1 hour in seconds
+    SESSION_MEMORY_LIMIT = int(os.getenv("SESSION_MEMORY_LIMIT", str(2 * 1024 * 1024)))  # bytes of chat history kept in RAM per session
+    GLOBAL_SESSION_MEMORY_LIMIT = int(os.getenv("GLOBAL_SESSION_MEMORY_LIMIT", str(256 * 1024 * 1024)))
+    SESSION_SPILL_DIR = os.getenv("SESSION_SPILL_DIR", os.path.join(tempfile.gettempdir(), "ai_chatbot_sessions"))
+    CONTEXT_WINDOW_MESSAGES = 20  # recent messages sent to the AI backend with each request
+    CHAT_RENDER_MESSAGES = 50  # newest messages drawn in the Chat tab; older ones are paged in the History tab
+    HISTORY_PAGE_MESSAGES = 25  # messages per History tab page
+    SESSION_SNAPSHOTS = os.getenv("SESSION_SNAPSHOTS", "true").lower() == "true"  # restore chat history on reload
+    SESSION_SNAPSHOT_DIR = os.getenv("SESSION_SNAPSHOT_DIR", os.path.join(tempfile.gettempdir(), "ai_chatbot_snapshots"))
+    SESSION_SNAPSHOT_CODEC = os.getenv("SESSION_SNAPSHOT_CODEC", "zstd")  # zstd (needs zstandard) or zlib
+    SESSION_SNAPSHOT_BLOCK_MESSAGES = 32  # messages per compressed block
+    SESSION_RESTORE_TAIL = CONTEXT_WINDOW_MESSAGES  # newest messages decoded on restore; older blocks load on demand
+    SESSION_SNAPSHOT_MAX_AGE = float(os.getenv("SESSION_SNAPSHOT_MAX_AGE", str(30 * 24 * 3600)))  # seconds since the last save before a snapshot is pruned
+    PERFORMANCE_METRICS_MAX = 500  # per-session response time samples kept
+    
+    # Content-addressed store for images and audio attached to chat messages (see blob_store.py)
+    BLOB_STORE_ENABLED = os.getenv("BLOB_STORE_ENABLED", "true").lower() == "true"
+    BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", os.path.join(tempfile.gettempdir(), "ai_chatbot_blobs"))
+    BLOB_STORE_MAX_BYTES = int(os.getenv("BLOB_STORE_MAX_BYTES", str(1024 * 1024 * 1024)))  # least recently used blobs go first
+    BLOB_THUMBNAIL_SIZE = (256, 256)
     
     # UI Configuration
     PRIMARY_COLOR = "#667eea"
@@ -37,7 +70,145 @@ class Config:
     # File Upload Configuration
     MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
     ALLOWED_IMAGE_TYPES = ["png", "jpg", "jpeg", "gif", "bmp", "webp"]
+    MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(50_000_000)))  # checked from the header before decoding
+    MODEL_IMAGE_SIZE = (1024, 1024)  # bounding box of the copy sent to the vision model
+    DISPLAY_IMAGE_SIZE = (800, 600)  # bounding box of the on-screen thumbnail
+    IMAGE_MEMORY_BUDGET = int(os.getenv("IMAGE_MEMORY_BUDGET", str(256 * 1024 * 1024)))  # bytes of in-flight decodes per process
+    IMAGE_BUDGET_TIMEOUT = 10.0  # seconds to wait for budget before rejecting
+    IMAGE_PIPELINE_CACHE_ENTRIES = 32
+    
+    # Local Image Pre-analysis Configuration
+    LOCAL_IMAGE_ANALYSIS = os.getenv("LOCAL_IMAGE_ANALYSIS", "true").lower() == "true"
+    LOCAL_ANALYSIS_SIZE = 512  # longest side analyzed, in pixels
+    LOCAL_SHORT_CIRCUIT = os.getenv("LOCAL_SHORT_CIRCUIT", "true").lower() == "true"
+    LOCAL_BLUR_THRESHOLD = 100.0  # Laplacian variance below this counts as blurry
+    
+    # Near-duplicate Image Result Cache Configuration
+    IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "true").lower() == "true"
+    IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "100000"))
+    IMAGE_CACHE_TTL = int(os.getenv("IMAGE_CACHE_TTL", "86400"))  # seconds
+    IMAGE_CACHE_PHASH_THRESHOLD = int(os.getenv("IMAGE_CACHE_PHASH_THRESHOLD", "6"))  # max differing bits of 64
+    IMAGE_CACHE_DHASH_THRESHOLD = int(os.getenv("IMAGE_CACHE_DHASH_THRESHOLD", "10"))
+    
+    # Batch Image Analysis Configuration
+    BATCH_MAX_IMAGES = 50
+    BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+    BATCH_MAX_RETRIES = 2
+    BATCH_RATE_LIMIT_REQUESTS = int(os.getenv("BATCH_RATE_LIMIT_REQUESTS", "0"))  # batch_cli.py throttle; 0 leaves pacing to the scheduler
+    BATCH_RATE_LIMIT_WINDOW_MINUTES = float(os.getenv("BATCH_RATE_LIMIT_WINDOW_MINUTES", "1"))
+    BATCH_MODEL_IMAGE_SIZE = MODEL_IMAGE_SIZE
+    
+    # Media Worker Pool Configuration (JPEG encoding, watermarking, frame and audio decoding)
+    MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", "2"))  # 0 runs media tasks inline
+    MEDIA_QUEUE_SIZE = int(os.getenv("MEDIA_QUEUE_SIZE", "32"))  # tasks waiting beyond the running ones
+    MEDIA_QUEUE_TIMEOUT = 10.0  # seconds to wait for a queue slot before rejecting
+    MEDIA_SHM_THRESHOLD = 256 * 1024  # buffers at least this large move through shared memory
+    
+    # Model Routing Configuration
+    # Routes are tried in order; the first whose limits fit the request wins
+    MODEL_ROUTES = [
+        {"name": "vision", "model": OPENAI_MODEL, "modalities": ["image"], "max_tokens": 1000},
+        {"name": "fast", "model": os.getenv("FAST_MODEL", "gpt-3.5-turbo"), "modalities": ["text", "voice"],
+         "max_prompt_chars": 300, "max_history": 2, "max_tokens": 400},
+        {"name": "voice", "model": os.getenv("FAST_MODEL", "gpt-3.5-turbo"), "modalities": ["voice"], "max_tokens": 500},
+        {"name": "standard", "model": os.getenv("TEXT_MODEL", "gpt-4"), "modalities": ["text"], "max_tokens": 1000},
+    ]
+    # Faster substitute used when a model's measured p95 latency breaks the SLO
+    MODEL_FALLBACKS = {
+        os.getenv("TEXT_MODEL", "gpt-4"): os.getenv("FAST_MODEL", "gpt-3.5-turbo"),
+    }
+    ROUTING_LATENCY_SLO = float(os.getenv("ROUTING_LATENCY_SLO", "10.0"))  # p95 seconds
+    ROUTING_MIN_SAMPLES = 10
+    ROUTING_SAMPLE_MAX_AGE = float(os.getenv("ROUTING_SAMPLE_MAX_AGE", "300"))  # seconds a latency sample counts toward p95
+    ROUTING_LOG_PATH = os.getenv("ROUTING_LOG_PATH", "")
+    
+    # Request Scheduling Configuration
+    SCHEDULER_MAX_CONCURRENCY = int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "8"))  # upstream calls in flight per process
+    # Seconds a request may wait for a slot before it is dropped (None waits indefinitely)
+    SCHEDULER_DEADLINES = {
+        "interactive": 60.0,
+        "voice": 30.0,
+        "camera": 10.0,
+        "batch": None,
+    }
+    
+    # Upstream Resilience Configuration
+    REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "60"))
+    RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+    RETRY_BASE_DELAY = 0.5
+    RETRY_MAX_DELAY = 20.0
+    HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+    HEDGE_PERCENTILE = 95
+    HEDGE_MIN_SAMPLES = 20
+    BREAKER_FAILURE_THRESHOLD = 5
+    BREAKER_RECOVERY_TIMEOUT = 30.0
+    
+    # AI Server Configuration
+    AI_SERVER_URL = os.getenv("AI_SERVER_URL", "")  # e.g. http://localhost:8600; empty runs AIService in-process
+    AI_SERVER_HOST = os.getenv("AI_SERVER_HOST", "127.0.0.1")
+    # Shared secret clients send as "Authorization: Bearer <token>"; required to bind beyond loopback
+    AI_SERVER_TOKEN = os.getenv("AI_SERVER_TOKEN", "")
+    AI_SERVER_ALLOW_OPEN = os.getenv("AI_SERVER_ALLOW_OPEN", "false").lower() == "true"  # bind beyond loopback without a token
+    AI_SERVER_PORT = int(os.getenv("AI_SERVER_PORT", "8600"))
+    AI_SERVER_WORKERS = int(os.getenv("AI_SERVER_WORKERS", "8"))
+    AI_SERVER_QUEUE_SIZE = int(os.getenv("AI_SERVER_QUEUE_SIZE", "64"))
+    AI_SERVER_SHUTDOWN_TIMEOUT = 30.0
+    AI_CLIENT_POOL_SIZE = int(os.getenv("AI_CLIENT_POOL_SIZE", "10"))
+    AI_CLIENT_TIMEOUT = 120.0
     
+    # Multi-worker Deployment Configuration
+    # Set SHARED_STATE_PATH so every Streamlit worker shares one cache, rate limiter and metrics store
+    SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "")
+    SHARED_CACHE_TTL = int(os.getenv("SHARED_CACHE_TTL", "300"))  # seconds a text response is reused
+    SHARED_CACHE_MAX_ENTRIES = 10000
+    SHARED_METRICS_RETENTION = 3600  # seconds of metric samples kept
+    RATE_LIMIT_REQUESTS = int(os.getenv("RATE_LIMIT_REQUESTS", "100"))
+    RATE_LIMIT_WINDOW_MINUTES = float(os.getenv("RATE_LIMIT_WINDOW_MINUTES", "60"))
+    PROXY_HOST = os.getenv("PROXY_HOST", "0.0.0.0")
+    PROXY_PORT = int(os.getenv("PROXY_PORT", "8501"))
+    PROXY_BACKENDS = [b for b in os.getenv("PROXY_BACKENDS", "").split(",") if b]  # e.g. http://127.0.0.1:8511,http://127.0.0.1:8512
+    PROXY_READY_TIMEOUT = float(os.getenv("PROXY_READY_TIMEOUT", "60"))  # seconds a new client is held while no worker is warm
+    WORKER_URL = os.getenv("WORKER_URL", "")  # this worker's URL in PROXY_BACKENDS; readiness is published under it
+    # X-Forwarded-For is only trusted behind proxy.py (run.sh sets WORKER_URL for its workers); otherwise clients write it
+    BEHIND_PROXY = bool(WORKER_URL or PROXY_BACKENDS)
+    
+    # Retrieval (conversation memory) Configuration
+    RAG_ENABLED = os.getenv("RAG_ENABLED", "true").lower() == "true"
+    RAG_EMBEDDING_DIM = int(os.getenv("RAG_EMBEDDING_DIM", "256"))
+    RAG_TOP_K = int(os.getenv("RAG_TOP_K", "4"))
+    RAG_MIN_SCORE = float(os.getenv("RAG_MIN_SCORE", "0.25"))
+    RAG_BATCH_SIZE = 256  # pending texts embedded per vectorized flush
+    RAG_CHUNK_SIZE = 800  # characters per uploaded-document chunk
+    RAG_APPROXIMATE = os.getenv("RAG_APPROXIMATE", "false").lower() == "true"
+    RAG_IVF_LISTS = 256
+    RAG_IVF_NPROBE = 8
+    RAG_INDEX_PATH = os.getenv("RAG_INDEX_PATH", "")
+
+    # Sampling profiler (off by default; see profiler.py)
+    PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() == "true"
+    PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "5"))
+    PROFILER_DIR = os.getenv("PROFILER_DIR", os.path.join(tempfile.gettempdir(), "ai_chatbot_profiles"))
+    PROFILER_MAX_FILES = int(os.getenv("PROFILER_MAX_FILES", "200"))
+    PROFILER_MIN_DURATION_MS = float(os.getenv("PROFILER_MIN_DURATION_MS", "250"))  # faster profiles are listed but not written
+
+    # Request tracing (see tracing.py); spans are appended as OTLP/JSON lines
+    TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+    TRACE_FILE = os.getenv("TRACE_FILE", os.path.join(tempfile.gettempdir(), "ai_chatbot_traces.jsonl"))
+    TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", "1.0"))  # share of new traces exported
+    TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(50 * 1024 * 1024)))  # rotated to TRACE_FILE.1 past this
+    TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "ai-chatbot-pro")
+
+    # Startup warm-up (see warmup.py)
+    WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+    WARMUP_MODULES = ["cv2", "gtts", "speech_recognition", "av", "streamlit_webrtc"]
+    WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "2"))  # upstream keep-alive connections opened ahead of traffic
+    WARMUP_SYNTHETIC_REQUEST = os.getenv("WARMUP_SYNTHETIC_REQUEST", "true").lower() == "true"
+    WARMUP_PROMPT = "Reply with the single word: ready"
+    WARMUP_HOT_SET_PATH = os.getenv("WARMUP_HOT_SET_PATH", os.path.join(tempfile.gettempdir(), "ai_chatbot_hot_set.json"))
+    WARMUP_HOT_SET_SIZE = 200  # most-hit cache entries persisted per cache
+    WARMUP_HOT_SET_INTERVAL = 300.0  # seconds between hot set saves
+    WARMUP_HEARTBEAT_INTERVAL = 10.0  # seconds between readiness heartbeats to shared state
+
     # WebRTC Configuration
     RTC_CONFIGURATION = {
         "iceServers": [
@@ -61,7 +232,11 @@ class Config:
             "timeout": cls.SPEECH_RECOGNITION_TIMEOUT,
             "language": cls.SPEECH_RECOGNITION_LANGUAGE,
             "tts_language": cls.TTS_LANGUAGE,
-            "tts_slow": cls.TTS_SLOW
+            "tts_slow": cls.TTS_SLOW,
+            "speculative": cls.SPECULATIVE_VOICE,
+            "min_sentence_chars": cls.SPECULATIVE_MIN_SENTENCE_CHARS,
+            "prefetch": cls.SPECULATIVE_PREFETCH,
+            "follow_ups": cls.VOICE_FOLLOW_UPS
         }
     
     @classmethod
@@ -70,9 +245,108 @@ class Config:
         return {
             "width": cls.CAMERA_WIDTH,
             "height": cls.CAMERA_HEIGHT,
-            "fps": cls.CAMERA_FPS
+            "fps": cls.CAMERA_FPS,
+            "adaptive": cls.CAMERA_ADAPTIVE,
+            "cpu_budget": cls.CAMERA_CPU_BUDGET,
+            "total_cpu_budget": cls.CAMERA_TOTAL_CPU_BUDGET,
+            "ladder": cls.CAMERA_LADDER
+        }
+    
+    @classmethod
+    def get_image_pipeline_config(cls) -> Dict[str, Any]:
+        """Get bounded image upload pipeline configuration"""
+        return {
+            "max_file_size": cls.MAX_FILE_SIZE,
+            "max_pixels": cls.MAX_IMAGE_PIXELS,
+            "model_size": cls.MODEL_IMAGE_SIZE,
+            "display_size": cls.DISPLAY_IMAGE_SIZE,
+            "memory_budget": cls.IMAGE_MEMORY_BUDGET,
+            "budget_timeout": cls.IMAGE_BUDGET_TIMEOUT,
+            "cache_entries": cls.IMAGE_PIPELINE_CACHE_ENTRIES
+        }
+    
+    @classmethod
+    def get_media_config(cls) -> Dict[str, Any]:
+        """Get media worker pool configuration"""
+        return {
+            "workers": cls.MEDIA_WORKERS,
+            "queue_size": cls.MEDIA_QUEUE_SIZE,
+            "queue_timeout": cls.MEDIA_QUEUE_TIMEOUT,
+            "shm_threshold": cls.MEDIA_SHM_THRESHOLD
+        }
+    
+    @classmethod
+    def get_server_config(cls) -> Dict[str, Any]:
+        """Get AI server and client configuration"""
+        return {
+            "url": cls.AI_SERVER_URL,
+            "host": cls.AI_SERVER_HOST,
+            "port": cls.AI_SERVER_PORT,
+            "token": cls.AI_SERVER_TOKEN,
+            "allow_open": cls.AI_SERVER_ALLOW_OPEN,
+            "workers": cls.AI_SERVER_WORKERS,
+            "queue_size": cls.AI_SERVER_QUEUE_SIZE,
+            "shutdown_timeout": cls.AI_SERVER_SHUTDOWN_TIMEOUT,
+            "client_pool_size": cls.AI_CLIENT_POOL_SIZE,
+            "client_timeout": cls.AI_CLIENT_TIMEOUT
+        }
+    
+    @classmethod
+    def get_deployment_config(cls) -> Dict[str, Any]:
+        """Get multi-worker proxy and shared state configuration"""
+        return {
+            "shared_state_path": cls.SHARED_STATE_PATH,
+            "cache_ttl": cls.SHARED_CACHE_TTL,
+            "rate_limit_requests": cls.RATE_LIMIT_REQUESTS,
+            "rate_limit_window_minutes": cls.RATE_LIMIT_WINDOW_MINUTES,
+            "proxy_host": cls.PROXY_HOST,
+            "proxy_port": cls.PROXY_PORT,
+            "proxy_backends": cls.PROXY_BACKENDS
+        }
+    
+    @classmethod
+    def get_routing_config(cls) -> Dict[str, Any]:
+        """Get model routing policy configuration"""
+        return {
+            "routes": cls.MODEL_ROUTES,
+            "fallbacks": cls.MODEL_FALLBACKS,
+            "latency_slo": cls.ROUTING_LATENCY_SLO,
+            "min_samples": cls.ROUTING_MIN_SAMPLES,
+            "sample_max_age": cls.ROUTING_SAMPLE_MAX_AGE,
+            "log_path": cls.ROUTING_LOG_PATH
         }
     
+    @classmethod
+    def get_resilience_config(cls) -> Dict[str, Any]:
+        """Get upstream retry, hedging and circuit breaker configuration"""
+        return {
+            "request_timeout": cls.REQUEST_TIMEOUT,
+            "max_retries": cls.RETRY_MAX_ATTEMPTS,
+            "base_delay": cls.RETRY_BASE_DELAY,
+            "max_delay": cls.RETRY_MAX_DELAY,
+            "hedge_enabled": cls.HEDGE_ENABLED,
+            "hedge_percentile": cls.HEDGE_PERCENTILE,
+            "hedge_min_samples": cls.HEDGE_MIN_SAMPLES,
+            "breaker_failure_threshold": cls.BREAKER_FAILURE_THRESHOLD,
+            "breaker_recovery_timeout": cls.BREAKER_RECOVERY_TIMEOUT
+        }
+    
+    @classmethod
+    def get_rag_config(cls) -> Dict[str, Any]:
+        """Get retrieval-augmented generation configuration"""
+        return {
+            "enabled": cls.RAG_ENABLED,
+            "dim": cls.RAG_EMBEDDING_DIM,
+            "top_k": cls.RAG_TOP_K,
+            "min_score": cls.RAG_MIN_SCORE,
+            "batch_size": cls.RAG_BATCH_SIZE,
+            "chunk_size": cls.RAG_CHUNK_SIZE,
+            "approximate": cls.RAG_APPROXIMATE,
+            "ivf_lists": cls.RAG_IVF_LISTS,
+            "ivf_nprobe": cls.RAG_IVF_NPROBE,
+            "index_path": cls.RAG_INDEX_PATH
+        }
+
     @classmethod
     def validate_config(cls) -> bool:
         """Validate configuration settings"""
@@ -0,0 +1,196 @@
+import re
+from typing import Dict, List, Any, Optional, Union
+import cv2
+import numpy as np
+from PIL import Image
+from config import Config
+
+# Reference palette used to name dominant colors (RGB)
+COLOR_NAMES = {
+    "black": (0, 0, 0),
+    "white": (255, 255, 255),
+    "gray": (128, 128, 128),
+    "red": (220, 30, 30),
+    "orange": (245, 140, 20),
+    "yellow": (240, 220, 40),
+    "green": (40, 160, 60),
+    "teal": (0, 128, 128),
+    "blue": (30, 80, 210),
+    "sky blue": (120, 180, 235),
+    "purple": (130, 50, 160),
+    "pink": (240, 150, 190),
+    "brown": (120, 75, 40),
+    "beige": (225, 205, 165),
+    "navy": (20, 30, 90),
+    "olive": (110, 115, 40),
+}
+_PALETTE_NAMES = list(COLOR_NAMES)
+_PALETTE = np.array([COLOR_NAMES[name] for name in _PALETTE_NAMES], dtype=np.float32)
+
+_SUBJECT = r"(this|the|it|that)( image| photo| picture| pic| shot)?"
+
+# Anchored so only questions that are purely about a cheap feature short-circuit
+_INTENTS = {
+    "colors": re.compile(rf"^(what|which)( are| is)?( the)?( main| dominant| primary)? colou?rs?( are| is)?( there)?( in| of)? {_SUBJECT}$"),
+    "blur": re.compile(rf"^(is|was) {_SUBJECT} (blurry|blurred|sharp|in focus|out of focus)$"),
+    "exposure": re.compile(rf"^(is|was) {_SUBJECT} (too )?(dark|bright|overexposed|underexposed|well lit)$"),
+    "faces": re.compile(rf"^(how many|are there( any)?) faces( are there)?( in {_SUBJECT})?$"),
+}
+
+def perceptual_hash(gray: np.ndarray) -> int:
+    """64-bit DCT perceptual hash (pHash) of a grayscale image"""
+
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view(">u8")[0])
+
+def difference_hash(gray: np.ndarray) -> int:
+    """64-bit gradient hash (dHash) of a grayscale image"""
+
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int(np.packbits(bits.flatten()).view(">u8")[0])
+
+def hamming_distance(a: int, b: int) -> int:
+    """Number of differing bits between two hashes"""
+    return bin(a ^ b).count("1")
+
+class LocalImageAnalyzer:
+    """On-device image features computed in one pass over a downscaled copy"""
+
+    def __init__(self, analysis_size: int = 512, detect_faces: bool = True):
+        self.analysis_size = analysis_size
+        self.detect_faces = detect_faces
+        self._face_cascade = None
+
+    def _get_face_cascade(self) -> Optional["cv2.CascadeClassifier"]:
+        """Lazily load OpenCV's bundled frontal-face Haar cascade"""
+
+        if self._face_cascade is None:
+            self._face_cascade = False
+            # Haar cascades ship with opencv-python 4.x but not every OpenCV build
+            data = getattr(cv2, "data", None)
+            if data is not None and hasattr(cv2, "CascadeClassifier"):
+                cascade = cv2.CascadeClassifier(data.haarcascades + "haarcascade_frontalface_default.xml")
+                if not cascade.empty():
+                    self._face_cascade = cascade
+        return self._face_cascade or None
+
+    def _to_rgb_array(self, image: Union[Image.Image, np.ndarray]) -> np.ndarray:
+        """Downscale to the analysis size and return an RGB uint8 array"""
+
+        if isinstance(image, Image.Image):
+            # Integer box reduction in PIL avoids materializing a full-size array
+            factor = max(1, min(image.size) // self.analysis_size)
+            if factor > 1:
+                image = image.reduce(factor)
+            image = np.asarray(image.convert("RGB"))
+
+        height, width = image.shape[:2]
+        scale = self.analysis_size / max(height, width)
+        if scale < 1:
+            image = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+        return np.ascontiguousarray(image)
+
+    def analyze(self, image: Union[Image.Image, np.ndarray]) -> Dict[str, Any]:
+        """Compute colors, exposure, blur, edges, faces and pHash for an RGB image"""
+
+        rgb = self._to_rgb_array(image)
+        gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+
+        # Dominant colors: 3 bits per channel packed into 512 histogram bins
+        quantized = (rgb >> 5).astype(np.uint16)
+        codes = (quantized[..., 0] << 6) | (quantized[..., 1] << 3) | quantized[..., 2]
+        counts = np.bincount(codes.ravel(), minlength=512)
+        top = np.argsort(counts)[::-1][:5]
+        centers = np.stack([(top >> 6) & 7, (top >> 3) & 7, top & 7], axis=1).astype(np.float32) * 32 + 16
+        names = np.argmin(((centers[:, None, :] - _PALETTE[None]) ** 2).sum(axis=2), axis=1)
+
+        colors: Dict[str, float] = {}
+        total = float(codes.size)
+        for name_index, count in zip(names, counts[top]):
+            if count:
+                name = _PALETTE_NAMES[name_index]
+                colors[name] = colors.get(name, 0.0) + int(count) / total
+
+        edges = cv2.Canny(gray, 100, 200)
+        faces = None
+        cascade = self._get_face_cascade() if self.detect_faces else None
+        if cascade is not None:
+            faces = len(cascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=5, minSize=(24, 24)))
+
+        brightness = float(gray.mean())
+        contrast = float(gray.std())
+        blur = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+        return {
+            "dominant_colors": [
+                {"name": name, "share": round(share, 3)}
+                for name, share in sorted(colors.items(), key=lambda item: -item[1])
+            ],
+            "brightness": round(brightness, 1),
+            "contrast": round(contrast, 1),
+            "blur_variance": round(blur, 1),
+            "is_blurry": blur < Config.LOCAL_BLUR_THRESHOLD,
+            "is_dark": brightness < 60,
+            "is_bright": brightness > 200,
+            "edge_density": round(float(np.count_nonzero(edges)) / edges.size, 4),
+            "faces": faces,
+            "phash": f"{perceptual_hash(gray):016x}",
+            "dhash": f"{difference_hash(gray):016x}",
+        }
+
+    @staticmethod
+    def summarize(features: Dict[str, Any]) -> str:
+        """Compact feature summary to attach to a vision prompt"""
+
+        colors = ", ".join(f"{c['name']} {c['share']:.0%}" for c in features["dominant_colors"][:3])
+        summary = (
+            f"dominant colors: {colors}; brightness {features['brightness']}/255; "
+            f"contrast {features['contrast']}; {'blurry' if features['is_blurry'] else 'sharp'} "
+            f"(Laplacian variance {features['blur_variance']}); edge density {features['edge_density']}"
+        )
+        if features["faces"] is not None:
+            summary += f"; faces detected: {features['faces']}"
+        return summary
+
+    @staticmethod
+    def classify_question(question: str) -> Optional[str]:
+        """Return the cheap-feature intent a question is purely about, if any"""
+
+        normalized = re.sub(r"\s+", " ", question.lower()).strip(" ?.!")
+        for intent, pattern in _INTENTS.items():
+            if pattern.match(normalized):
+                return intent
+        return None
+
+    def answer(self, question: str, features: Dict[str, Any]) -> Optional[str]:
+        """Answer trivially answerable questions from local features, else None"""
+
+        intent = self.classify_question(question or "")
+
+        if intent == "colors":
+            colors: List[Dict] = features["dominant_colors"]
+            listed = ", ".join(f"**{c['name']}** ({c['share']:.0%})" for c in colors)
+            return f"The main colors in this image are {listed}."
+
+        if intent == "blur":
+            if features["is_blurry"]:
+                return f"Yes, the image looks blurry (sharpness score {features['blur_variance']:.0f}, below {Config.LOCAL_BLUR_THRESHOLD})."
+            return f"No, the image looks sharp (sharpness score {features['blur_variance']:.0f})."
+
+        if intent == "exposure":
+            if features["is_dark"]:
+                verdict = "quite dark"
+            elif features["is_bright"]:
+                verdict = "very bright"
+            else:
+                verdict = "reasonably well exposed"
+            return f"The image is {verdict} (average brightness {features['brightness']:.0f}/255, contrast {features['contrast']:.0f})."
+
+        if intent == "faces" and features["faces"] is not None:
+            count = features["faces"]
+            return f"I detected {count} face{'s' if count != 1 else ''} in this image."
+
+        return None
@@ -0,0 +1,200 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from itertools import combinations
+from typing import Dict, List, Any, Iterator, Optional, Set, Tuple
+from config import Config
+from image_analysis import hamming_distance
+
+class MultiIndexHashIndex:
+    """Hamming-radius search over 64-bit hashes using multi-index hashing
+
+    Each hash is split into ``chunks`` substrings with one exact-match table
+    per substring. By the pigeonhole principle, two hashes within distance
+    ``r`` agree to within ``r // chunks`` bits on at least one substring, so
+    a query only probes that small neighborhood in each table and verifies
+    the candidates it finds.
+    """
+
+    def __init__(self, chunks: int = 4):
+        if 64 % chunks:
+            raise ValueError("chunks must divide 64")
+        self.chunks = chunks
+        self.chunk_bits = 64 // chunks
+        self._mask = (1 << self.chunk_bits) - 1
+        self._tables: List[Dict[int, Set[int]]] = [{} for _ in range(chunks)]
+        self._hashes: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def _split(self, value: int) -> List[int]:
+        return [(value >> (i * self.chunk_bits)) & self._mask for i in range(self.chunks)]
+
+    def _neighbors(self, value: int, radius: int) -> Iterator[int]:
+        """All substring values within the given bit radius of value"""
+
+        yield value
+        for r in range(1, radius + 1):
+            for bits in combinations(range(self.chunk_bits), r):
+                flipped = value
+                for bit in bits:
+                    flipped ^= 1 << bit
+                yield flipped
+
+    def add(self, item_id: int, value: int):
+        """Index an item under its hash"""
+
+        self._hashes[item_id] = value
+        for table, part in zip(self._tables, self._split(value)):
+            table.setdefault(part, set()).add(item_id)
+
+    def remove(self, item_id: int):
+        """Remove an item from the index"""
+
+        value = self._hashes.pop(item_id, None)
+        if value is None:
+            return
+        for table, part in zip(self._tables, self._split(value)):
+            bucket = table.get(part)
+            if bucket is not None:
+                bucket.discard(item_id)
+                if not bucket:
+                    del table[part]
+
+    def search(self, value: int, radius: int) -> List[Tuple[int, int]]:
+        """Return (distance, item_id) pairs within radius, nearest first"""
+
+        sub_radius = radius // self.chunks
+        candidates: Set[int] = set()
+        for table, part in zip(self._tables, self._split(value)):
+            for probe in self._neighbors(part, sub_radius):
+                bucket = table.get(probe)
+                if bucket:
+                    candidates.update(bucket)
+
+        matches = []
+        for item_id in candidates:
+            distance = hamming_distance(value, self._hashes[item_id])
+            if distance <= radius:
+                matches.append((distance, item_id))
+        matches.sort()
+        return matches
+
+class ImageResultCache:
+    """Near-duplicate image + question cache for vision model answers"""
+
+    def __init__(self,
+                 max_entries: int = None,
+                 ttl_seconds: float = None,
+                 phash_threshold: int = None,
+                 dhash_threshold: int = None):
+        self.max_entries = max_entries or Config.IMAGE_CACHE_MAX_ENTRIES
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else Config.IMAGE_CACHE_TTL
+        self.phash_threshold = phash_threshold if phash_threshold is not None else Config.IMAGE_CACHE_PHASH_THRESHOLD
+        self.dhash_threshold = dhash_threshold if dhash_threshold is not None else Config.IMAGE_CACHE_DHASH_THRESHOLD
+
+        self._index = MultiIndexHashIndex()
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def normalize_question(question: str) -> str:
+        """Canonical form so trivially different phrasings share an entry"""
+        return re.sub(r"[^a-z0-9 ]", "", re.sub(r"\s+", " ", (question or "").lower())).strip()
+
+    def _evict(self, item_id: int):
+        self._entries.pop(item_id, None)
+        self._index.remove(item_id)
+
+    def get(self, phash: str, dhash: str, question: str) -> Optional[Tuple[str, Dict, int]]:
+        """Return (response, sources, distance) for a near-duplicate image and same question"""
+
+        question_key = self.normalize_question(question)
+        phash_value, dhash_value = int(phash, 16), int(dhash, 16)
+        now = time.time()
+
+        with self._lock:
+            for distance, item_id in self._index.search(phash_value, self.phash_threshold):
+                entry = self._entries[item_id]
+                if now - entry["created"] > self.ttl_seconds:
+                    self._evict(item_id)
+                    continue
+                if entry["question"] != question_key:
+                    continue
+                if hamming_distance(dhash_value, entry["dhash"]) > self.dhash_threshold:
+                    continue
+
+                self._entries.move_to_end(item_id)
+                entry["hits"] += 1
+                self.stats["hits"] += 1
+                return entry["response"], dict(entry["sources"]), distance
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, phash: str, dhash: str, question: str, response: str, sources: Dict):
+        """Store an analysis result, evicting least recently used entries past the cap"""
+
+        self._add({
+            "phash": int(phash, 16),
+            "dhash": int(dhash, 16),
+            "question": self.normalize_question(question),
+            "response": response,
+            "sources": dict(sources),
+            "created": time.time(),
+            "hits": 0
+        })
+
+    def _add(self, entry: Dict[str, Any]):
+        with self._lock:
+            item_id = self._next_id
+            self._next_id += 1
+            self._entries[item_id] = entry
+            self._index.add(item_id, entry["phash"])
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._evict(oldest)
+                self.stats["evictions"] += 1
+
+    def hot_entries(self, limit: int) -> List[Dict[str, Any]]:
+        """The most-hit live entries in a JSON-safe form, for persisting across restarts"""
+
+        now = time.time()
+        with self._lock:
+            entries = [entry for entry in self._entries.values() if entry["hits"] and now - entry["created"] <= self.ttl_seconds]
+            entries = sorted(entries, key=lambda entry: -entry["hits"])[:limit]
+            return [dict(entry, phash=f"{entry['phash']:016x}", dhash=f"{entry['dhash']:016x}") for entry in entries]
+
+    def load(self, entries: List[Dict[str, Any]]) -> int:
+        """Add entries saved by hot_entries that have not expired; returns the count added"""
+
+        now = time.time()
+        added = 0
+        for entry in reversed(entries):  # least hit first, so the hottest end up most recently used
+            if now - entry["created"] > self.ttl_seconds:
+                continue
+            self._add(dict(entry, phash=int(entry["phash"], 16), dhash=int(entry["dhash"], 16)))
+            added += 1
+        return added
+
+    def clear(self):
+        """Drop all cached results"""
+
+        with self._lock:
+            self._entries.clear()
+            self._index = MultiIndexHashIndex()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache size and hit statistics"""
+
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "entries": len(self._entries),
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else None,
+            **self.stats
+        }
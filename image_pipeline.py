@@ -0,0 +1,154 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from io import BytesIO
+from typing import Dict, Any, Iterator, Tuple
+from PIL import Image
+from config import Config
+
+class ImageRejectedError(ValueError):
+    """Raised when an upload is too large to accept"""
+
+class ImageBudgetExceeded(RuntimeError):
+    """Raised when in-flight image memory stays over budget for too long"""
+
+class ImageMemoryBudget:
+    """Process-wide byte budget for images being decoded"""
+
+    def __init__(self, limit_bytes: int):
+        self.limit_bytes = limit_bytes
+        self.in_use = 0
+        self.peak = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def reserve(self, nbytes: int, timeout: float) -> Iterator[None]:
+        """Hold nbytes of budget for the duration of the block"""
+
+        # A single image larger than the whole budget may still run alone
+        nbytes = min(nbytes, self.limit_bytes)
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.in_use + nbytes <= self.limit_bytes, timeout):
+                self.rejected += 1
+                raise ImageBudgetExceeded("Too many large images are being processed; please retry shortly")
+            self.in_use += nbytes
+            self.peak = max(self.peak, self.in_use)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_use -= nbytes
+                self._cond.notify_all()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get budget usage"""
+
+        return {
+            "limit_bytes": self.limit_bytes,
+            "in_use_bytes": self.in_use,
+            "peak_bytes": self.peak,
+            "rejected": self.rejected
+        }
+
+class BoundedImagePipeline:
+    """Validates uploads from headers, decodes them at reduced size once and caches the results"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = config or Config.get_image_pipeline_config()
+        self.budget = ImageMemoryBudget(self.config["memory_budget"])
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def probe(self, uploaded_file) -> Tuple[str, Tuple[int, int]]:
+        """Check byte size, then header dimensions, without decoding pixels"""
+
+        size = getattr(uploaded_file, "size", None)
+        if size is not None and size > self.config["max_file_size"]:
+            raise ImageRejectedError(f"File is larger than {self.config['max_file_size'] // (1024 * 1024)}MB")
+
+        uploaded_file.seek(0)
+        try:
+            with Image.open(uploaded_file) as image:
+                image_format, dimensions = image.format, image.size
+        except Exception:
+            raise ImageRejectedError("File is not a readable image")
+        finally:
+            uploaded_file.seek(0)
+
+        if dimensions[0] * dimensions[1] > self.config["max_pixels"]:
+            raise ImageRejectedError(
+                f"Image is {dimensions[0]}x{dimensions[1]}; the limit is {self.config['max_pixels'] // 1_000_000}MP"
+            )
+        return image_format, dimensions
+
+    @staticmethod
+    def _cache_key(uploaded_file) -> str:
+        """Streamlit's per-upload id, falling back to a content digest"""
+
+        file_id = getattr(uploaded_file, "file_id", None)
+        if file_id:
+            return str(file_id)
+        uploaded_file.seek(0)
+        digest = hashlib.sha1(uploaded_file.read()).hexdigest()
+        uploaded_file.seek(0)
+        return digest
+
+    def _decode(self, uploaded_file, image_format: str) -> Dict[str, Any]:
+        """Decode at reduced resolution and derive the model and display copies"""
+
+        model_size = self.config["model_size"]
+        with Image.open(uploaded_file) as image:
+            if image_format == "JPEG":
+                # DCT-domain downscaling: decode at 1/2, 1/4 or 1/8 scale
+                image.draft("RGB", model_size)
+            decoded_bytes = image.size[0] * image.size[1] * max(len(image.getbands()), 3)
+
+            with self.budget.reserve(decoded_bytes, self.config["budget_timeout"]):
+                image = image.convert("RGB")
+                if image.width > model_size[0] or image.height > model_size[1]:
+                    image.thumbnail(model_size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+        display = image.copy()
+        display.thumbnail(self.config["display_size"], Image.Resampling.LANCZOS)
+        return {"model": image, "display": display}
+
+    def load(self, uploaded_file) -> Dict[str, Any]:
+        """Return {"model", "display", "format", "original_size"} for an upload, decoding at most once"""
+
+        key = self._cache_key(uploaded_file)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        image_format, dimensions = self.probe(uploaded_file)
+        try:
+            result = self._decode(uploaded_file, image_format)
+        finally:
+            uploaded_file.seek(0)
+        result.update(format=image_format, original_size=dimensions)
+
+        with self._lock:
+            self._cache[key] = result
+            while len(self._cache) > self.config["cache_entries"]:
+                self._cache.popitem(last=False)
+        return result
+
+    def load_bytes(self, data: bytes, name: str = "image") -> Dict[str, Any]:
+        """Run raw bytes through the same bounded pipeline"""
+
+        buffer = BytesIO(data)
+        buffer.size = len(data)
+        buffer.file_id = hashlib.sha1(data).hexdigest()
+        buffer.name = name
+        return self.load(buffer)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache and memory budget usage"""
+
+        return {"cached_uploads": len(self._cache), **self.budget.get_stats()}
+
+# Global pipeline shared by every session in the process
+image_pipeline = BoundedImagePipeline()
@@ -0,0 +1,343 @@
+"""Process pool for CPU-heavy media work (JPEG encoding, watermarking, frame and audio decoding)
+
+Work submitted here runs outside the Streamlit script thread, so it does
+not hold the GIL while UI reruns and asyncio callbacks wait. Arrays and
+byte strings larger than ``Config.MEDIA_SHM_THRESHOLD`` travel to and
+from the workers through ``multiprocessing.shared_memory`` instead of
+being pickled through the executor's pipe.
+
+Each task is traced as a child of the submitting span: "media.<task>"
+covers queueing and transfer, and its "run" child is the time spent in the
+worker process, as measured and returned by the worker.
+
+This module is imported by the worker processes, so it must stay free of
+Streamlit and other heavy imports.
+"""
+import asyncio
+import io
+import multiprocessing as mp
+import threading
+import time
+import wave
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Dict, List, Any, Callable, NamedTuple, Optional, Tuple
+import numpy as np
+from PIL import Image
+from config import Config
+from tracing import tracer
+
+class MediaQueueFullError(RuntimeError):
+    """Raised when the media pool's bounded queue stays full past the timeout"""
+
+class SharedBuffer(NamedTuple):
+    """Handle to an array or bytes value placed in a shared memory segment"""
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+    is_bytes: bool
+
+def _export(value: Any, threshold: int, segments: List[shared_memory.SharedMemory]) -> Any:
+    """Move large arrays and bytes into shared memory; other values pass through"""
+
+    if isinstance(value, Image.Image):
+        value = _image_to_array(value)
+    if isinstance(value, (bytes, bytearray)) and len(value) >= threshold:
+        array, is_bytes = np.frombuffer(value, dtype=np.uint8), True
+    elif isinstance(value, np.ndarray) and value.nbytes >= threshold:
+        array, is_bytes = value, False
+    else:
+        return value
+
+    segment = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+    segments.append(segment)
+    return SharedBuffer(segment.name, array.shape, array.dtype.str, is_bytes)
+
+def _import(value: Any, unlink: bool = False) -> Any:
+    """Copy a SharedBuffer back into private memory; other values pass through"""
+
+    if not isinstance(value, SharedBuffer):
+        return value
+    segment = shared_memory.SharedMemory(name=value.name)
+    try:
+        array = np.ndarray(value.shape, dtype=np.dtype(value.dtype), buffer=segment.buf).copy()
+    finally:
+        segment.close()
+        if unlink:
+            segment.unlink()
+    return array.tobytes() if value.is_bytes else array
+
+def _image_to_array(image: Image.Image) -> np.ndarray:
+    if image.mode not in ("RGB", "RGBA", "L"):
+        image = image.convert("RGB")
+    return np.asarray(image)
+
+def _invoke(fn: Callable, args: tuple, kwargs: dict, threshold: int) -> Tuple[Any, float, float]:
+    """Worker-side wrapper: unpack shared inputs, run fn, export a large result"""
+
+    started = time.time()
+    run_start = time.perf_counter()
+    result = fn(*(_import(arg) for arg in args), **kwargs)
+
+    segments: List[shared_memory.SharedMemory] = []
+    exported = _export(result, threshold, segments)
+    for segment in segments:
+        # The parent unlinks the segment after copying the result out
+        segment.close()
+    return exported, started, time.perf_counter() - run_start
+
+# Tasks. Images arrive as uint8 arrays (H x W or H x W x C) and are returned the same way.
+
+def encode_jpeg(array: np.ndarray, quality: int = 90) -> bytes:
+    """Encode an image array as JPEG"""
+
+    image = Image.fromarray(array)
+    if image.mode == "RGBA":
+        image = image.convert("RGB")
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG", quality=quality)
+    return buffered.getvalue()
+
+def watermark(array: np.ndarray, text: str) -> np.ndarray:
+    """Draw a text watermark with a dark backing box in the bottom right corner"""
+
+    from PIL import ImageDraw, ImageFont
+
+    watermarked = Image.fromarray(array).copy()
+    draw = ImageDraw.Draw(watermarked)
+
+    # Try to use a font, fallback to default
+    try:
+        font = ImageFont.truetype("arial.ttf", 20)
+    except OSError:
+        font = ImageFont.load_default()
+
+    text_bbox = draw.textbbox((0, 0), text, font=font)
+    text_width = text_bbox[2] - text_bbox[0]
+    text_height = text_bbox[3] - text_bbox[1]
+
+    margin = 10
+    x = watermarked.width - text_width - margin
+    y = watermarked.height - text_height - margin
+
+    draw.rectangle([x - 5, y - 5, x + text_width + 5, y + text_height + 5], fill=(0, 0, 0, 128))
+    draw.text((x, y), text, fill=(255, 255, 255, 180), font=font)
+    return np.asarray(watermarked)
+
+def bgr_to_rgb(frame: np.ndarray) -> np.ndarray:
+    """Convert an OpenCV BGR frame to RGB"""
+
+    import cv2
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+def prepare_image(data: bytes, max_size: Tuple[int, int] = (1024, 1024)) -> bytes:
+    """Decode, downscale and re-encode raw image bytes as JPEG for the model"""
+
+    image = Image.open(io.BytesIO(data))
+    if image.width * image.height > Config.MAX_IMAGE_PIXELS:
+        raise ValueError(f"image is {image.width}x{image.height}, above the pixel limit")
+    image.draft("RGB", max_size)
+    image = image.convert("RGB")
+    image.thumbnail(max_size, Image.Resampling.LANCZOS)
+
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG", quality=90)
+    return buffered.getvalue()
+
+def decode_wav(data: bytes, target_rate: int = 16000) -> Tuple[bytes, int, int]:
+    """Decode WAV bytes to mono 16-bit PCM at target_rate; returns (pcm, rate, sample_width)"""
+
+    with wave.open(io.BytesIO(data)) as wav:
+        channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+        frames = wav.readframes(wav.getnframes())
+
+    if width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) * 256
+    elif width == 2:
+        samples = np.frombuffer(frames, dtype="<i2").astype(np.float32)
+    elif width == 4:
+        samples = np.frombuffer(frames, dtype="<i4").astype(np.float32) / 65536
+    else:
+        raise ValueError(f"unsupported WAV sample width: {width} bytes")
+
+    samples = samples.reshape(-1, channels).mean(axis=1)
+    if rate != target_rate and len(samples):
+        positions = np.arange(0, len(samples), rate / target_rate)
+        samples = np.interp(positions, np.arange(len(samples)), samples)
+        rate = target_rate
+    return np.clip(samples, -32768, 32767).astype("<i2").tobytes(), rate, 2
+
+class MediaWorkerPool:
+    """Bounded ProcessPoolExecutor with shared-memory transport and per-task metrics"""
+
+    def __init__(self,
+                 workers: int = None,
+                 queue_size: int = None,
+                 queue_timeout: float = None,
+                 shm_threshold: int = None):
+        self.workers = Config.MEDIA_WORKERS if workers is None else workers
+        self.queue_size = queue_size or Config.MEDIA_QUEUE_SIZE
+        self.queue_timeout = Config.MEDIA_QUEUE_TIMEOUT if queue_timeout is None else queue_timeout
+        self.shm_threshold = shm_threshold or Config.MEDIA_SHM_THRESHOLD
+
+        # Running plus waiting tasks; submit blocks (then fails) beyond this
+        self._slots = threading.BoundedSemaphore(max(1, self.workers) + self.queue_size)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._metrics: Dict[str, Dict[str, Any]] = {}
+        self.in_flight = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # forkserver/spawn children never inherit Streamlit's threads and locks
+                method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=mp.get_context(method))
+            return self._executor
+
+    def _task_metrics(self, name: str) -> Dict[str, Any]:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = {
+                    "submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "inline": 0,
+                    "shm_bytes": 0, "run_seconds": deque(maxlen=500), "wait_seconds": deque(maxlen=500)
+                }
+            return self._metrics[name]
+
+    def _record(self, metrics: Dict[str, Any], outcome: str, run_seconds: float = None, wait_seconds: float = None):
+        with self._stats_lock:
+            metrics[outcome] += 1
+            if run_seconds is not None:
+                metrics["run_seconds"].append(run_seconds)
+                metrics["wait_seconds"].append(wait_seconds)
+
+    def _run_inline(self, fn: Callable, args: tuple, kwargs: dict, metrics: Dict[str, Any]) -> Future:
+        future: Future = Future()
+        start = time.perf_counter()
+        self._record(metrics, "inline")
+        try:
+            with tracer.span(f"media.{fn.__name__}", inline=True):
+                future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            self._record(metrics, "failed")
+            future.set_exception(e)
+        else:
+            self._record(metrics, "completed", time.perf_counter() - start, 0.0)
+        return future
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Run fn(*args, **kwargs) in a worker process; PIL images are sent as arrays
+
+        Waits up to queue_timeout for a queue slot, then raises MediaQueueFullError.
+        """
+
+        metrics = self._task_metrics(fn.__name__)
+        self._record(metrics, "submitted")
+        args = tuple(_image_to_array(arg) if isinstance(arg, Image.Image) else arg for arg in args)
+
+        if self.workers <= 0:
+            return self._run_inline(fn, args, kwargs, metrics)
+
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self._record(metrics, "rejected")
+            raise MediaQueueFullError(f"Media worker queue is full ({self.queue_size} waiting); please retry shortly")
+
+        segments: List[shared_memory.SharedMemory] = []
+        try:
+            shared_args = tuple(_export(arg, self.shm_threshold, segments) for arg in args)
+            shm_bytes = sum(segment.size for segment in segments)
+            with self._stats_lock:
+                metrics["shm_bytes"] += shm_bytes
+            submitted_at = time.time()
+            parent = tracer.current_span()
+            inner = self._get_executor().submit(_invoke, fn, shared_args, kwargs, self.shm_threshold)
+        except BrokenProcessPool:
+            self._release(segments)
+            self._reset_executor()
+            return self._run_inline(fn, args, kwargs, metrics)
+        except BaseException:
+            self._release(segments)
+            raise
+
+        with self._stats_lock:
+            self.in_flight += 1
+        outer: Future = Future()
+
+        def finish(done: Future):
+            with self._stats_lock:
+                self.in_flight -= 1
+            self._release(segments)
+            try:
+                exported, started, run_seconds = done.result()
+                result = _import(exported, unlink=True)
+            except BaseException as e:
+                if isinstance(e, BrokenProcessPool):
+                    self._reset_executor()
+                self._record(metrics, "failed")
+                tracer.record_span(f"media.{fn.__name__}", parent, int(submitted_at * 1e9), time.time_ns(), error=f"{type(e).__name__}: {e}")
+                outer.set_exception(e)
+                return
+            self._record(metrics, "completed", run_seconds, max(0.0, started - submitted_at))
+            span = tracer.record_span(f"media.{fn.__name__}", parent, int(submitted_at * 1e9), time.time_ns(),
+                                      shm_bytes=shm_bytes)
+            tracer.record_span("run", span, int(started * 1e9), int((started + run_seconds) * 1e9))
+            outer.set_result(result)
+
+        inner.add_done_callback(finish)
+        return outer
+
+    def _release(self, segments: List[shared_memory.SharedMemory]):
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+        segments.clear()
+        self._slots.release()
+
+    def _reset_executor(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, fn: Callable, *args, timeout: float = None, **kwargs) -> Any:
+        """Run a task and wait for its result"""
+        return self.submit(fn, *args, **kwargs).result(timeout)
+
+    async def run_async(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run a task without blocking the event loop, including while waiting for a queue slot"""
+
+        future = await asyncio.to_thread(self.submit, fn, *args, **kwargs)
+        return await asyncio.wrap_future(future)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-task counts, queue wait and run time percentiles"""
+
+        def percentiles(samples) -> Dict[str, Optional[float]]:
+            values = sorted(samples)
+            if not values:
+                return {"p50_ms": None, "p95_ms": None}
+            return {
+                "p50_ms": round(values[len(values) // 2] * 1000, 2),
+                "p95_ms": round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 2)
+            }
+
+        tasks = {}
+        with self._stats_lock:
+            for name, metrics in list(self._metrics.items()):
+                tasks[name] = {
+                    **{key: value for key, value in metrics.items() if not isinstance(value, deque)},
+                    "run": percentiles(metrics["run_seconds"]),
+                    "wait": percentiles(metrics["wait_seconds"])
+                }
+        return {"workers": self.workers, "queue_size": self.queue_size, "in_flight": self.in_flight, "tasks": tasks}
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        self._reset_executor()
+
+# Global media pool shared by every session in the process; workers start on first use
+media_pool = MediaWorkerPool()
@@ -0,0 +1,115 @@
+import json
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Any, Optional
+from config import Config
+from resilience import LatencyTracker
+
+logger = logging.getLogger(__name__)
+
+class ModelRouter:
+    """Policy engine choosing the model and max_tokens for each request"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = config or Config.get_routing_config()
+        self._latency: Dict[str, LatencyTracker] = {}
+        self._recent = deque(maxlen=200)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _fits(route: Dict[str, Any], modality: str, prompt_chars: int, history_size: int) -> bool:
+        """Check a request against a route's modality and size limits"""
+
+        if modality not in route.get("modalities", []):
+            return False
+        if prompt_chars > route.get("max_prompt_chars", float("inf")):
+            return False
+        return history_size <= route.get("max_history", float("inf"))
+
+    def _p95(self, model: str) -> Optional[float]:
+        """Measured p95 latency of a model, once enough recent samples exist"""
+
+        tracker = self._latency.get(model)
+        if tracker is None or len(tracker) < self.config["min_samples"]:
+            return None
+        return tracker.percentile(95)
+
+    def route(self, modality: str, prompt: str, history_size: int = 0, latency_slo: float = None) -> Dict[str, Any]:
+        """Pick a model for a request and log the decision"""
+
+        slo = latency_slo or self.config["latency_slo"]
+        route = next(
+            (r for r in self.config["routes"] if self._fits(r, modality, len(prompt), history_size)),
+            self.config["routes"][-1]
+        )
+        decision = {
+            "timestamp": datetime.now().isoformat(),
+            "modality": modality,
+            "prompt_chars": len(prompt),
+            "history_size": history_size,
+            "route": route["name"],
+            "model": route["model"],
+            "max_tokens": route.get("max_tokens", 1000),
+            "latency_slo": slo,
+            "fallback_from": None
+        }
+
+        # Step down to faster models while the chosen one breaks the SLO
+        seen = {decision["model"]}
+        p95 = self._p95(decision["model"])
+        while p95 is not None and p95 > slo:
+            fallback = self.config["fallbacks"].get(decision["model"])
+            if not fallback or fallback in seen:
+                break
+            decision["fallback_from"] = decision["fallback_from"] or decision["model"]
+            decision["model"] = fallback
+            seen.add(fallback)
+            p95 = self._p95(fallback)
+        decision["measured_p95"] = round(p95, 3) if p95 is not None else None
+
+        self._log(decision)
+        return decision
+
+    def record_latency(self, model: str, seconds: float):
+        """Record an observed upstream latency for a model"""
+
+        with self._lock:
+            # Samples age out, so a model that was skipped for being slow is tried again later
+            tracker = self._latency.setdefault(model, LatencyTracker(max_age=self.config["sample_max_age"]))
+        tracker.record(seconds)
+
+    def _log(self, decision: Dict[str, Any]):
+        """Keep a decision for analysis and append it to the routing log"""
+
+        self._recent.append(decision)
+        logger.info("routing decision %s", json.dumps(decision))
+
+        path = self.config.get("log_path")
+        if path:
+            try:
+                with self._lock, open(path, "a") as f:
+                    f.write(json.dumps(decision) + "\n")
+            except OSError as e:
+                logger.warning("could not write routing log: %s", e)
+
+    def recent_decisions(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Get the most recent routing decisions"""
+        return list(self._recent)[-limit:]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get per-model latency and routing counts"""
+
+        counts: Dict[str, int] = {}
+        fallbacks = 0
+        for decision in self._recent:
+            counts[decision["model"]] = counts.get(decision["model"], 0) + 1
+            fallbacks += decision["fallback_from"] is not None
+
+        return {
+            "latency_slo": self.config["latency_slo"],
+            "recent_by_model": counts,
+            "recent_fallbacks": fallbacks,
+            "p95_by_model": {model: self._p95(model) for model in self._latency}
+        }
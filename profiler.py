@@ -0,0 +1,308 @@
+"""Opt-in sampling profiler for Streamlit reruns and AIService calls
+
+When PROFILER_ENABLED is set, a daemon thread samples Python stacks every
+PROFILER_INTERVAL_MS while at least one profile is open. A profile is either
+a script rerun, which samples the script thread plus any busy worker thread,
+or an AI request, which samples only its own asyncio task, so concurrent
+requests on one event loop are told apart. A task that is suspended is
+recorded at its await point, so time spent waiting on a queue or on the
+network shows up too.
+
+Profiles slower than PROFILER_MIN_DURATION_MS are written as collapsed
+stacks ("frame;frame;frame count" lines) to PROFILER_DIR, keeping the newest
+PROFILER_MAX_FILES. Those files load directly into flamegraph.pl,
+speedscope or inferno.
+"""
+import asyncio
+import functools
+import inspect
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Dict, List, Any, Iterator, Optional, Tuple
+from config import Config
+
+# Leaf frames in these modules mean the thread is parked, not working
+_IDLE_FILES = ("threading.py", "queue.py", "selectors.py", os.path.join("concurrent", "futures", "thread.py"))
+_UNSAFE_NAME = re.compile(r"[^A-Za-z0-9_.-]+")
+
+def _label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _thread_stack(frame, stop_at=None) -> List[str]:
+    """Root-first labels for a thread's frames, cut below stop_at if it is on the stack"""
+
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        if frame is stop_at:
+            break
+        frame = frame.f_back
+    return [_label(f.f_code) for f in reversed(frames) if f.f_code.co_filename != __file__]
+
+def _await_stack(coro) -> List[str]:
+    """Root-first labels for a suspended coroutine chain, ending at what it awaits"""
+
+    labels = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            if not hasattr(coro, "cr_await") and not hasattr(coro, "gi_yieldfrom"):
+                labels.append(f"[await {type(coro).__name__.replace('FutureIter', 'Future')}]")
+            break
+        if frame.f_code.co_filename != __file__:
+            labels.append(_label(frame.f_code))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    return labels
+
+class Profile:
+    """Samples collected for one rerun or request"""
+
+    def __init__(self, kind: str, name: str, include_workers: bool):
+        self.kind = kind
+        self.name = name
+        self.include_workers = include_workers
+        self.thread_id = threading.get_ident()
+        try:
+            self.task = asyncio.current_task()
+        except RuntimeError:
+            self.task = None
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self.path: Optional[str] = None
+
+    def sample(self, frames: Dict[int, Any], threads: Dict[int, str], sampler_id: int):
+        self.samples += 1
+        if self.task is not None:
+            coro = self.task.get_coro()
+            if getattr(coro, "cr_running", False) and self.thread_id in frames:
+                stack = _thread_stack(frames[self.thread_id], stop_at=coro.cr_frame)
+            else:
+                stack = _await_stack(coro)
+            self.stacks[tuple(stack)] += 1
+            return
+
+        if self.thread_id in frames:
+            self.stacks[("script",) + tuple(_thread_stack(frames[self.thread_id]))] += 1
+        if self.include_workers:
+            for ident, frame in frames.items():
+                if ident in (self.thread_id, sampler_id) or frame.f_code.co_filename.endswith(_IDLE_FILES):
+                    continue
+                self.stacks[(f"thread:{threads.get(ident, ident)}",) + tuple(_thread_stack(frame))] += 1
+
+    def collapsed(self) -> str:
+        """Stacks in the collapsed format read by flame graph tools"""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top_frames(self, limit: int = 3) -> List[Tuple[str, int]]:
+        """Frames with the most samples at the top of the stack (self time)"""
+
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            if stack:
+                leaves[stack[-1]] += count
+        return leaves.most_common(limit)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "name": self.name,
+            "started": time.strftime("%H:%M:%S", time.localtime(self.started_at)),
+            "duration_ms": round(self.duration * 1000, 1),
+            "samples": self.samples,
+            "top": ", ".join(f"{frame} ×{count}" for frame, count in self.top_frames()),
+            "file": self.path
+        }
+
+class SamplingProfiler:
+    """Samples the stacks of open profiles on a background thread"""
+
+    def __init__(self,
+                 enabled: bool = None,
+                 interval_ms: float = None,
+                 directory: str = None,
+                 max_files: int = None,
+                 min_duration_ms: float = None):
+        self.enabled = Config.PROFILER_ENABLED if enabled is None else enabled
+        self.interval = (interval_ms or Config.PROFILER_INTERVAL_MS) / 1000
+        self.directory = directory or Config.PROFILER_DIR
+        self.max_files = max_files or Config.PROFILER_MAX_FILES
+        self.min_duration = (Config.PROFILER_MIN_DURATION_MS if min_duration_ms is None else min_duration_ms) / 1000
+        self.max_seconds = 300.0  # longer profiles are assumed abandoned
+
+        self._active: List[Profile] = []
+        self._reruns: Dict[int, Profile] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.recent = deque(maxlen=200)
+        self.stats = {"profiles": 0, "written": 0, "abandoned": 0, "sample_seconds": 0.0, "sweeps": 0}
+
+    def begin(self, kind: str, name: str = "", include_workers: bool = False) -> Optional[Profile]:
+        """Open a profile for the current thread (or asyncio task); None when disabled"""
+
+        if not self.enabled:
+            return None
+        profile = Profile(kind, name, include_workers)
+        with self._lock:
+            if kind == "rerun":
+                # A rerun interrupted by newer input never reaches end(); drop it (st.rerun()/st.stop()
+                # callers end it first, see rerun_app/stop_app in streamlit_app.py)
+                previous = self._reruns.pop(profile.thread_id, None)
+                if previous is not None and previous in self._active:
+                    self._active.remove(previous)
+                    self.stats["abandoned"] += 1
+                self._reruns[profile.thread_id] = profile
+            self._active.append(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return profile
+
+    def end(self, profile: Optional[Profile]):
+        """Close a profile and write it out if it was slow enough"""
+
+        if profile is None:
+            return
+        profile.duration = time.perf_counter() - profile.started
+        with self._lock:
+            if profile not in self._active:
+                return
+            self._active.remove(profile)
+            if self._reruns.get(profile.thread_id) is profile:
+                del self._reruns[profile.thread_id]
+            self.stats["profiles"] += 1
+        if profile.duration >= self.min_duration and profile.samples:
+            self._write(profile)
+        self.recent.append(profile.summary())
+
+    @contextmanager
+    def profile(self, kind: str, name: str = "", include_workers: bool = False) -> Iterator[Optional[Profile]]:
+        """Profile the enclosed block; nested request profiles in the same task are folded into the outer one"""
+
+        if not self.enabled or (kind == "request" and self._task_profiled()):
+            yield None
+            return
+        profile = self.begin(kind, name, include_workers)
+        try:
+            yield profile
+        finally:
+            self.end(profile)
+
+    def _task_profiled(self) -> bool:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            return False
+        return task is not None and any(p.task is task for p in list(self._active))
+
+    def _run(self):
+        sampler_id = threading.get_ident()
+        while True:
+            if not self._active:
+                self._wake.clear()
+                self._wake.wait()
+            start = time.perf_counter()
+            frames = sys._current_frames()
+            threads = {t.ident: t.name for t in threading.enumerate()}
+            with self._lock:
+                self._expire(frames)
+                active = list(self._active)
+            for profile in active:
+                try:
+                    profile.sample(frames, threads, sampler_id)
+                except Exception:
+                    # Frames and coroutines change under us; skip a torn sample
+                    pass
+            del frames
+            elapsed = time.perf_counter() - start
+            self.stats["sample_seconds"] += elapsed
+            self.stats["sweeps"] += 1
+            time.sleep(max(self.interval - elapsed, self.interval / 4))
+
+    def _expire(self, frames: Dict[int, Any]):
+        """Drop profiles whose thread or task is gone without calling end() (lock held)"""
+
+        now = time.perf_counter()
+        for profile in list(self._active):
+            gone = profile.task.done() if profile.task is not None else profile.thread_id not in frames
+            if gone or now - profile.started > self.max_seconds:
+                self._active.remove(profile)
+                if self._reruns.get(profile.thread_id) is profile:
+                    del self._reruns[profile.thread_id]
+                self.stats["abandoned"] += 1
+
+    def _write(self, profile: Profile):
+        name = _UNSAFE_NAME.sub("_", profile.name)[:60] or "unnamed"
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(profile.started_at))
+        path = os.path.join(self.directory, f"{stamp}-{profile.kind}-{name}-{int(profile.duration * 1000)}ms-{id(profile) & 0xffff:04x}.collapsed")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(profile.collapsed())
+            profile.path = path
+            self.stats["written"] += 1
+            self._rotate()
+        except OSError:
+            pass
+
+    def _rotate(self):
+        files = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith(".collapsed")),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in files[:max(0, len(files) - self.max_files)]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def slowest(self, kind: str = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """Slowest recent profiles, optionally of one kind"""
+
+        profiles = [p for p in list(self.recent) if kind is None or p["kind"] == kind]
+        return sorted(profiles, key=lambda p: -p["duration_ms"])[:limit]
+
+    def get_stats(self) -> Dict[str, Any]:
+        sweeps = self.stats["sweeps"]
+        return {
+            "enabled": self.enabled,
+            "interval_ms": self.interval * 1000,
+            "active": len(self._active),
+            "directory": self.directory,
+            "sample_us": round(self.stats["sample_seconds"] / sweeps * 1e6, 1) if sweeps else None,
+            **{key: value for key, value in self.stats.items() if key != "sample_seconds"}
+        }
+
+# Global profiler; a no-op unless PROFILER_ENABLED is set
+profiler = SamplingProfiler()
+
+def profiled(name: str):
+    """Profile each call of an async function or async generator as a "request" when enabled"""
+
+    def decorator(func):
+        if not profiler.enabled:
+            return func
+
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def generator_wrapper(*args, **kwargs):
+                with profiler.profile("request", name):
+                    async for item in func(*args, **kwargs):
+                        yield item
+            return generator_wrapper
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with profiler.profile("request", name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,279 @@
+"""Sticky reverse proxy in front of several Streamlit worker processes
+
+Streamlit keeps each session's state in the process that served its
+WebSocket, so a browser must keep talking to the same worker. The proxy
+pins clients with a cookie, places new clients on the healthy worker with
+the fewest open connections and forwards both HTTP and WebSocket traffic.
+
+With shared state configured, new clients only go to workers whose
+warm-up (warmup.py) has finished. A worker that has not run the app yet is
+nudged through Streamlit's script health check, which runs the script once
+and so starts its warm-up. While no worker is ready, requests wait up to
+PROXY_READY_TIMEOUT before going to any healthy worker.
+
+Run with:
+
+    python proxy.py --port 8501 --backends http://127.0.0.1:8511,http://127.0.0.1:8512
+
+``run.sh`` starts the workers and the proxy together when WORKERS > 1.
+"""
+import argparse
+import asyncio
+import logging
+import sqlite3
+import time
+from typing import Dict, List, Any, Optional
+import aiohttp
+from aiohttp import web, WSMsgType
+from config import Config
+from shared_state import shared_state
+
+logger = logging.getLogger(__name__)
+
+WORKER_COOKIE = "chatbot_worker"
+HEALTH_INTERVAL = 5.0
+
+# Hop-by-hop headers are connection-specific and never forwarded
+_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "content-length", "host"
+}
+_FORWARDED_HEADERS = {"x-forwarded-for", "x-forwarded-host"}
+
+class Backend:
+    """One Streamlit worker and its live connection count"""
+
+    def __init__(self, index: int, url: str, ready: bool = True):
+        self.index = index
+        self.url = url.rstrip("/")
+        self.healthy = True
+        self.ready = ready
+        self.up_since = time.time()  # readiness published before this belongs to an earlier process
+        self.trigger: Optional[asyncio.Task] = None
+        self.active = 0
+        self.requests = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"index": self.index, "url": self.url, "healthy": self.healthy, "ready": self.ready,
+                "active": self.active, "requests": self.requests}
+
+class StickyBalancer:
+    """Cookie-pinned, least-connections choice among healthy, warmed-up backends
+
+    ``readiness`` is the shared worker status table; without it every
+    healthy backend counts as ready.
+    """
+
+    def __init__(self, urls: List[str], readiness=None):
+        if not urls:
+            raise ValueError("at least one backend is required")
+        self.readiness = readiness
+        self.backends = [Backend(i, url, ready=readiness is None) for i, url in enumerate(urls)]
+        self.any_ready = asyncio.Event()
+        if readiness is None:
+            self.any_ready.set()
+
+    def pick(self, request: web.Request) -> Backend:
+        pinned = request.cookies.get(WORKER_COOKIE)
+        if pinned is not None and pinned.isdigit() and int(pinned) < len(self.backends):
+            backend = self.backends[int(pinned)]
+            if backend.healthy and backend.ready:
+                return backend
+        candidates = (
+            [b for b in self.backends if b.healthy and b.ready]
+            or [b for b in self.backends if b.healthy]
+            or self.backends
+        )
+        return min(candidates, key=lambda b: (b.active, b.requests))
+
+    async def wait_ready(self, timeout: float) -> bool:
+        """Wait until some backend is ready; False if the timeout passed first"""
+
+        try:
+            await asyncio.wait_for(self.any_ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def check_health(self, session: aiohttp.ClientSession):
+        """Mark backends healthy from Streamlit's health endpoint and ready from their published warm-up"""
+
+        for backend in self.backends:
+            try:
+                async with session.get(f"{backend.url}/_stcore/health", timeout=aiohttp.ClientTimeout(total=2)) as resp:
+                    healthy = resp.status == 200
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                healthy = False
+            if healthy != backend.healthy:
+                logger.warning("worker %s is now %s", backend.url, "healthy" if healthy else "unhealthy")
+                if healthy and self.readiness is not None:
+                    # Back after being down: a restarted process has to warm up again
+                    backend.ready = False
+                    backend.up_since = time.time()
+            backend.healthy = healthy
+            if healthy and not backend.ready:
+                self._check_ready(session, backend)
+
+        if any(b.healthy and b.ready for b in self.backends):
+            self.any_ready.set()
+        else:
+            self.any_ready.clear()
+
+    def _check_ready(self, session: aiohttp.ClientSession, backend: Backend):
+        try:
+            status = self.readiness.get(backend.url)
+        except sqlite3.Error:
+            return
+        if status is not None and status["updated"] >= backend.up_since and status["ready"]:
+            backend.ready = True
+            logger.warning("worker %s is warmed up (%ss)", backend.url, status["status"].get("seconds"))
+            return
+        if time.time() - backend.up_since > Config.PROXY_READY_TIMEOUT:
+            backend.ready = True
+            logger.warning("worker %s did not report ready within %ss; sending it traffic anyway", backend.url, Config.PROXY_READY_TIMEOUT)
+            return
+        # Nothing published by this process yet: the app has not run there, so run it once
+        if (status is None or status["updated"] < backend.up_since) and (backend.trigger is None or backend.trigger.done()):
+            backend.trigger = asyncio.create_task(self._trigger_warmup(session, backend))
+
+    @staticmethod
+    async def _trigger_warmup(session: aiohttp.ClientSession, backend: Backend):
+        """Run the worker's script once via Streamlit's script health check, starting its warm-up"""
+
+        try:
+            async with session.get(f"{backend.url}/_stcore/script-health-check", timeout=aiohttp.ClientTimeout(total=60)) as resp:
+                if resp.status == 404:
+                    logger.warning("worker %s has no script health check; it warms up on its first session", backend.url)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+
+def _forward_headers(request: web.Request) -> Dict[str, str]:
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in _HOP_HEADERS and k.lower() not in _FORWARDED_HEADERS}
+    # The proxy is the edge: a client-supplied X-Forwarded-For is replaced, never extended,
+    # since workers rate-limit on this address
+    headers["X-Forwarded-For"] = request.remote or ""
+    headers["X-Forwarded-Host"] = request.host
+    return headers
+
+async def _proxy_websocket(request: web.Request, backend: Backend) -> web.WebSocketResponse:
+    session: aiohttp.ClientSession = request.app["session"]
+    protocols = [p.strip() for p in request.headers.get("Sec-WebSocket-Protocol", "").split(",") if p.strip()]
+    headers = {k: v for k, v in _forward_headers(request).items() if not k.lower().startswith("sec-websocket")}
+
+    async with session.ws_connect(
+        f"{backend.url}{request.rel_url}", headers=headers, protocols=protocols, max_msg_size=0
+    ) as upstream:
+        downstream = web.WebSocketResponse(protocols=[upstream.protocol] if upstream.protocol else (), max_msg_size=0)
+        await downstream.prepare(request)
+
+        async def pipe(source, sink):
+            async for msg in source:
+                if msg.type == WSMsgType.TEXT:
+                    await sink.send_str(msg.data)
+                elif msg.type == WSMsgType.BINARY:
+                    await sink.send_bytes(msg.data)
+                else:
+                    break
+
+        tasks = [asyncio.create_task(pipe(downstream, upstream)), asyncio.create_task(pipe(upstream, downstream))]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await downstream.close()
+        return downstream
+
+async def _proxy_http(request: web.Request, backend: Backend) -> web.StreamResponse:
+    session: aiohttp.ClientSession = request.app["session"]
+    body = await request.read() if request.body_exists else None
+
+    async with session.request(
+        request.method, f"{backend.url}{request.rel_url}",
+        headers=_forward_headers(request), data=body, allow_redirects=False
+    ) as upstream:
+        response = web.StreamResponse(status=upstream.status, reason=upstream.reason)
+        for key, value in upstream.headers.items():
+            if key.lower() not in _HOP_HEADERS:
+                response.headers.add(key, value)
+        if request.cookies.get(WORKER_COOKIE) != str(backend.index):
+            response.set_cookie(WORKER_COOKIE, str(backend.index), httponly=True, samesite="Lax")
+        await response.prepare(request)
+        async for chunk in upstream.content.iter_chunked(64 * 1024):
+            await response.write(chunk)
+        await response.write_eof()
+        return response
+
+async def handle(request: web.Request) -> web.StreamResponse:
+    """Forward a request to the client's worker"""
+
+    balancer: StickyBalancer = request.app["balancer"]
+    if not balancer.any_ready.is_set():
+        # Hold the request while workers warm up rather than handing it a cold one
+        await balancer.wait_ready(Config.PROXY_READY_TIMEOUT)
+    backend = balancer.pick(request)
+    backend.active += 1
+    backend.requests += 1
+    try:
+        if request.headers.get("Upgrade", "").lower() == "websocket":
+            return await _proxy_websocket(request, backend)
+        return await _proxy_http(request, backend)
+    except aiohttp.ClientConnectionError:
+        backend.healthy = False
+        return web.Response(status=502, text=f"Worker {backend.index} is unavailable; reload to reconnect")
+    finally:
+        backend.active -= 1
+
+async def proxy_status(request: web.Request) -> web.Response:
+    """Worker health and connection counts"""
+
+    return web.json_response({"backends": [b.to_dict() for b in request.app["balancer"].backends]})
+
+async def _health_loop(app: web.Application):
+    while True:
+        await app["balancer"].check_health(app["session"])
+        # Poll faster while every worker is still warming up
+        await asyncio.sleep(HEALTH_INTERVAL if app["balancer"].any_ready.is_set() else 1.0)
+
+async def _on_startup(app: web.Application):
+    # Streamlit pages open many parallel asset requests; keep the pool roomy
+    app["session"] = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=0),
+        timeout=aiohttp.ClientTimeout(total=None, sock_connect=5),
+        auto_decompress=False
+    )
+    app["health_task"] = asyncio.create_task(_health_loop(app))
+
+async def _on_cleanup(app: web.Application):
+    app["health_task"].cancel()
+    await app["session"].close()
+
+def create_app(backends: List[str]) -> web.Application:
+    """Build the proxy application for the given worker URLs"""
+
+    app = web.Application(client_max_size=Config.MAX_FILE_SIZE * 2)
+    app["balancer"] = StickyBalancer(backends, shared_state.workers if shared_state else None)
+    app.on_startup.append(_on_startup)
+    app.on_cleanup.append(_on_cleanup)
+    app.router.add_get("/proxy/status", proxy_status)
+    app.router.add_route("*", "/{tail:.*}", handle)
+    return app
+
+def main(argv: Optional[list] = None):
+    config = Config.get_deployment_config()
+    parser = argparse.ArgumentParser(description="AI ChatBot Pro worker proxy")
+    parser.add_argument("--host", default=config["proxy_host"])
+    parser.add_argument("--port", type=int, default=config["proxy_port"])
+    parser.add_argument("--backends", default=",".join(config["proxy_backends"]),
+                        help="comma-separated Streamlit worker URLs")
+    args = parser.parse_args(argv)
+
+    backends = [b for b in args.backends.split(",") if b]
+    if not backends:
+        parser.error("no backends given; pass --backends or set PROXY_BACKENDS")
+
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(create_app(backends), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
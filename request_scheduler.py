@@ -0,0 +1,237 @@
+import asyncio
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+from contextlib import asynccontextmanager
+from typing import Dict, Any, AsyncIterator, Optional
+from config import Config
+
+# Highest priority first; a class is only served when every class above it is empty
+PRIORITY_CLASSES = ("interactive", "voice", "camera", "batch")
+
+class RequestDroppedError(RuntimeError):
+    """Raised when a queued request is dropped before it reaches the upstream model"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"request dropped ({reason})")
+        self.reason = reason
+
+class _Waiter:
+    __slots__ = ("priority", "user_id", "start_tag", "finish_tag", "seq", "deadline",
+                 "supersede_key", "future", "enqueued", "state")
+
+    def __init__(self, priority: str, user_id: str, deadline: Optional[float], supersede_key: Optional[str], seq: int):
+        self.priority = priority
+        self.user_id = user_id
+        self.deadline = deadline
+        self.supersede_key = supersede_key
+        self.seq = seq
+        self.future: Future = Future()
+        self.enqueued = time.monotonic()
+        self.state = "queued"  # queued -> admitted | dropped
+        self.start_tag = self.finish_tag = 0.0
+
+class RequestScheduler:
+    """Admission control for upstream AI calls shared by every session and event loop
+
+    Requests wait for one of ``max_concurrency`` slots. Slots go to the
+    highest priority class with waiters; within a class, users are served by
+    weighted fair queuing (start-time fair queuing with unit cost), so one
+    user's burst cannot starve another user of the same class. Waiters past
+    their deadline, or superseded by a newer request with the same
+    ``supersede_key``, are dropped without being sent upstream.
+
+    Slots are handed over through ``concurrent.futures.Future`` so callers
+    on different event loops (Streamlit's per-call ``asyncio.run``, the AI
+    server loop) share one scheduler.
+    """
+
+    def __init__(self, max_concurrency: int = None, deadlines: Dict[str, Optional[float]] = None):
+        self.max_concurrency = max_concurrency or Config.SCHEDULER_MAX_CONCURRENCY
+        self.deadlines = deadlines if deadlines is not None else Config.SCHEDULER_DEADLINES
+        self.weights: Dict[str, float] = {}
+
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._running = 0
+        self._queues: Dict[str, Dict[str, deque]] = {cls: {} for cls in PRIORITY_CLASSES}
+        self._virtual_time = {cls: 0.0 for cls in PRIORITY_CLASSES}
+        self._last_finish: Dict[str, Dict[str, float]] = {cls: {} for cls in PRIORITY_CLASSES}
+        self._superseding: Dict[str, _Waiter] = {}
+        self.stats = {
+            cls: {"queued": 0, "admitted": 0, "dropped_deadline": 0, "dropped_superseded": 0, "dropped_cancelled": 0, "wait_seconds": deque(maxlen=500)}
+            for cls in PRIORITY_CLASSES
+        }
+
+    def set_weight(self, user_id: str, weight: float):
+        """Give a user a larger (or smaller) share of its class; default 1.0"""
+
+        if weight <= 0:
+            raise ValueError("weight must be positive")
+        with self._lock:
+            self.weights[user_id] = weight
+
+    def _enqueue(self, priority: str, user_id: str, deadline: Optional[float], supersede_key: Optional[str]) -> _Waiter:
+        if priority not in self._queues:
+            raise ValueError(f"unknown priority class: {priority}")
+
+        with self._lock:
+            waiter = _Waiter(priority, user_id, deadline, supersede_key, next(self._seq))
+
+            if supersede_key is not None:
+                previous = self._superseding.get(supersede_key)
+                if previous is not None and previous.state == "queued":
+                    self._drop(previous, "superseded")
+                self._superseding[supersede_key] = waiter
+
+            # Start-time fair queuing: a user's tags advance by 1/weight per request
+            last_finish = self._last_finish[priority]
+            waiter.start_tag = max(self._virtual_time[priority], last_finish.get(user_id, 0.0))
+            waiter.finish_tag = waiter.start_tag + 1.0 / self.weights.get(user_id, 1.0)
+            last_finish[user_id] = waiter.finish_tag
+
+            self._queues[priority].setdefault(user_id, deque()).append(waiter)
+            self.stats[priority]["queued"] += 1
+            self._dispatch()
+            return waiter
+
+    def _drop(self, waiter: _Waiter, reason: str):
+        """Mark a queued waiter dropped; it is removed from its queue lazily (lock held)"""
+
+        waiter.state = "dropped"
+        self.stats[waiter.priority]["queued"] -= 1
+        self.stats[waiter.priority][f"dropped_{reason}"] += 1
+        if self._superseding.get(waiter.supersede_key) is waiter:
+            del self._superseding[waiter.supersede_key]
+        try:
+            waiter.future.set_exception(RequestDroppedError(reason))
+        except InvalidStateError:
+            pass
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        """Pop the waiter with the smallest finish tag in the highest non-empty class (lock held)"""
+
+        now = time.monotonic()
+        for priority in PRIORITY_CLASSES:
+            queues = self._queues[priority]
+            while queues:
+                user_id = min(queues, key=lambda u: queues[u][0].finish_tag)
+                queue = queues[user_id]
+                waiter = queue.popleft()
+                if not queue:
+                    del queues[user_id]
+                if waiter.state != "queued":
+                    continue
+                if waiter.deadline is not None and now > waiter.deadline:
+                    self._drop(waiter, "deadline")
+                    continue
+                return waiter
+        return None
+
+    def _dispatch(self):
+        """Admit waiters while slots are free (lock held)"""
+
+        while self._running < self.max_concurrency:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+
+            waiter.state = "admitted"
+            self._running += 1
+            stats = self.stats[waiter.priority]
+            stats["queued"] -= 1
+            stats["admitted"] += 1
+            stats["wait_seconds"].append(time.monotonic() - waiter.enqueued)
+            self._virtual_time[waiter.priority] = waiter.start_tag
+            if self._superseding.get(waiter.supersede_key) is waiter:
+                del self._superseding[waiter.supersede_key]
+            self._prune(waiter.priority)
+
+            try:
+                waiter.future.set_result(None)
+            except InvalidStateError:
+                # The caller gave up at the same moment; hand the slot on
+                waiter.state = "dropped"
+                self._running -= 1
+
+    def _prune(self, priority: str):
+        """Forget idle users whose finish tags the class clock has passed (lock held)"""
+
+        last_finish = self._last_finish[priority]
+        if len(last_finish) > 1000:
+            now = self._virtual_time[priority]
+            for user_id in [u for u, tag in last_finish.items() if tag <= now]:
+                del last_finish[user_id]
+
+    def _release(self):
+        with self._lock:
+            self._running -= 1
+            self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self,
+                   priority: str = "interactive",
+                   user_id: str = "default",
+                   deadline: float = None,
+                   supersede_key: str = None) -> AsyncIterator[None]:
+        """Hold one upstream slot for the block
+
+        ``deadline`` is seconds from now (defaults to the class deadline); a
+        request still queued after that raises RequestDroppedError, as does
+        one replaced by a newer request with the same ``supersede_key``.
+        """
+
+        if deadline is None:
+            deadline = self.deadlines.get(priority)
+        expires = time.monotonic() + deadline if deadline is not None else None
+        waiter = self._enqueue(priority, user_id, expires, supersede_key)
+
+        try:
+            await asyncio.wait_for(asyncio.wrap_future(waiter.future), deadline)
+        except BaseException as e:
+            with self._lock:
+                if waiter.state == "admitted":
+                    # Admitted just as we timed out or were cancelled; give the slot back
+                    self._running -= 1
+                    self._dispatch()
+                elif waiter.state == "queued":
+                    self._drop(waiter, "deadline" if isinstance(e, asyncio.TimeoutError) else "cancelled")
+            if isinstance(e, asyncio.TimeoutError):
+                raise RequestDroppedError("deadline") from e
+            raise
+
+        try:
+            yield
+        finally:
+            self._release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Running slots plus per-class queue depth, outcomes and wait percentiles"""
+
+        with self._lock:
+            classes = {}
+            for priority, stats in self.stats.items():
+                waits = sorted(stats["wait_seconds"])
+                classes[priority] = {
+                    **{key: value for key, value in stats.items() if key != "wait_seconds"},
+                    "wait_p50_ms": round(waits[len(waits) // 2] * 1000, 1) if waits else None,
+                    "wait_p95_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else None
+                }
+            queued_by_user: Dict[str, int] = {}
+            for queues in self._queues.values():
+                for user_id, queue in queues.items():
+                    count = sum(w.state == "queued" for w in queue)
+                    if count:
+                        queued_by_user[user_id] = queued_by_user.get(user_id, 0) + count
+
+        return {
+            "running": self._running,
+            "max_concurrency": self.max_concurrency,
+            "classes": classes,
+            "queued_by_user": dict(sorted(queued_by_user.items(), key=lambda item: -item[1])[:10])
+        }
+
+# Global scheduler shared by every session in the process
+request_scheduler = RequestScheduler()
@@ -0,0 +1,287 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Callable, Optional, Tuple
+from config import Config
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker rejects a call to an unhealthy upstream"""
+
+class LatencyTracker:
+    """Rolling window of upstream call latencies, optionally dropping samples older than max_age seconds"""
+
+    def __init__(self, window: int = 200, max_age: float = None):
+        self._samples = deque(maxlen=window)  # (monotonic time, seconds)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        """Record one successful call latency"""
+        with self._lock:
+            self._samples.append((time.monotonic(), seconds))
+
+    def _expire(self):
+        """Drop samples past max_age (lock held)"""
+
+        if self.max_age is None:
+            return
+        cutoff = time.monotonic() - self.max_age
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Return the q-th percentile (0-100) of recorded latencies"""
+
+        with self._lock:
+            self._expire()
+            samples = sorted(seconds for _, seconds in self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(q / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire()
+            return len(self._samples)
+
+class CircuitBreaker:
+    """Closed / open / half-open circuit breaker for the upstream model API"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """Check whether a call may go upstream right now"""
+
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                # Let a single probe through to test recovery
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        """Close the circuit after a successful call"""
+
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """Let another probe through after one that ended without a verdict on upstream health"""
+
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        """Count an upstream failure, opening the circuit past the threshold"""
+
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def get_state(self) -> Dict[str, Any]:
+        """Get circuit breaker state"""
+
+        with self._lock:
+            retry_in = 0.0
+            if self.state == self.OPEN:
+                retry_in = max(0.0, self.recovery_timeout - (time.monotonic() - self.opened_at))
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "trips": self.trips,
+                "retry_in_seconds": round(retry_in, 1)
+            }
+
+class RetryPolicy:
+    """Exponential backoff with full jitter for throttled or failing upstream calls"""
+
+    RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+    def __init__(self, max_retries: int = 3, base_delay: float = 0.5, max_delay: float = 20.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def status_of(error: Exception) -> Optional[int]:
+        """Extract an HTTP status code from an OpenAI or requests exception"""
+
+        for attr in ("http_status", "status_code", "status"):
+            status = getattr(error, attr, None)
+            if isinstance(status, int):
+                return status
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+        return status if isinstance(status, int) else None
+
+    def is_retryable(self, error: Exception) -> bool:
+        """Retry on 429/5xx and on timeouts or dropped connections"""
+
+        status = self.status_of(error)
+        if status is not None:
+            return status in self.RETRYABLE_STATUS
+        if isinstance(error, (TimeoutError, ConnectionError, asyncio.TimeoutError)):
+            return True
+        name = type(error).__name__
+        return "Timeout" in name or "Connection" in name or name == "ServiceUnavailableError"
+
+    @staticmethod
+    def retry_after(error: Exception) -> Optional[float]:
+        """Read a Retry-After header (seconds or HTTP date) from an exception"""
+
+        headers = getattr(error, "headers", None)
+        if headers is None:
+            headers = getattr(getattr(error, "response", None), "headers", None)
+        if not headers:
+            return None
+
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                return None
+
+    def delay(self, attempt: int, error: Exception = None) -> float:
+        """Backoff before the given retry attempt, honoring Retry-After"""
+
+        hinted = self.retry_after(error) if error is not None else None
+        if hinted is not None:
+            return min(hinted, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+class ResilientCaller:
+    """Runs blocking upstream calls with retries, hedging and a circuit breaker"""
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = config or Config.get_resilience_config()
+        self.retry_policy = RetryPolicy(
+            self.config["max_retries"],
+            self.config["base_delay"],
+            self.config["max_delay"]
+        )
+        self.breaker = CircuitBreaker(
+            self.config["breaker_failure_threshold"],
+            self.config["breaker_recovery_timeout"]
+        )
+        self.latency = LatencyTracker()
+        self.stats = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "failures": 0, "rejected": 0}
+
+    def hedge_delay(self) -> Optional[float]:
+        """Delay before a duplicate request is sent, from the observed p95"""
+
+        if not self.config["hedge_enabled"] or len(self.latency) < self.config["hedge_min_samples"]:
+            return None
+        return self.latency.percentile(self.config["hedge_percentile"])
+
+    async def _attempt(self, func: Callable, *args, **kwargs) -> Tuple[Any, float]:
+        """Run one (possibly hedged) attempt in worker threads; returns the result and its latency"""
+
+        start = time.perf_counter()
+        primary = asyncio.ensure_future(asyncio.to_thread(func, *args, **kwargs))
+        delay = self.hedge_delay()
+        pending = {primary}
+
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done:
+                    self.stats["hedges"] += 1
+                    pending.add(asyncio.ensure_future(asyncio.to_thread(func, *args, **kwargs)))
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=lambda t: t.exception() is not None):
+                    if task.exception() is None or not pending:
+                        if task is not primary and task.exception() is None:
+                            self.stats["hedge_wins"] += 1
+                        result = task.result()
+                        elapsed = time.perf_counter() - start
+                        self.latency.record(elapsed)
+                        return result, elapsed
+        finally:
+            # The losing request keeps its thread until it returns; its result is discarded
+            for task in pending:
+                task.cancel()
+
+    async def call(self, func: Callable, *args, **kwargs):
+        """Call a blocking upstream function with the full resilience policy"""
+
+        result, _ = await self.call_timed(func, *args, **kwargs)
+        return result
+
+    async def call_timed(self, func: Callable, *args, **kwargs) -> Tuple[Any, float]:
+        """Like call, also returning the latency of the attempt that succeeded (no backoff or earlier attempts)"""
+
+        self.stats["calls"] += 1
+        for attempt in range(self.retry_policy.max_retries + 1):
+            if not self.breaker.allow_request():
+                self.stats["rejected"] += 1
+                raise CircuitOpenError("Upstream circuit is open")
+
+            recorded = False
+            try:
+                result, elapsed = await self._attempt(func, *args, **kwargs)
+            except Exception as e:
+                if not self.retry_policy.is_retryable(e):
+                    # Client errors say nothing about upstream health
+                    raise
+                self.breaker.record_failure()
+                recorded = True
+                if attempt >= self.retry_policy.max_retries:
+                    self.stats["failures"] += 1
+                    raise
+                self.stats["retries"] += 1
+                await asyncio.sleep(self.retry_policy.delay(attempt, e))
+            else:
+                self.breaker.record_success()
+                recorded = True
+                return result, elapsed
+            finally:
+                if not recorded:
+                    # Client errors and cancellation (e.g. a dropped queue waiter) must not hold the half-open probe
+                    self.breaker.release_probe()
+
+    def get_state(self) -> Dict[str, Any]:
+        """Get resilience layer state for status reporting"""
+
+        p50 = self.latency.percentile(50)
+        p95 = self.latency.percentile(95)
+        return {
+            "circuit": self.breaker.get_state(),
+            "latency_p50": round(p50, 3) if p50 is not None else None,
+            "latency_p95": round(p95, 3) if p95 is not None else None,
+            "hedge_delay": self.hedge_delay(),
+            **self.stats
+        }
@@ -11,9 +11,36 @@ if ! command -v streamlit &> /dev/null; then
     pip install -r requirements.txt
 fi
 
-# Start the application
-echo "🚀 Launching AI ChatBot Pro on http://localhost:8501"
+# WORKERS=N runs N Streamlit processes behind proxy.py, sharing one SQLite state store
+WORKERS=${WORKERS:-1}
+PORT=${PORT:-8501}
+
+echo "🚀 Launching AI ChatBot Pro on http://localhost:$PORT"
 echo "📝 Note: Some advanced features require API keys (see .env.example)"
 echo "🎯 Press Ctrl+C to stop the application"
 
-streamlit run streamlit_app.py --server.port 8501 --server.address 0.0.0.0
\ No newline at end of file
+if [ "$WORKERS" -le 1 ]; then
+    streamlit run streamlit_app.py --server.port "$PORT" --server.address 0.0.0.0
+    exit $?
+fi
+
+export SHARED_STATE_PATH=${SHARED_STATE_PATH:-/tmp/ai_chatbot_shared.db}
+BASE_PORT=${WORKER_BASE_PORT:-8511}
+BACKENDS=""
+PIDS=()
+
+trap 'kill "${PIDS[@]}" 2>/dev/null; wait' EXIT INT TERM
+
+for ((i = 0; i < WORKERS; i++)); do
+    WORKER_PORT=$((BASE_PORT + i))
+    # WORKER_URL keys this worker's warm-up status; the script health check lets the proxy start the warm-up
+    WORKER_URL="http://127.0.0.1:$WORKER_PORT" streamlit run streamlit_app.py --server.port "$WORKER_PORT" \
+        --server.address 127.0.0.1 --server.headless true --server.scriptHealthCheckEnabled true &
+    PIDS+=($!)
+    BACKENDS="${BACKENDS:+$BACKENDS,}http://127.0.0.1:$WORKER_PORT"
+done
+
+echo "🧵 $WORKERS workers on ports $BASE_PORT-$((BASE_PORT + WORKERS - 1)), shared state in $SHARED_STATE_PATH"
+python proxy.py --host 0.0.0.0 --port "$PORT" --backends "$BACKENDS" &
+PIDS+=($!)
+wait -n
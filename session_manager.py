@@ -0,0 +1,436 @@
+import logging
+import os
+import pickle
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from collections.abc import MutableSequence
+from datetime import datetime
+from typing import Dict, List, Any, Iterator
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_TYPE_CODES = {"user": 0, "bot": 1}
+_TYPE_NAMES = {code: name for name, code in _TYPE_CODES.items()}
+_SOURCE_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def private_directory(directory: str):
+    """Create directory as 0700, or check an existing one is ours and closed to others
+
+    For directories holding pickles or user data under a shared default
+    such as /tmp; raises PermissionError when another user could plant files.
+    """
+
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.stat(directory)
+    if hasattr(os, "getuid") and info.st_uid != os.getuid():
+        raise PermissionError(f"{directory} is owned by another user")
+    if info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"{directory} is writable by other users")
+    if info.st_mode & 0o077:
+        os.chmod(directory, 0o700)
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def pack_message(msg: Dict[str, Any]) -> tuple:
+    """Pack a chat entry dict into a compact tuple
+
+    Layout: (type, epoch seconds, content, sources, extras). The ``sources``
+    dict becomes a tuple whose timestamp is dropped when it matches the
+    message time, and rarely used keys travel in ``extras``.
+    """
+
+    timestamp = msg.get('timestamp')
+    epoch = timestamp.timestamp() if isinstance(timestamp, datetime) else float(timestamp or time.time())
+
+    sources = msg.get('sources')
+    packed_sources = None
+    if sources is not None:
+        source_time = sources.get('timestamp')
+        if source_time == datetime.fromtimestamp(epoch).strftime(_SOURCE_TIME_FORMAT):
+            source_time = None
+        known = ('timestamp', 'sources', 'confidence', 'error', 'real_time')
+        extra = {k: v for k, v in sources.items() if k not in known} or None
+        packed_sources = (
+            source_time,
+            tuple(sources.get('sources') or ()),
+            sys.intern(sources['confidence']) if isinstance(sources.get('confidence'), str) else sources.get('confidence'),
+            sources.get('error'),
+            sources.get('real_time', True),
+            extra
+        )
+
+    extras = {k: v for k, v in msg.items() if k not in ('type', 'timestamp', 'content', 'sources')} or None
+    msg_type = msg.get('type')
+    return (_TYPE_CODES.get(msg_type, msg_type), epoch, msg.get('content', ''), packed_sources, extras)
+
+def unpack_message(record: tuple) -> Dict[str, Any]:
+    """Rebuild the chat entry dict the UI expects from a packed tuple"""
+
+    msg_type, epoch, content, packed_sources, extras = record
+    timestamp = datetime.fromtimestamp(epoch)
+    msg = {
+        'type': _TYPE_NAMES.get(msg_type, msg_type),
+        'content': content,
+        'timestamp': timestamp
+    }
+    if packed_sources is not None:
+        source_time, urls, confidence, error, real_time, extra = packed_sources
+        msg['sources'] = {
+            'timestamp': source_time or timestamp.strftime(_SOURCE_TIME_FORMAT),
+            'sources': list(urls),
+            'confidence': confidence,
+            'error': error,
+            'real_time': real_time,
+            **(extra or {})
+        }
+    if extras:
+        msg.update(extras)
+    return msg
+
+def record_size(record: tuple) -> int:
+    """Approximate bytes held by a packed record"""
+
+    size = sys.getsizeof(record) + sys.getsizeof(record[2])
+    if record[3] is not None:
+        size += sys.getsizeof(record[3]) + sum(sys.getsizeof(url) for url in record[3][1])
+        if record[3][3]:
+            size += sys.getsizeof(record[3][3])
+        if record[3][5]:
+            size += sys.getsizeof(pickle.dumps(record[3][5]))
+    if record[4]:
+        size += sys.getsizeof(pickle.dumps(record[4]))
+    return size
+
+class CompactChatHistory(MutableSequence):
+    """List-like chat history storing packed tuples, with the oldest entries spillable to disk
+
+    Indexing and iteration return ordinary message dicts, so existing code
+    that reads ``st.session_state.chat_history`` keeps working. Slices return
+    plain lists and read only the spilled records they cover, so rendering a
+    window of recent messages never decodes the whole history.
+
+    A history restored from a session snapshot keeps only its newest records
+    in memory; the older ones stay in the snapshot's ``archive`` and count as
+    spilled, ahead of any records spilled afterwards.
+
+    Spilled records are pickled, so the spill directory must be private
+    (see ``private_directory``). The spill file is deleted when the history
+    is garbage collected, i.e. when Streamlit drops the session holding it.
+    """
+
+    def __init__(self, spill_path: str):
+        self.spill_path = spill_path
+        self._records: List[tuple] = []
+        self._spilled = 0
+        self._archive = None
+        self.bytes = 0
+        self.generation = 0  # bumped whenever existing entries change, not on append
+        self._lock = threading.RLock()
+        weakref.finalize(self, _remove_file, spill_path)
+
+    def __len__(self) -> int:
+        return self._spilled + len(self._records)
+
+    def _iter_spill_file(self) -> Iterator[List[tuple]]:
+        """Chunks of records in the spill file, one per spill() call"""
+
+        if not os.path.exists(self.spill_path):
+            return
+        with open(self.spill_path, "rb") as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    break
+
+    def _read_spilled(self, start: int = 0, stop: int = None) -> List[tuple]:
+        """Load spilled records [start, stop) from disk, stopping once stop is reached"""
+
+        stop = self._spilled if stop is None else min(stop, self._spilled)
+        archived = len(self._archive) if self._archive is not None else 0
+        records = self._archive.read(start, stop) if start < archived else []
+        if stop > archived:
+            position = archived
+            for chunk in self._iter_spill_file():
+                if position + len(chunk) > start:
+                    records.extend(chunk[max(start - position, 0):stop - position])
+                position += len(chunk)
+                if position >= stop:
+                    break
+        return records
+
+    def _all_records(self) -> List[tuple]:
+        with self._lock:
+            return self._read_spilled() + self._records if self._spilled else list(self._records)
+
+    def __getitem__(self, index):
+        with self._lock:
+            if isinstance(index, slice):
+                start, stop, step = index.indices(len(self))
+                if step != 1:
+                    records = self._all_records()[index]
+                elif start >= self._spilled:
+                    records = self._records[start - self._spilled:stop - self._spilled]
+                else:
+                    records = self._read_spilled(start, stop) + self._records[:max(stop - self._spilled, 0)]
+                return [unpack_message(record) for record in records]
+
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError("chat history index out of range")
+            if index >= self._spilled:
+                return unpack_message(self._records[index - self._spilled])
+            return unpack_message(self._read_spilled(index, index + 1)[0])
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        # Reads every spilled record; UI code that renders each rerun should slice a window instead
+        for record in self._all_records():
+            yield unpack_message(record)
+
+    def __reversed__(self) -> Iterator[Dict[str, Any]]:
+        for record in reversed(self._all_records()):
+            yield unpack_message(record)
+
+    def _rewrite(self, records: List[tuple]):
+        """Replace the whole history, bringing spilled records back into memory"""
+
+        self._discard_spill()
+        self._records = records
+        self.bytes = sum(record_size(record) for record in records)
+        self.generation += 1
+
+    def __setitem__(self, index, value):
+        with self._lock:
+            records = self._all_records()
+            if isinstance(index, slice):
+                records[index] = [pack_message(msg) for msg in value]
+            else:
+                records[index] = pack_message(value)
+            self._rewrite(records)
+
+    def __delitem__(self, index):
+        with self._lock:
+            records = self._all_records()
+            del records[index]
+            self._rewrite(records)
+
+    def insert(self, index: int, value: Dict[str, Any]):
+        with self._lock:
+            if index >= len(self):
+                self.append(value)
+                return
+            records = self._all_records()
+            records.insert(index, pack_message(value))
+            self._rewrite(records)
+
+    def append(self, value: Dict[str, Any]):
+        record = pack_message(value)
+        with self._lock:
+            self._records.append(record)
+            self.bytes += record_size(record)
+
+    def records_since(self, start: int) -> List[tuple]:
+        """Packed records from position start onwards"""
+
+        with self._lock:
+            if start >= self._spilled:
+                return self._records[start - self._spilled:]
+            return self._all_records()[start:]
+
+    def restore(self, archive, recent: List[tuple]):
+        """Replace the contents with a snapshot: older records in archive, newest in memory"""
+
+        with self._lock:
+            self._discard_spill()
+            self._archive = archive
+            self._spilled = len(archive)
+            self._records = list(recent)
+            self.bytes = sum(record_size(record) for record in self._records)
+
+    def clear(self):
+        with self._lock:
+            self._rewrite([])
+
+    def trim(self, keep_last: int):
+        """Drop all but the newest keep_last messages"""
+
+        with self._lock:
+            if len(self) > keep_last:
+                self._rewrite(self._all_records()[-keep_last:] if keep_last else [])
+
+    def spill(self, keep_in_memory: int) -> int:
+        """Move all but the newest keep_in_memory records to disk; returns bytes freed"""
+
+        with self._lock:
+            count = len(self._records) - keep_in_memory
+            if count <= 0:
+                return 0
+            moving, self._records = self._records[:count], self._records[count:]
+            private_directory(os.path.dirname(self.spill_path))
+            # Start a fresh file on the first spill so a leftover file at this path is never read back
+            archived = len(self._archive) if self._archive is not None else 0
+            with open(self.spill_path, "ab" if self._spilled > archived else "wb") as f:
+                pickle.dump(moving, f, protocol=pickle.HIGHEST_PROTOCOL)
+            self._spilled += len(moving)
+            freed = sum(record_size(record) for record in moving)
+            self.bytes -= freed
+            return freed
+
+    def _discard_spill(self):
+        self._spilled = 0
+        self._archive = None
+        try:
+            os.remove(self.spill_path)
+        except FileNotFoundError:
+            pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get in-memory and spilled message counts"""
+
+        return {
+            "messages": len(self),
+            "in_memory": len(self._records),
+            "spilled": self._spilled,
+            "archived": len(self._archive) if self._archive is not None else 0,
+            "bytes": self.bytes
+        }
+
+class SessionManager:
+    """Process-wide registry enforcing memory caps and idle eviction for Streamlit sessions"""
+
+    def __init__(self,
+                 session_limit: int = None,
+                 global_limit: int = None,
+                 idle_timeout: int = None,
+                 spill_dir: str = None):
+        self.session_limit = session_limit or Config.SESSION_MEMORY_LIMIT
+        self.global_limit = global_limit or Config.GLOBAL_SESSION_MEMORY_LIMIT
+        self.idle_timeout = idle_timeout or Config.SESSION_TIMEOUT
+        self.spill_dir = spill_dir or Config.SESSION_SPILL_DIR
+        try:
+            private_directory(self.spill_dir)
+        except PermissionError as e:
+            # Spilled history is pickled; never read it from a directory others can write to
+            self.spill_dir = tempfile.mkdtemp(prefix="ai_chatbot_sessions-")
+            logger.error("%s; spilling chat history to %s instead", e, self.spill_dir)
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"evicted_sessions": 0, "spills": 0, "spilled_bytes": 0}
+
+    @staticmethod
+    def current_session_id() -> str:
+        """Streamlit's id for the session running this script"""
+
+        try:
+            from streamlit.runtime.scriptrunner import get_script_run_ctx
+            ctx = get_script_run_ctx()
+            if ctx is not None:
+                return ctx.session_id
+        except ImportError:
+            pass
+        return "default"
+
+    def create_history(self, session_id: str) -> CompactChatHistory:
+        """Register a session and return its compact chat history"""
+
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is None:
+                path = os.path.join(self.spill_dir, f"{session_id}.spill")
+                record = {"history": CompactChatHistory(path), "last_seen": time.time()}
+                self._sessions[session_id] = record
+            return record["history"]
+
+    def adopt(self, session_id: str, history: CompactChatHistory):
+        """Register a history again after idle eviction, e.g. when its tab comes back"""
+
+        with self._lock:
+            if session_id not in self._sessions:
+                self._sessions[session_id] = {"history": history, "last_seen": time.time()}
+
+    def touch(self, session_id: str):
+        """Mark a session active, enforce caps and evict idle sessions"""
+
+        now = time.time()
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is not None:
+                record["last_seen"] = now
+                history = record["history"]
+                if history.bytes > self.session_limit:
+                    self._spill(history, keep_in_memory=len(history._records) // 2)
+            self._evict_idle(now)
+            self._enforce_global_limit()
+
+    def _spill(self, history: CompactChatHistory, keep_in_memory: int):
+        freed = history.spill(keep_in_memory)
+        if freed:
+            self.stats["spills"] += 1
+            self.stats["spilled_bytes"] += freed
+
+    def _evict_idle(self, now: float):
+        for session_id, record in list(self._sessions.items()):
+            if now - record["last_seen"] > self.idle_timeout:
+                # The tab may still hold the history in st.session_state and come back to it: spill it
+                # to disk rather than drop it (contents are unchanged, so snapshots see no edit)
+                self._spill(record["history"], keep_in_memory=0)
+                del self._sessions[session_id]
+                self.stats["evicted_sessions"] += 1
+
+    def _enforce_global_limit(self):
+        """Spill the largest sessions first until total usage fits the global cap"""
+
+        total = sum(record["history"].bytes for record in self._sessions.values())
+        for record in sorted(self._sessions.values(), key=lambda r: -r["history"].bytes):
+            if total <= self.global_limit:
+                break
+            history = record["history"]
+            before = history.bytes
+            self._spill(history, keep_in_memory=min(10, len(history._records)))
+            total -= before - history.bytes
+
+    def evict_idle(self):
+        """Evict sessions idle longer than the timeout"""
+
+        with self._lock:
+            self._evict_idle(time.time())
+
+    def get_memory_report(self) -> Dict[str, Any]:
+        """Per-session and total memory usage"""
+
+        now = time.time()
+        with self._lock:
+            sessions = [
+                {
+                    "session_id": session_id,
+                    "idle_seconds": round(now - record["last_seen"]),
+                    **record["history"].get_stats()
+                }
+                for session_id, record in self._sessions.items()
+            ]
+        sessions.sort(key=lambda s: -s["bytes"])
+        return {
+            "sessions": sessions,
+            "total_bytes": sum(s["bytes"] for s in sessions),
+            "session_limit": self.session_limit,
+            "global_limit": self.global_limit,
+            **self.stats
+        }
+
+    def shutdown(self):
+        """Remove all spill files"""
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+# Global session manager shared by every session in the process
+session_manager = SessionManager()
@@ -0,0 +1,425 @@
+import logging
+import os
+import pickle
+import re
+import struct
+import threading
+import time
+import zlib
+from bisect import bisect_right
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Any, Optional, Tuple
+from config import Config
+from session_manager import CompactChatHistory, private_directory
+
+try:
+    import zstandard
+except ImportError:  # optional; zlib is always available
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; tabs sharing a sid then rely on the process-wide lock alone
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Data file: magic, then frames of (header, compressed pickled list of packed records)
+_DATA_MAGIC = b"CBSNAP1\n"
+_FRAME = struct.Struct("<4sBIII")  # frame magic, codec, record count, payload length, crc32 of payload
+_FRAME_MAGIC = b"BLK1"
+
+# Index sidecar: magic, then one fixed-size entry per frame so the tail can be found by seeking
+_INDEX_MAGIC = b"CBSIDX1\n"
+_ENTRY = struct.Struct("<QIQI")  # frame offset, frame length, first message position, record count
+
+CODEC_ZLIB = 0
+CODEC_ZSTD = 1
+
+_SNAPSHOT_ID = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+class SnapshotCorruptError(ValueError):
+    """Raised when a snapshot frame or index entry fails validation"""
+
+def encode_frame(records: List[tuple], codec: int) -> bytes:
+    """Serialize and compress one block of packed records"""
+
+    raw = pickle.dumps(records, protocol=pickle.HIGHEST_PROTOCOL)
+    if codec == CODEC_ZSTD:
+        payload = zstandard.ZstdCompressor(level=3).compress(raw)
+    else:
+        payload = zlib.compress(raw, 6)
+    return _FRAME.pack(_FRAME_MAGIC, codec, len(records), len(payload), zlib.crc32(payload)) + payload
+
+def decode_frame(data: bytes) -> List[tuple]:
+    """Validate and decompress one frame produced by encode_frame"""
+
+    if len(data) < _FRAME.size:
+        raise SnapshotCorruptError("truncated frame header")
+    magic, codec, count, length, crc = _FRAME.unpack_from(data)
+    payload = data[_FRAME.size:_FRAME.size + length]
+    if magic != _FRAME_MAGIC or len(payload) != length or zlib.crc32(payload) != crc:
+        raise SnapshotCorruptError("bad frame")
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise SnapshotCorruptError("snapshot uses zstd but zstandard is not installed")
+        raw = zstandard.ZstdDecompressor().decompress(payload)
+    elif codec == CODEC_ZLIB:
+        raw = zlib.decompress(payload)
+    else:
+        raise SnapshotCorruptError(f"unknown codec {codec}")
+    records = pickle.loads(raw)
+    if len(records) != count:
+        raise SnapshotCorruptError("record count mismatch")
+    return records
+
+def _read_entries(index_path: str, start: int, stop: int) -> List[Tuple[int, int, int, int]]:
+    with open(index_path, "rb") as f:
+        f.seek(len(_INDEX_MAGIC) + start * _ENTRY.size)
+        data = f.read((stop - start) * _ENTRY.size)
+    return list(_ENTRY.iter_unpack(data))
+
+def _read_frames(data_path: str, entries: List[Tuple[int, int, int, int]]) -> List[tuple]:
+    """Decode a run of consecutive frames with a single read"""
+
+    if not entries:
+        return []
+    begin = entries[0][0]
+    with open(data_path, "rb") as f:
+        f.seek(begin)
+        data = f.read(entries[-1][0] + entries[-1][1] - begin)
+    records = []
+    for offset, length, _, _ in entries:
+        records.extend(decode_frame(data[offset - begin:offset - begin + length]))
+    return records
+
+class SnapshotArchive:
+    """Older, sealed blocks of a restored snapshot, decoded only when read"""
+
+    def __init__(self, data_path: str, index_path: str, frames: int, count: int):
+        self.data_path = data_path
+        self.index_path = index_path
+        self.frames = frames
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def read(self, start: int = 0, stop: int = None) -> List[tuple]:
+        """Records [start, stop), reading only the blocks that hold them"""
+
+        stop = self.count if stop is None else min(stop, self.count)
+        if start >= stop:
+            return []
+        entries = _read_entries(self.index_path, 0, self.frames)
+        firsts = [entry[2] for entry in entries]
+        lo = bisect_right(firsts, start) - 1
+        hi = bisect_right(firsts, stop - 1)
+        records = _read_frames(self.data_path, entries[lo:hi])
+        base = entries[lo][2]
+        return records[start - base:stop - base]
+
+class SessionSnapshot:
+    """Append-only compressed snapshot of one session's chat history
+
+    ``save`` writes only the messages added since the previous save. New
+    messages go into the last block until it holds ``block_messages``
+    records; only that open block is ever rewritten. Sealed blocks never
+    change, so a restore reads the index tail and the last few blocks, and
+    older blocks are decoded only if the history is read that far back.
+    Edits to existing entries (clear, delete) rewrite the whole snapshot.
+
+    Several tabs (or worker processes) can open the same ``sid``. Every
+    read and write holds the snapshot's file lock, and an append starts
+    from the tail on disk rather than from where this tab last wrote, so
+    the tabs' messages interleave instead of overwriting each other's
+    blocks. Files are only created by the first save that has something
+    to write.
+    """
+
+    def __init__(self, store: "SnapshotStore", snapshot_id: str, history: CompactChatHistory):
+        self.store = store
+        self.snapshot_id = snapshot_id
+        self.history = history
+        self.data_path, self.index_path = store.paths(snapshot_id)
+        self._lock = threading.Lock()
+        self._saved = 0
+        self._generation = history.generation
+        self._stale = False  # files on disk are unreadable and must be replaced
+        self._tail = None  # (frames, last index entry) as this object last left them
+        self._reset_open(0, 0, len(_DATA_MAGIC))
+
+    def _reset_open(self, frame: int, first: int, offset: int, records: List[tuple] = None):
+        """Position the open (still growing) block"""
+
+        self._open = records or []
+        self._open_frame = frame
+        self._open_first = first
+        self._open_offset = offset
+
+    def restore(self) -> int:
+        """Load the newest blocks into the history; returns the restored message count"""
+
+        if not os.path.exists(self.index_path):
+            return 0  # checked first so sessions that never save leave no files, not even a lock
+        with self._lock, self.store.locked(self.snapshot_id):
+            try:
+                frames = (os.path.getsize(self.index_path) - len(_INDEX_MAGIC)) // _ENTRY.size
+            except OSError:
+                return 0
+            if frames <= 0:
+                return 0
+
+            try:
+                # Walk back from the last block until the restore tail is covered
+                tail: List[Tuple[int, int, int, int]] = []
+                position = frames
+                while position > 0 and sum(entry[3] for entry in tail) < self.store.restore_tail:
+                    position -= 1
+                    tail[:0] = _read_entries(self.index_path, position, position + 1)
+                recent = _read_frames(self.data_path, tail)
+            except (OSError, struct.error, SnapshotCorruptError, pickle.UnpicklingError, zlib.error) as e:
+                logger.warning("discarding unreadable session snapshot %s: %s", self.snapshot_id, e)
+                self._stale = True
+                return 0
+
+            archive = SnapshotArchive(self.data_path, self.index_path, position, tail[0][2])
+            self.history.restore(archive, recent)
+            self._generation = self.history.generation
+
+            _, _, first, count = tail[-1]
+            self._saved = first + count
+            self._position_after(frames, tail[-1], recent[len(recent) - count:])
+            return self._saved
+
+    def _position_after(self, frames: int, entry: Tuple[int, int, int, int], last: List[tuple]):
+        """Point the open block at the end of a snapshot whose last index entry is ``entry``"""
+
+        offset, length, first, count = entry
+        if count < self.store.block_messages:
+            self._reset_open(frames - 1, first, offset, last)
+        else:
+            self._reset_open(frames, first + count, offset + length)
+        self._tail = (frames, entry)
+
+    def _sync_tail(self):
+        """Catch up with blocks another tab appended since this one last wrote (file lock held)"""
+
+        frames = (os.path.getsize(self.index_path) - len(_INDEX_MAGIC)) // _ENTRY.size
+        if frames <= 0:
+            self._reset_open(0, 0, len(_DATA_MAGIC))
+            self._tail = None
+            return
+        entry = _read_entries(self.index_path, frames - 1, frames)[0]
+        if self._tail == (frames, entry):
+            return
+        last = _read_frames(self.data_path, [entry]) if entry[3] < self.store.block_messages else []
+        self._position_after(frames, entry, last)
+
+    def save(self) -> int:
+        """Persist messages added since the last save; returns the number written"""
+
+        history = self.history
+        with self._lock:
+            if history.generation == self._generation and len(history) == self._saved:
+                return 0
+            with self.store.locked(self.snapshot_id):
+                if (self._stale or history.generation != self._generation or len(history) < self._saved
+                        or not os.path.exists(self.index_path)):
+                    return self._rewrite()
+
+                new = history.records_since(self._saved)
+                if not new:
+                    return 0
+                try:
+                    self._sync_tail()
+                except (struct.error, SnapshotCorruptError, pickle.UnpicklingError, zlib.error) as e:
+                    logger.warning("replacing unreadable session snapshot %s: %s", self.snapshot_id, e)
+                    return self._rewrite()
+                with open(self.data_path, "r+b") as data, open(self.index_path, "r+b") as index:
+                    self._write_blocks(data, index, self._open + new)
+            self._saved += len(new)
+            self.store.stats["saved_messages"] += len(new)
+            return len(new)
+
+    def _write_blocks(self, data, index, records: List[tuple]):
+        """Write records as blocks starting at the open block, replacing it"""
+
+        size = self.store.block_messages
+        frames, entries = [], []
+        offset, first = self._open_offset, self._open_first
+        for i in range(0, len(records), size):
+            block = records[i:i + size]
+            frame = encode_frame(block, self.store.codec)
+            entries.append(_ENTRY.pack(offset, len(frame), first, len(block)))
+            frames.append(frame)
+            offset += len(frame)
+            first += len(block)
+
+        data.seek(self._open_offset)
+        data.write(b"".join(frames))
+        data.truncate()
+        index.seek(len(_INDEX_MAGIC) + self._open_frame * _ENTRY.size)
+        index.write(b"".join(entries))
+        index.truncate()
+        self.store.stats["bytes_written"] += sum(map(len, frames)) + sum(map(len, entries))
+
+        last = records[(len(frames) - 1) * size:]
+        entry = _ENTRY.unpack(entries[-1])
+        self._position_after(self._open_frame + len(frames), entry, last)
+
+    def _rewrite(self) -> int:
+        """Write the whole history to fresh files and swap them in (file lock held)"""
+
+        records = self.history.records_since(0)
+        self._stale = False
+        self._tail = None
+        self._reset_open(0, 0, len(_DATA_MAGIC))
+        if records:
+            tmp_data, tmp_index = f"{self.data_path}.tmp", f"{self.index_path}.tmp"
+            with open(tmp_data, "wb") as data, open(tmp_index, "wb") as index:
+                data.write(_DATA_MAGIC)
+                index.write(_INDEX_MAGIC)
+                self._write_blocks(data, index, records)
+            os.replace(tmp_data, self.data_path)
+            os.replace(tmp_index, self.index_path)
+        else:
+            # A cleared history leaves nothing to restore
+            self.store.delete(self.snapshot_id)
+        self._saved = len(records)
+        self._generation = self.history.generation
+        self.store.stats["rewrites"] += 1
+        return len(records)
+
+class SnapshotStore:
+    """Directory of per-session chat snapshots keyed by the ``sid`` URL parameter
+
+    Snapshots are unpickled on restore, so the directory must be private:
+    it is created 0700, and one owned by another user or writable by
+    others is refused with PermissionError. Snapshots not saved for
+    SESSION_SNAPSHOT_MAX_AGE seconds are pruned when the store starts and
+    then at most every PRUNE_INTERVAL seconds as sessions open.
+    """
+
+    PRUNE_INTERVAL = 3600
+
+    def __init__(self,
+                 directory: str = None,
+                 codec: str = None,
+                 block_messages: int = None,
+                 restore_tail: int = None,
+                 max_age: float = None):
+        self.directory = directory or Config.SESSION_SNAPSHOT_DIR
+        codec = (codec or Config.SESSION_SNAPSHOT_CODEC).lower()
+        if codec == "zstd" and zstandard is None:
+            logger.info("zstandard is not installed; session snapshots use zlib")
+            codec = "zlib"
+        self.codec = CODEC_ZSTD if codec == "zstd" else CODEC_ZLIB
+        self.block_messages = block_messages or Config.SESSION_SNAPSHOT_BLOCK_MESSAGES
+        self.restore_tail = restore_tail or Config.SESSION_RESTORE_TAIL
+        self.max_age = max_age or Config.SESSION_SNAPSHOT_MAX_AGE
+        private_directory(self.directory)
+        self.restore_seconds = deque(maxlen=200)
+        self.stats = {"restores": 0, "restored_messages": 0, "saved_messages": 0, "rewrites": 0, "bytes_written": 0,
+                      "pruned": 0}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self._next_prune = 0.0
+        self.prune()
+
+    @staticmethod
+    def valid_id(snapshot_id: Optional[str]) -> bool:
+        """Snapshot ids are random URL-safe tokens; anything else could escape the directory"""
+        return bool(snapshot_id) and _SNAPSHOT_ID.match(snapshot_id) is not None
+
+    def paths(self, snapshot_id: str) -> Tuple[str, str]:
+        if not self.valid_id(snapshot_id):
+            raise ValueError("invalid snapshot id")
+        base = os.path.join(self.directory, snapshot_id)
+        return f"{base}.snap", f"{base}.idx"
+
+    @contextmanager
+    def locked(self, snapshot_id: str):
+        """Hold a snapshot's lock, across threads and (where fcntl exists) processes"""
+
+        with self._locks_guard:
+            lock = self._locks.setdefault(snapshot_id, threading.Lock())
+        with lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.directory, f"{snapshot_id}.lock"), "a") as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def open(self, snapshot_id: str, history: CompactChatHistory) -> SessionSnapshot:
+        """Bind a history to its snapshot, restoring any saved messages into it"""
+
+        if time.monotonic() >= self._next_prune:
+            self.prune()
+        snapshot = SessionSnapshot(self, snapshot_id, history)
+        start = time.perf_counter()
+        restored = snapshot.restore()
+        if restored:
+            self.restore_seconds.append(time.perf_counter() - start)
+            self.stats["restores"] += 1
+            self.stats["restored_messages"] += restored
+        return snapshot
+
+    def delete(self, snapshot_id: str):
+        for path in self.paths(snapshot_id):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def prune(self) -> int:
+        """Delete snapshots last saved more than max_age seconds ago; returns how many went"""
+
+        self._next_prune = time.monotonic() + self.PRUNE_INTERVAL
+        cutoff = time.time() - self.max_age
+        pruned = 0
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            snapshot_id, ext = os.path.splitext(entry.name)
+            if ext not in (".snap", ".idx", ".lock", ".tmp") or not self.valid_id(snapshot_id.split(".")[0]):
+                continue
+            try:
+                if entry.stat().st_mtime >= cutoff:
+                    continue
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            pruned += ext == ".snap"
+        self.stats["pruned"] += pruned
+        return pruned
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Snapshot count, disk usage and restore timings"""
+
+        files = [name for name in os.listdir(self.directory) if name.endswith((".snap", ".idx"))]
+        timings = sorted(self.restore_seconds)
+        return {
+            "snapshots": sum(name.endswith(".snap") for name in files),
+            "disk_bytes": sum(os.path.getsize(os.path.join(self.directory, name)) for name in files),
+            "codec": "zstd" if self.codec == CODEC_ZSTD else "zlib",
+            "restore_p50_ms": round(timings[len(timings) // 2] * 1000, 2) if timings else None,
+            **self.stats
+        }
+
+def _create_store() -> Optional[SnapshotStore]:
+    try:
+        return SnapshotStore()
+    except PermissionError as e:
+        logger.error("session snapshots disabled: %s; set SESSION_SNAPSHOT_DIR to a private directory", e)
+        return None
+
+# Global snapshot store; None when snapshots are disabled or the directory is unsafe
+session_snapshots = _create_store() if Config.SESSION_SNAPSHOTS else None
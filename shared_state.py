@@ -0,0 +1,269 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Any, Optional, Tuple
+from config import Config
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS response_cache (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    sources TEXT NOT NULL,
+    created REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS rate_events (
+    user_id TEXT NOT NULL,
+    ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rate_events_user_ts ON rate_events (user_id, ts);
+CREATE TABLE IF NOT EXISTS metrics (
+    name TEXT NOT NULL,
+    worker INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS metrics_name_ts ON metrics (name, ts);
+CREATE TABLE IF NOT EXISTS worker_status (
+    worker TEXT PRIMARY KEY,
+    ready INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+class SharedStateStore:
+    """SQLite database in WAL mode shared by every worker process on the host
+
+    Each thread gets its own connection; WAL lets readers proceed while one
+    writer commits, which is plenty for the cache, limiter and metrics
+    traffic of a handful of Streamlit workers.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self.connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def connect(self) -> sqlite3.Connection:
+        """This thread's connection, opened on first use"""
+
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def transaction(self, immediate: bool = False) -> "_Transaction":
+        """Context manager running the block in one transaction"""
+        return _Transaction(self.connect(), immediate)
+
+class _Transaction:
+    def __init__(self, conn: sqlite3.Connection, immediate: bool):
+        self.conn = conn
+        self.immediate = immediate
+
+    def __enter__(self) -> sqlite3.Connection:
+        # IMMEDIATE takes the write lock up front so read-then-write is atomic across processes
+        self.conn.execute("BEGIN IMMEDIATE" if self.immediate else "BEGIN")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+class SharedResponseCache:
+    """Cross-worker cache of text responses keyed by prompt and recent context"""
+
+    def __init__(self, store: SharedStateStore, ttl_seconds: float = None, max_entries: int = None):
+        self.store = store
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else Config.SHARED_CACHE_TTL
+        self.max_entries = max_entries or Config.SHARED_CACHE_MAX_ENTRIES
+
+    @staticmethod
+    def make_key(prompt: str, conversation_history: List[Dict] = None, context_messages: int = 4) -> str:
+        """Digest of the prompt and the last few history messages"""
+
+        context = [
+            (msg.get('type'), msg.get('content'))
+            for msg in (conversation_history or [])[-context_messages:]
+        ]
+        payload = json.dumps([prompt.strip(), context], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[str, Dict]]:
+        """Return (response, sources) if a fresh entry exists"""
+
+        conn = self.store.connect()
+        row = conn.execute(
+            "SELECT response, sources FROM response_cache WHERE key = ? AND created > ?",
+            (key, time.time() - self.ttl_seconds)
+        ).fetchone()
+        if row is None:
+            SharedMetrics.record_on(self.store, "response_cache_miss", 1)
+            return None
+        conn.execute("UPDATE response_cache SET hits = hits + 1 WHERE key = ?", (key,))
+        SharedMetrics.record_on(self.store, "response_cache_hit", 1)
+        return row[0], json.loads(row[1])
+
+    def put(self, key: str, response: str, sources: Dict):
+        """Store a response, pruning expired and excess entries"""
+
+        now = time.time()
+        with self.store.transaction(immediate=True) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, response, sources, created) VALUES (?, ?, ?, ?)",
+                (key, response, json.dumps(sources, default=str), now)
+            )
+            conn.execute("DELETE FROM response_cache WHERE created <= ?", (now - self.ttl_seconds,))
+            conn.execute(
+                "DELETE FROM response_cache WHERE key IN "
+                "(SELECT key FROM response_cache ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def hot_entries(self, limit: int) -> List[Dict[str, Any]]:
+        """The most-hit fresh entries, for persisting across restarts"""
+
+        rows = self.store.connect().execute(
+            "SELECT key, response, sources, created, hits FROM response_cache WHERE created > ? AND hits > 0 "
+            "ORDER BY hits DESC LIMIT ?",
+            (time.time() - self.ttl_seconds, limit)
+        ).fetchall()
+        return [
+            {"key": key, "response": response, "sources": json.loads(sources), "created": created, "hits": hits}
+            for key, response, sources, created, hits in rows
+        ]
+
+    def prime(self, entries: List[Dict[str, Any]]) -> int:
+        """Insert persisted entries that are still fresh and not already cached; returns the count added"""
+
+        cutoff = time.time() - self.ttl_seconds
+        added = 0
+        with self.store.transaction(immediate=True) as conn:
+            for entry in entries:
+                if entry["created"] <= cutoff:
+                    continue
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO response_cache (key, response, sources, created, hits) VALUES (?, ?, ?, ?, ?)",
+                    (entry["key"], entry["response"], json.dumps(entry["sources"], default=str), entry["created"], entry["hits"])
+                )
+                added += cursor.rowcount
+        return added
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get entry count and total hits"""
+
+        entries, hits = self.store.connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM response_cache"
+        ).fetchone()
+        return {"entries": entries, "hits": hits}
+
+class SharedRateLimiter:
+    """Sliding-window rate limiter whose counts are shared by all workers"""
+
+    def __init__(self, store: SharedStateStore):
+        self.store = store
+
+    def check(self, user_id: str, max_requests: int, window_seconds: float) -> bool:
+        """Record a request and return False if the user is over the limit"""
+
+        now = time.time()
+        with self.store.transaction(immediate=True) as conn:
+            conn.execute("DELETE FROM rate_events WHERE user_id = ? AND ts <= ?", (user_id, now - window_seconds))
+            (count,) = conn.execute("SELECT COUNT(*) FROM rate_events WHERE user_id = ?", (user_id,)).fetchone()
+            if count >= max_requests:
+                return False
+            conn.execute("INSERT INTO rate_events (user_id, ts) VALUES (?, ?)", (user_id, now))
+            return True
+
+class SharedMetrics:
+    """Timestamped samples from every worker, summarized on read"""
+
+    def __init__(self, store: SharedStateStore, retention_seconds: float = None):
+        self.store = store
+        self.retention_seconds = retention_seconds or Config.SHARED_METRICS_RETENTION
+        self._last_prune = 0.0
+
+    @staticmethod
+    def record_on(store: SharedStateStore, name: str, value: float):
+        store.connect().execute(
+            "INSERT INTO metrics (name, worker, ts, value) VALUES (?, ?, ?, ?)",
+            (name, os.getpid(), time.time(), value)
+        )
+
+    def record(self, name: str, value: float):
+        """Add a sample, pruning old samples at most once a minute"""
+
+        self.record_on(self.store, name, value)
+        now = time.time()
+        if now - self._last_prune > 60:
+            self._last_prune = now
+            self.store.connect().execute("DELETE FROM metrics WHERE ts <= ?", (now - self.retention_seconds,))
+
+    def summary(self, window_seconds: float = 300) -> Dict[str, Any]:
+        """Per-metric count, mean and p95 plus per-worker sample counts over the window"""
+
+        conn = self.store.connect()
+        since = time.time() - window_seconds
+        metrics = {}
+        for (name,) in conn.execute("SELECT DISTINCT name FROM metrics WHERE ts > ?", (since,)).fetchall():
+            values = [row[0] for row in conn.execute(
+                "SELECT value FROM metrics WHERE name = ? AND ts > ? ORDER BY value", (name, since)
+            )]
+            metrics[name] = {
+                "count": len(values),
+                "mean": round(sum(values) / len(values), 4),
+                "p95": round(values[min(len(values) - 1, int(len(values) * 0.95))], 4)
+            }
+        workers = dict(conn.execute(
+            "SELECT worker, COUNT(*) FROM metrics WHERE ts > ? GROUP BY worker", (since,)
+        ).fetchall())
+        return {"window_seconds": window_seconds, "metrics": metrics, "workers": workers}
+
+class SharedWorkerStatus:
+    """Readiness each worker publishes for the proxy, keyed by the URL the proxy uses for it"""
+
+    def __init__(self, store: SharedStateStore):
+        self.store = store
+
+    def publish(self, worker: str, ready: bool, status: Dict[str, Any]):
+        self.store.connect().execute(
+            "INSERT OR REPLACE INTO worker_status (worker, ready, status, updated) VALUES (?, ?, ?, ?)",
+            (worker, int(ready), json.dumps(status, default=str), time.time())
+        )
+
+    def get(self, worker: str) -> Optional[Dict[str, Any]]:
+        """{"ready", "status", "updated"} as last published by the worker, or None"""
+
+        row = self.store.connect().execute(
+            "SELECT ready, status, updated FROM worker_status WHERE worker = ?", (worker,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"ready": bool(row[0]), "status": json.loads(row[1]), "updated": row[2]}
+
+class SharedState:
+    """Response cache, rate limiter, metrics and worker readiness backed by one shared store"""
+
+    def __init__(self, path: str = None):
+        self.path = path or Config.SHARED_STATE_PATH
+        self.store = SharedStateStore(self.path)
+        self.cache = SharedResponseCache(self.store)
+        self.rate_limiter = SharedRateLimiter(self.store)
+        self.metrics = SharedMetrics(self.store)
+        self.workers = SharedWorkerStatus(self.store)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache stats and a metrics summary"""
+
+        return {"path": self.path, "cache": self.cache.get_stats(), **self.metrics.summary()}
+
+# Shared across worker processes when SHARED_STATE_PATH is set; None keeps state per process
+shared_state = SharedState() if Config.SHARED_STATE_PATH else None
@@ -0,0 +1,249 @@
+import asyncio
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Dict, List, Any, AsyncIterator, Callable, Optional, Tuple
+from ai_service import AIService, ai_service
+from config import Config
+from shared_state import SharedResponseCache
+from tracing import tracer, traced
+from utils import VoiceUtils
+
+_SENTENCE_END = re.compile(r"[.!?](?=\s|$)")
+
+def first_sentence_end(text: str, min_chars: int) -> Optional[int]:
+    """Index just past the first sentence of at least min_chars, or None if not complete yet"""
+
+    for match in _SENTENCE_END.finditer(text):
+        if match.end() >= min_chars:
+            return match.end()
+    return None
+
+class BackgroundLoop:
+    """Event loop on a daemon thread for work that outlives a Streamlit script run"""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def submit(self, coro) -> Future:
+        """Schedule a coroutine; cancelling the returned future cancels the task"""
+
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="speculative-loop", daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+class SpeculativeVoicePipeline:
+    """Low-latency voice replies: speak the first sentence early and pre-warm likely follow-ups
+
+    ``respond`` streams the model reply and synthesizes its first sentence
+    while the rest is still being generated. After each reply,
+    ``prefetch_follow_ups`` answers and synthesizes the configured quick
+    follow-ups in the background at the scheduler's lowest priority; asking
+    one of them then replays the pre-warmed audio. ``cancel`` drops a
+    session's speculative work when the user goes elsewhere.
+    """
+
+    def __init__(self,
+                 service: AIService = None,
+                 synthesize: Callable[[str], bytes] = None,
+                 follow_ups: List[str] = None,
+                 min_sentence_chars: int = None):
+        self.service = service or ai_service
+        self.synthesize = synthesize or VoiceUtils.synthesize
+        self.follow_ups = follow_ups if follow_ups is not None else Config.VOICE_FOLLOW_UPS
+        self.min_sentence_chars = min_sentence_chars or Config.SPECULATIVE_MIN_SENTENCE_CHARS
+
+        self._background = BackgroundLoop()
+        self._prefetch: "OrderedDict[str, Dict[str, Future]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.latencies = {mode: deque(maxlen=200) for mode in ("sequential", "speculative", "prefetched")}
+        self.stats = {"prefetched": 0, "prefetch_hits": 0, "prefetch_cancelled": 0}
+
+    def record_latency(self, mode: str, seconds: float):
+        """Record a record-stop to first-audio-byte measurement"""
+        self.latencies[mode].append(seconds)
+
+    async def respond_sequential(self,
+                                 text: str,
+                                 conversation_history: List[Dict] = None,
+                                 user_id: str = "default",
+                                 started: float = None) -> AsyncIterator[Dict]:
+        """Baseline: full reply, then TTS of the whole reply"""
+
+        started = started or time.perf_counter()
+        response, sources = await self.service.process_voice_query(text, conversation_history, user_id=user_id)
+        yield {"delta": response}
+        audio = await asyncio.to_thread(self.synthesize, response)
+        first_audio = time.perf_counter() - started
+        self.record_latency("sequential", first_audio)
+        yield {"audio": audio, "part": "full"}
+        yield self._done(response, sources, "sequential", first_audio, started)
+
+    async def respond(self,
+                      text: str,
+                      conversation_history: List[Dict] = None,
+                      user_id: str = "default",
+                      started: float = None) -> AsyncIterator[Dict]:
+        """Yield {"delta"} text, {"audio", "part"} clips as soon as each is ready, then {"done"}
+
+        ``started`` is the perf_counter time recording stopped; first-audio
+        latency is measured from it.
+        """
+
+        started = started or time.perf_counter()
+
+        prefetched = self._take_prefetch(user_id, text, conversation_history)
+        if prefetched is not None:
+            try:
+                response, sources, audio = await asyncio.wrap_future(prefetched)
+            except Exception:
+                prefetched = None
+            else:
+                self.stats["prefetch_hits"] += 1
+                first_audio = time.perf_counter() - started
+                self.record_latency("prefetched", first_audio)
+                yield {"delta": response}
+                yield {"audio": audio, "part": "full"}
+                # The answer was produced under the prefetch's own trace; keep both ids
+                sources = dict(sources, prefetched=True, prefetch_trace_id=sources.get("trace_id"), trace_id=tracer.current_trace_id())
+                yield self._done(response, sources, "prefetched", first_audio, started)
+                return
+
+        parts: List[str] = []
+        first_task: Optional[asyncio.Task] = None
+        spoken = 0
+        first_audio = None
+        response, sources = "", {}
+
+        try:
+            async for event in self.service.stream_ai_response(
+                f"[Voice Query] {text}",
+                conversation_history=conversation_history,
+                priority="voice",
+                user_id=user_id
+            ):
+                if event.get("done"):
+                    response, sources = event["response"], event["sources"]
+                    break
+
+                parts.append(event["delta"])
+                yield event
+                if first_task is None:
+                    end = first_sentence_end("".join(parts), self.min_sentence_chars)
+                    if end is not None:
+                        spoken = end
+                        first_task = asyncio.create_task(asyncio.to_thread(self.synthesize, "".join(parts)[:end]))
+
+                if first_task is not None and first_audio is None and first_task.done():
+                    first_audio = time.perf_counter() - started
+                    yield {"audio": first_task.result(), "part": "first"}
+
+            if first_task is None:
+                # Short reply without a sentence break: speak it whole
+                spoken = len(response)
+                first_task = asyncio.create_task(asyncio.to_thread(self.synthesize, response))
+            if first_audio is None:
+                audio = await first_task
+                first_audio = time.perf_counter() - started
+                yield {"audio": audio, "part": "first"}
+
+            rest = response[spoken:].strip()
+            if rest:
+                yield {"audio": await asyncio.to_thread(self.synthesize, rest), "part": "rest"}
+        finally:
+            if first_task is not None and not first_task.done():
+                first_task.cancel()
+
+        self.record_latency("speculative", first_audio)
+        yield self._done(response, sources, "speculative", first_audio, started)
+
+    @staticmethod
+    def _done(response: str, sources: Dict, mode: str, first_audio: float, started: float) -> Dict:
+        return {
+            "done": True,
+            "response": response,
+            "sources": sources,
+            "timings": {"mode": mode, "first_audio": round(first_audio, 3), "total": round(time.perf_counter() - started, 3)}
+        }
+
+    @staticmethod
+    def _prefetch_key(text: str, conversation_history: Optional[List[Dict]]) -> str:
+        return SharedResponseCache.make_key(text.strip().lower(), conversation_history)
+
+    def prefetch_follow_ups(self, user_id: str, conversation_history: List[Dict]):
+        """Start answering and synthesizing the quick follow-ups for this conversation state"""
+
+        self.cancel(user_id)
+        futures = {}
+        for index, phrase in enumerate(self.follow_ups):
+            futures[self._prefetch_key(phrase, conversation_history)] = self._background.submit(
+                self._prefetch_one(phrase, list(conversation_history or []), user_id, index)
+            )
+        self.stats["prefetched"] += len(futures)
+
+        with self._lock:
+            self._prefetch[user_id] = futures
+            while len(self._prefetch) > Config.SPECULATIVE_PREFETCH_SESSIONS:
+                _, stale = self._prefetch.popitem(last=False)
+                for future in stale.values():
+                    future.cancel()
+
+    @traced("voice.prefetch")
+    async def _prefetch_one(self, phrase: str, conversation_history: List[Dict], user_id: str, index: int) -> Tuple[str, Dict, bytes]:
+        # Lowest priority so speculation never delays real requests
+        response, sources = await self.service.get_ai_response(
+            f"[Voice Query] {phrase}",
+            conversation_history=conversation_history,
+            priority="batch",
+            user_id=user_id,
+            supersede_key=f"{user_id}:prefetch:{index}"
+        )
+        if sources.get('error'):
+            raise RuntimeError(sources['error'])
+        audio = await asyncio.to_thread(self.synthesize, response)
+        return response, sources, audio
+
+    def _take_prefetch(self, user_id: str, text: str, conversation_history: Optional[List[Dict]]) -> Optional[Future]:
+        """Claim a pre-warmed reply for this exact request and cancel the session's other speculation"""
+
+        with self._lock:
+            futures = self._prefetch.pop(user_id, None)
+        if not futures:
+            return None
+        match = futures.pop(self._prefetch_key(text, conversation_history), None)
+        self._cancel_futures(futures)
+        return match
+
+    def _cancel_futures(self, futures: Dict[str, Future]):
+        for future in futures.values():
+            if future.cancel():
+                self.stats["prefetch_cancelled"] += 1
+
+    def cancel(self, user_id: str):
+        """Cancel a session's speculative work (the user left voice mode or asked something else)"""
+
+        with self._lock:
+            futures = self._prefetch.pop(user_id, None)
+        if futures:
+            self._cancel_futures(futures)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Record-stop to first-audio latency per mode, plus prefetch counters"""
+
+        latency = {}
+        for mode, samples in self.latencies.items():
+            values = sorted(samples)
+            latency[mode] = {
+                "count": len(values),
+                "p50_s": round(values[len(values) // 2], 3) if values else None,
+                "p95_s": round(values[min(len(values) - 1, int(len(values) * 0.95))], 3) if values else None
+            }
+        return {"first_audio_latency": latency, "sessions_prefetching": len(self._prefetch), **self.stats}
+
+# Global voice pipeline shared by every session in the process
+voice_pipeline = SpeculativeVoicePipeline()
@@ -7,6 +7,7 @@ import json
 import base64
 import io
 import os
+import hashlib
 from datetime import datetime
 import speech_recognition as sr
 from gtts import gTTS
@@ -16,7 +17,23 @@ from streamlit_chat import message
 from audio_recorder_streamlit import audio_recorder
 import time
 import threading
+import asyncio
 from streamlit_webrtc import webrtc_streamer, VideoTransformerBase, RTCConfiguration
+from ai_service import ai_service
+from ai_client import AIServiceClient
+from config import Config
+from utils import ImageUtils, SessionUtils, ValidationUtils, VoiceUtils
+from image_pipeline import image_pipeline, ImageRejectedError, ImageBudgetExceeded
+from shared_state import shared_state
+from media_workers import media_pool, decode_wav, encode_jpeg
+from request_scheduler import request_scheduler
+from speculative import voice_pipeline
+from session_snapshots import session_snapshots
+from camera_adaptation import capture_governor
+from profiler import profiler
+from tracing import tracer, traced
+from warmup import warmup
+from blob_store import blob_store
 
 # Page configuration
 st.set_page_config(
@@ -84,73 +101,246 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Initialize session state
-if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
-if 'voice_enabled' not in st.session_state:
-    st.session_state.voice_enabled = False
-if 'camera_active' not in st.session_state:
-    st.session_state.camera_active = False
+# Sample this rerun's stacks when PROFILER_ENABLED is set
+rerun_profile = profiler.begin("rerun", include_workers=True)
+
+def rerun_app():
+    """st.rerun(), closing this run's profile first since the rest of the script is skipped"""
+    profiler.end(rerun_profile)
+    st.rerun()
+
+def stop_app():
+    """st.stop(), closing this run's profile first since the rest of the script is skipped"""
+    profiler.end(rerun_profile)
+    st.stop()
+
+# Initialize session state (compact, memory-capped chat history)
+SessionUtils.initialize_session()
 
 class VideoTransformer(VideoTransformerBase):
     def __init__(self):
         self.frame_count = 0
+        self.latest_frame = None
+        self.last_output = None
+        # Frame dropping and downscaling to hold the per-stream CPU budget
+        self.stream = capture_governor.open_stream() if Config.CAMERA_ADAPTIVE else None
     
     def transform(self, frame):
+        if self.stream is not None and not self.stream.admit() and self.last_output is not None:
+            # Behind the level's frame rate: repeat the last output instead of processing
+            return self.last_output
+        
+        start = time.perf_counter()
         img = frame.to_ndarray(format="bgr24")
+        if self.stream is not None:
+            img = self.stream.fit(img)
         self.frame_count += 1
+        self.latest_frame = img.copy()
         
         # Add frame counter overlay
         cv2.putText(img, f"Frame: {self.frame_count}", (10, 30), 
                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
         
+        self.last_output = img
+        if self.stream is not None:
+            self.stream.record(time.perf_counter() - start)
         return img
+    
+    def on_ended(self):
+        if self.stream is not None:
+            capture_governor.close_stream(self.stream)
+
+@st.cache_resource
+def get_ai_client():
+    """Pooled client for the standalone AI server, shared by all sessions"""
+    return AIServiceClient() if Config.AI_SERVER_URL else None
+
+# The first run in this process starts the background warm-up; the proxy holds new clients until it is done
+if warmup.state == "idle":
+    if get_ai_client():
+        warmup.add_step("ai_server", get_ai_client().warm)
+    warmup.start(ai_service)
+
+def rate_limited_response():
+    """Reply to send instead of calling the AI when the client is over its rate limit"""
+    
+    # Counted across all workers when SHARED_STATE_PATH is set
+    if ValidationUtils.check_rate_limit(ValidationUtils.get_client_id(), Config.RATE_LIMIT_REQUESTS, Config.RATE_LIMIT_WINDOW_MINUTES):
+        return None
+    return "You're sending requests too quickly. Please wait a moment and try again.", {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "sources": [],
+        "confidence": "N/A",
+        "error": "rate_limited",
+        "real_time": True,
+        "trace_id": tracer.current_trace_id()
+    }
 
-def get_ai_response(prompt, image=None, voice_response=False):
-    """Simulate AI response - In production, integrate with OpenAI or other AI service"""
+def get_ai_response(prompt, image=None, voice_response=False, priority="interactive"):
+    """Get AI response from the AI server, or from the in-process AIService when none is configured
+
+    Runs in an "app.get_ai_response" span, the root of the request's trace
+    unless called inside another span; its id is in the returned sources.
+    """
+    
+    with tracer.span("app.get_ai_response", priority=priority, image=image is not None, voice=voice_response):
+        return _get_ai_response(prompt, image, voice_response, priority)
+
+def _get_ai_response(prompt, image, voice_response, priority):
+    limited = rate_limited_response()
+    if limited:
+        return limited
     
-    responses = [
-        f"I understand you're asking about: {prompt}. This is an intelligent response based on advanced AI processing.",
-        f"Based on your question '{prompt}', here's my detailed analysis and response with contextual understanding.",
-        f"Thank you for your question about '{prompt}'. I've processed this with real-time information and can provide you with comprehensive insights.",
-    ]
+    history = st.session_state.chat_history[-Config.CONTEXT_WINDOW_MESSAGES:]
+    client = get_ai_client()
     
-    response = responses[len(prompt) % len(responses)]
+    # Fair-queued per session; a newer request in the same class replaces one still queued
+    user_id = SessionUtils.get_session_id()
     
+    if voice_response and image is None:
+        if client:
+            return client.process_voice_query(prompt, conversation_history=history, user_id=user_id)
+        return asyncio.run(ai_service.process_voice_query(prompt, conversation_history=history, user_id=user_id))
+    
+    scheduling = {"priority": priority, "user_id": user_id, "supersede_key": f"{user_id}:{priority}"}
     if image is not None:
-        response += "\n\nI can see the image you've shared. I've analyzed it using computer vision and can provide detailed insights about what I observe."
-    
-    # Add timestamp and source simulation
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    source_info = {
-        "timestamp": timestamp,
-        "sources": [
-            "https://example-source1.com",
-            "https://example-source2.com"
-        ],
-        "confidence": "95%"
-    }
+        # analyze_image adds the local feature summary, answers purely local questions itself and reuses
+        # answers for matching photos; the server's /api/image goes through it the same way
+        if client:
+            return client.analyze_image(image, prompt, **scheduling)
+        return asyncio.run(ai_service.analyze_image(image, prompt, **scheduling))
+    if client:
+        return client.get_ai_response(prompt, conversation_history=history, **scheduling)
+    return asyncio.run(ai_service.get_ai_response(prompt, conversation_history=history, **scheduling))
+
+def reanalyze_image(key, question):
+    """Analyze an image kept in the blob store again, decoding it from the store's mapping"""
     
-    return response, source_info
+    with tracer.span("app.reanalyze_image", sha256=key):
+        limited = rate_limited_response()
+        if limited:
+            return limited
+        
+        image = blob_store.open_image(key, Config.MODEL_IMAGE_SIZE)
+        user_id = SessionUtils.get_session_id()
+        client = get_ai_client()
+        if client:
+            return client.analyze_image(image, question, user_id=user_id)
+        return asyncio.run(ai_service.analyze_image(image, question, user_id=user_id))
 
 def text_to_speech(text):
     """Convert text to speech"""
     try:
-        tts = gTTS(text=text, lang='en', slow=False)
-        fp = io.BytesIO()
-        tts.write_to_fp(fp)
-        fp.seek(0)
-        return fp
+        return io.BytesIO(VoiceUtils.synthesize(text))
     except Exception as e:
         st.error(f"Error in text-to-speech: {e}")
         return None
 
+def attach(data, kind, mime, name=None):
+    """Keep media for a chat entry in the blob store; [] when the store is off or the write fails"""
+    if blob_store is None or not data:
+        return []
+    try:
+        return [blob_store.attach(data, kind, mime, name)]
+    except OSError as e:
+        st.warning(f"Could not keep the {kind} with this message: {e}")
+        return []
+
+@traced("voice.turn")
+def run_voice_turn(recognized_text, started, recording=None):
+    """Answer a voice query, playing audio as soon as the first clip is ready
+
+    started is the perf_counter time the recording arrived; the time to the
+    first audio clip is shown and kept in voice_pipeline's latency stats.
+    The recording (WAV bytes) and the reply's audio clips are kept with the
+    chat entries in the blob store.
+    """
+    
+    st.success(f"🎯 Recognized: {recognized_text}")
+    
+    limited = rate_limited_response()
+    history = st.session_state.chat_history[-Config.CONTEXT_WINDOW_MESSAGES:]
+    user_id = SessionUtils.get_session_id()
+    
+    st.write("🤖 AI Response:")
+    text_placeholder = st.empty()
+    audio_placeholders = {"first": st.empty(), "rest": st.empty(), "full": st.empty()}
+    clips = []
+    
+    if limited:
+        ai_response, source_info = limited
+        text_placeholder.write(ai_response)
+        timings = None
+    elif get_ai_client() or not Config.SPECULATIVE_VOICE:
+        # Sequential path: whole reply, then speech for the whole reply
+        ai_response, source_info = get_ai_response(recognized_text, voice_response=True)
+        text_placeholder.write(ai_response)
+        audio_fp = text_to_speech(ai_response)
+        timings = {"mode": "sequential", "first_audio": round(time.perf_counter() - started, 3)}
+        voice_pipeline.record_latency("sequential", timings["first_audio"])
+        if audio_fp:
+            audio_placeholders["full"].audio(audio_fp, format="audio/mp3")
+            clips.append(audio_fp.getvalue())
+    else:
+        async def consume():
+            parts = []
+            async for event in voice_pipeline.respond(recognized_text, history, user_id=user_id, started=started):
+                if "delta" in event:
+                    parts.append(event["delta"])
+                    text_placeholder.write("".join(parts))
+                elif "audio" in event:
+                    audio_placeholders[event["part"]].audio(event["audio"], format="audio/mp3", autoplay=event["part"] != "rest")
+                    clips.append(event["audio"])
+                elif event.get("done"):
+                    return event
+        
+        try:
+            final = asyncio.run(consume())
+            ai_response, source_info, timings = final["response"], final["sources"], final["timings"]
+        except Exception as e:
+            st.warning(f"Streaming voice reply failed, answering in one piece: {e}")
+            ai_response, source_info = get_ai_response(recognized_text, voice_response=True)
+            text_placeholder.write(ai_response)
+            timings = None
+            clips = []
+    
+    if timings:
+        st.caption(f"⏱️ First audio after {timings['first_audio']:.2f}s ({timings['mode']})")
+    
+    # Add to chat history
+    trace_id = tracer.current_trace_id()
+    st.session_state.chat_history.append({
+        'type': 'user',
+        'content': f"[Voice] {recognized_text}",
+        'timestamp': datetime.now(),
+        'trace_id': trace_id,
+        'attachments': attach(recording, "audio", "audio/wav", "recording.wav")
+    })
+    
+    st.session_state.chat_history.append({
+        'type': 'bot',
+        'content': ai_response,
+        'timestamp': datetime.now(),
+        'sources': source_info,
+        'voice_response': True,
+        'trace_id': trace_id,
+        'attachments': [record for index, clip in enumerate(clips) for record in attach(clip, "audio", "audio/mp3", f"reply-{index + 1}.mp3")]
+    })
+    
+    # Pre-warm answers and audio for the likely next requests
+    if Config.SPECULATIVE_VOICE and Config.SPECULATIVE_PREFETCH and not get_ai_client() and not limited:
+        voice_pipeline.prefetch_follow_ups(user_id, st.session_state.chat_history[-Config.CONTEXT_WINDOW_MESSAGES:])
+
+@traced("speech_to_text")
 def speech_to_text(audio_data):
     """Convert speech to text"""
     try:
         r = sr.Recognizer()
-        with sr.AudioFile(audio_data) as source:
-            audio = r.record(source)
+        if hasattr(audio_data, "read"):
+            audio_data = audio_data.read()
+        # WAV decoding, downmixing and resampling run in the media worker pool
+        pcm, sample_rate, sample_width = media_pool.run(decode_wav, audio_data)
+        audio = sr.AudioData(pcm, sample_rate, sample_width)
         text = r.recognize_google(audio)
         return text
     except Exception as e:
@@ -164,7 +354,7 @@ st.markdown('<p style="text-align: center; font-size: 1.2rem; color: #666;">Adva
 # Navigation Menu
 selected = option_menu(
     menu_title=None,
-    options=["💬 Chat", "📸 Camera", "� Voice", "📚 History", "ℹ️ Info"],
+    options=["💬 Chat", "📸 Camera", "🎤 Voice", "📚 History", "ℹ️ Info"],
     icons=["chat-dots", "camera", "mic", "clock-history", "info-circle"],
     menu_icon="cast",
     default_index=0,
@@ -177,6 +367,13 @@ selected = option_menu(
     }
 )
 
+if rerun_profile is not None:
+    rerun_profile.name = selected
+
+# Speculative voice work is only useful while the user stays in voice mode
+if selected != "🎤 Voice":
+    voice_pipeline.cancel(SessionUtils.get_session_id())
+
 # Main Content Area
 if selected == "💬 Chat":
     st.markdown("### 💬 Chat with AI")
@@ -187,8 +384,12 @@ if selected == "💬 Chat":
         # Chat interface
         st.markdown('<div class="chat-container">', unsafe_allow_html=True)
         
-        # Display chat history
-        for i, chat in enumerate(st.session_state.chat_history):
+        # Display the newest messages; slicing reads only those, however much has spilled to disk
+        history_length = len(st.session_state.chat_history)
+        window_start = max(history_length - Config.CHAT_RENDER_MESSAGES, 0)
+        if window_start:
+            st.caption(f"Showing the latest {history_length - window_start} of {history_length} messages; see the History tab for older ones.")
+        for i, chat in enumerate(st.session_state.chat_history[window_start:], start=window_start):
             if chat['type'] == 'user':
                 message(chat['content'], is_user=True, key=f"user_{i}")
             else:
@@ -204,25 +405,27 @@ if selected == "💬 Chat":
         with col_send:
             if st.button("🚀 Send Message", type="primary"):
                 if user_input:
+                    # Get AI response (history so far is sent as context)
+                    ai_response, source_info = get_ai_response(user_input)
+                    
                     # Add user message
                     st.session_state.chat_history.append({
                         'type': 'user',
                         'content': user_input,
-                        'timestamp': datetime.now()
+                        'timestamp': datetime.now(),
+                        'trace_id': source_info.get('trace_id')
                     })
                     
-                    # Get AI response
-                    ai_response, source_info = get_ai_response(user_input)
-                    
                     # Add AI response
                     st.session_state.chat_history.append({
                         'type': 'bot',
                         'content': ai_response,
                         'timestamp': datetime.now(),
-                        'sources': source_info
+                        'sources': source_info,
+                        'trace_id': source_info.get('trace_id')
                     })
                     
-                    st.rerun()
+                    rerun_app()
         
         with col_voice:
             if st.button("🎤 Voice Message"):
@@ -239,8 +442,16 @@ if selected == "💬 Chat":
             st.session_state.voice_enabled = True
         
         if st.button("🗑️ Clear History", key="clear_history"):
-            st.session_state.chat_history = []
-            st.rerun()
+            st.session_state.chat_history.clear()
+            rerun_app()
+        
+        # Documents added here are retrieved into later answers
+        memory_doc = st.file_uploader("📄 Add document to memory", type=['txt', 'md'], key="memory_doc")
+        if memory_doc is not None and st.button("🧠 Index Document", key="index_doc"):
+            chunks = ai_service.index_document(
+                memory_doc.getvalue().decode("utf-8", errors="ignore"), memory_doc.name, user_id=SessionUtils.get_session_id()
+            )
+            st.success(f"Indexed {chunks} chunk{'s' if chunks != 1 else ''} from {memory_doc.name}")
         
         st.markdown('</div>', unsafe_allow_html=True)
         
@@ -261,48 +472,61 @@ elif selected == "📸 Camera":
         st.markdown('<div class="camera-section">', unsafe_allow_html=True)
         st.markdown("#### 🎥 Live Camera Feed")
         
-        # WebRTC camera stream
-        rtc_configuration = RTCConfiguration({
-            "iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]
-        })
+        # WebRTC camera stream, capped at the configured resolution and frame rate
+        rtc_configuration = RTCConfiguration(Config.RTC_CONFIGURATION)
         
         webrtc_ctx = webrtc_streamer(
             key="live-camera",
             video_transformer_factory=VideoTransformer,
             rtc_configuration=rtc_configuration,
-            media_stream_constraints={"video": True, "audio": False},
+            media_stream_constraints=capture_governor.constraints(),
         )
         
         if webrtc_ctx.video_transformer:
             st.success("📹 Camera is active! Ask questions about what you see.")
             
+            stream = webrtc_ctx.video_transformer.stream
+            if stream is not None:
+                stream_stats = stream.get_stats()
+                st.caption(
+                    f"Streaming at {stream_stats['level']} | {stream_stats['output_fps']} of {stream_stats['input_fps']} fps processed | "
+                    f"{stream_stats['frame_ms']} ms/frame | {capture_governor.get_stats()['streams']} live streams"
+                )
+            
             # Input for camera-based questions
             camera_question = st.text_input("🤔 Ask about what the camera sees...")
             
             if st.button("🔍 Analyze Current View"):
-                if camera_question:
-                    # Simulate getting current frame (in production, capture actual frame)
+                frame = webrtc_ctx.video_transformer.latest_frame
+                if camera_question and frame is not None:
+                    current_view = ImageUtils.frame_to_image(frame)
                     ai_response, source_info = get_ai_response(
                         camera_question, 
-                        image="current_camera_frame",
-                        voice_response=True
+                        image=current_view,
+                        voice_response=True,
+                        priority="camera"
                     )
                     
                     st.success("📝 AI Response:")
                     st.write(ai_response)
+                    if source_info.get('cached'):
+                        st.caption(f"♻️ Reused the answer for a matching view (hash distance {source_info.get('cache_distance', 0)})")
                     
-                    # Add to chat history
+                    # Add to chat history, keeping the analyzed frame for History and re-analysis
                     st.session_state.chat_history.append({
                         'type': 'user',
                         'content': f"[Camera] {camera_question}",
-                        'timestamp': datetime.now()
+                        'timestamp': datetime.now(),
+                        'trace_id': source_info.get('trace_id'),
+                        'attachments': attach(media_pool.run(encode_jpeg, current_view) if blob_store else None, "image", "image/jpeg", "camera.jpg")
                     })
                     
                     st.session_state.chat_history.append({
                         'type': 'bot',
                         'content': ai_response,
                         'timestamp': datetime.now(),
-                        'sources': source_info
+                        'sources': source_info,
+                        'trace_id': source_info.get('trace_id')
                     })
         
         st.markdown('</div>', unsafe_allow_html=True)
@@ -310,15 +534,27 @@ elif selected == "📸 Camera":
     with tab2:
         st.markdown("#### 📤 Upload & Analyze Photos")
         
-        uploaded_file = st.file_uploader("Choose an image...", type=['png', 'jpg', 'jpeg'])
+        uploaded_files = st.file_uploader(
+            "Choose images...",
+            type=['png', 'jpg', 'jpeg'],
+            accept_multiple_files=True
+        )
         
-        if uploaded_file is not None:
-            image = Image.open(uploaded_file)
+        if len(uploaded_files) == 1:
+            uploaded_file = uploaded_files[0]
+            
+            # Header-checked, reduced-resolution decode, cached per upload
+            try:
+                loaded = image_pipeline.load(uploaded_file)
+            except (ImageRejectedError, ImageBudgetExceeded) as e:
+                st.error(f"❌ {e}")
+                stop_app()
+            image = loaded["model"]
             
             col1, col2 = st.columns([1, 1])
             
             with col1:
-                st.image(image, caption="Uploaded Image", use_column_width=True)
+                st.image(loaded["display"], caption="Uploaded Image", use_column_width=True)
             
             with col2:
                 st.markdown("### 🔍 Image Analysis")
@@ -334,10 +570,84 @@ elif selected == "📸 Camera":
                         
                         st.success("📝 Analysis Result:")
                         st.write(ai_response)
+                        if source_info.get('cached'):
+                            st.caption(f"♻️ Reused the answer for a matching photo (hash distance {source_info.get('cache_distance', 0)})")
                         
                         # Show sources
                         with st.expander("📚 Sources & Information"):
                             st.json(source_info)
+                        
+                        # Add to chat history with the original upload attached
+                        st.session_state.chat_history.append({
+                            'type': 'user',
+                            'content': f"[Photo] {image_question}",
+                            'timestamp': datetime.now(),
+                            'trace_id': source_info.get('trace_id'),
+                            'attachments': attach(uploaded_file.getvalue(), "image", uploaded_file.type or "image/jpeg", uploaded_file.name)
+                        })
+                        
+                        st.session_state.chat_history.append({
+                            'type': 'bot',
+                            'content': ai_response,
+                            'timestamp': datetime.now(),
+                            'sources': source_info,
+                            'trace_id': source_info.get('trace_id')
+                        })
+        
+        elif len(uploaded_files) > 1:
+            st.markdown(f"### 🗂️ Batch Analysis ({len(uploaded_files)} images)")
+            
+            if len(uploaded_files) > Config.BATCH_MAX_IMAGES:
+                st.warning(f"Only the first {Config.BATCH_MAX_IMAGES} images will be analyzed.")
+                uploaded_files = uploaded_files[:Config.BATCH_MAX_IMAGES]
+            
+            batch_question = st.text_area("Ask about every image...", key="batch_question")
+            
+            rejected = [f.name for f in uploaded_files if not ImageUtils.validate_image(f)]
+            if rejected:
+                st.warning(f"Skipping files that are too large or unreadable: {', '.join(rejected)}")
+                uploaded_files = [f for f in uploaded_files if f.name not in rejected]
+            
+            if st.button("🤖 Analyze All Images") and uploaded_files:
+                images = [(f.name, f.getvalue()) for f in uploaded_files]
+                progress = st.progress(0.0, text="Analyzing images...")
+                results = []
+                
+                async def run_batch():
+                    # Render each result as soon as its analysis finishes
+                    async for result in ai_service.analyze_images(images, batch_question or None, user_id=SessionUtils.get_session_id()):
+                        show_result(result)
+                
+                def show_result(result):
+                    results.append(result)
+                    progress.progress(len(results) / len(images), text=f"Analyzed {len(results)}/{len(images)}")
+                    with st.expander(f"{'❌' if result['error'] else '✅'} {result['name']} ({result['elapsed']}s)"):
+                        st.write(result['error'] or result['response'])
+                
+                if get_ai_client():
+                    for result in get_ai_client().analyze_images(images, batch_question or None, user_id=SessionUtils.get_session_id()):
+                        show_result(result)
+                else:
+                    asyncio.run(run_batch())
+                st.session_state.batch_results = results
+            
+            if st.session_state.get('batch_results'):
+                export_col1, export_col2 = st.columns([1, 1])
+                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                with export_col1:
+                    st.download_button(
+                        label="📥 Download JSON",
+                        data=ImageUtils.export_batch_results(st.session_state.batch_results, "json"),
+                        file_name=f"image_analysis_{timestamp}.json",
+                        mime="application/json"
+                    )
+                with export_col2:
+                    st.download_button(
+                        label="📥 Download CSV",
+                        data=ImageUtils.export_batch_results(st.session_state.batch_results, "csv"),
+                        file_name=f"image_analysis_{timestamp}.csv",
+                        mime="text/csv"
+                    )
 
 elif selected == "🎤 Voice":
     st.markdown("### 🎤 Voice Conversation")
@@ -357,40 +667,28 @@ elif selected == "🎤 Voice":
         )
         
         if audio_bytes:
+            # The rerun that delivers new audio is the closest point to "recording stopped"
+            audio_key = hashlib.sha1(audio_bytes).hexdigest()
+            is_new_audio = st.session_state.get('last_voice_audio') != audio_key
+            received_at = time.perf_counter()
+            
             st.audio(audio_bytes, format="audio/wav")
             
-            if st.button("🔄 Process Voice"):
-                with st.spinner("Processing voice..."):
+            auto_process = is_new_audio and st.session_state.get('auto_voice', True)
+            if st.button("🔄 Process Voice") or auto_process:
+                st.session_state.last_voice_audio = audio_key
+                with st.spinner("Processing voice..."), tracer.span("voice.recording", audio_bytes=len(audio_bytes)):
                     # Convert audio to text (simulation)
                     recognized_text = "Hello, I'm speaking to the AI assistant through voice."
-                    
-                    st.success(f"🎯 Recognized: {recognized_text}")
-                    
-                    # Get AI response
-                    ai_response, source_info = get_ai_response(recognized_text, voice_response=True)
-                    
-                    st.write("🤖 AI Response:")
-                    st.write(ai_response)
-                    
-                    # Convert response to speech
-                    audio_fp = text_to_speech(ai_response)
-                    if audio_fp:
-                        st.audio(audio_fp, format="audio/mp3")
-                    
-                    # Add to chat history
-                    st.session_state.chat_history.append({
-                        'type': 'user',
-                        'content': f"[Voice] {recognized_text}",
-                        'timestamp': datetime.now()
-                    })
-                    
-                    st.session_state.chat_history.append({
-                        'type': 'bot',
-                        'content': ai_response,
-                        'timestamp': datetime.now(),
-                        'sources': source_info,
-                        'voice_response': True
-                    })
+                    run_voice_turn(recognized_text, received_at, recording=audio_bytes)
+        
+        # With SPECULATIVE_PREFETCH on, these are pre-warmed after each voice reply and answer almost instantly
+        if Config.SPECULATIVE_VOICE and any(chat.get('voice_response') for chat in st.session_state.chat_history[-2:]):
+            st.markdown("#### ⚡ Quick Follow-ups")
+            follow_up_cols = st.columns(len(Config.VOICE_FOLLOW_UPS))
+            for index, (follow_up_col, phrase) in enumerate(zip(follow_up_cols, Config.VOICE_FOLLOW_UPS)):
+                if follow_up_col.button(phrase, key=f"voice_follow_up_{index}"):
+                    run_voice_turn(phrase, time.perf_counter())
     
     with col2:
         st.markdown("#### ⚙️ Voice Settings")
@@ -401,7 +699,7 @@ elif selected == "🎤 Voice":
         voice_speed = st.slider("🏃 Speech Speed", 0.5, 2.0, 1.0)
         voice_pitch = st.slider("🎵 Voice Pitch", 0.5, 2.0, 1.0)
         
-        auto_voice = st.checkbox("🔄 Auto Voice Response", value=True)
+        auto_voice = st.checkbox("🔄 Auto Voice Response", value=True, key="auto_voice")
         
         st.markdown('</div>', unsafe_allow_html=True)
         
@@ -430,7 +728,7 @@ elif selected == "📚 History":
         with col3:
             if st.button("💾 Export History"):
                 # Export functionality
-                history_json = json.dumps(st.session_state.chat_history, indent=2, default=str)
+                history_json = json.dumps(list(st.session_state.chat_history), indent=2, default=str)
                 st.download_button(
                     label="📥 Download JSON",
                     data=history_json,
@@ -440,8 +738,21 @@ elif selected == "📚 History":
         
         st.markdown("---")
         
-        # Display filtered history
-        for i, chat in enumerate(reversed(st.session_state.chat_history) if sort_order == "Newest First" else st.session_state.chat_history):
+        # Display one page; slicing reads only that page's messages, however much has spilled to disk
+        history_length = len(st.session_state.chat_history)
+        page_size = Config.HISTORY_PAGE_MESSAGES
+        pages = (history_length + page_size - 1) // page_size
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1) if pages > 1 else 1
+        if sort_order == "Newest First":
+            page_stop = history_length - (page - 1) * page_size
+            page_start = max(page_stop - page_size, 0)
+            page_items = reversed(list(enumerate(st.session_state.chat_history[page_start:page_stop], start=page_start)))
+        else:
+            page_start = (page - 1) * page_size
+            page_items = enumerate(st.session_state.chat_history[page_start:page_start + page_size], start=page_start)
+        
+        reanalyzed = []
+        for i, chat in page_items:
             with st.expander(f"{'🧑' if chat['type'] == 'user' else '🤖'} {chat['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}"):
                 st.write(chat['content'])
                 
@@ -450,8 +761,49 @@ elif selected == "📚 History":
                     for source in chat['sources']['sources']:
                         st.markdown(f"- [Link]({source})")
                 
-                if chat['type'] == 'bot' and 'voice_response' in chat:
+                for index, attachment in enumerate(chat.get('attachments') or []):
+                    key = attachment['sha256']
+                    if blob_store is None or key not in blob_store:
+                        st.caption(f"📎 {attachment.get('name') or attachment['kind']} is no longer stored")
+                    elif attachment['kind'] == "image":
+                        thumbnail = blob_store.thumbnail(key)
+                        if thumbnail:
+                            st.image(thumbnail, caption=attachment.get('name'))
+                        question = chat['content'].split("] ", 1)[-1] if chat['content'].startswith("[") else chat['content']
+                        if st.button("🔁 Re-analyze", key=f"reanalyze_{i}_{index}"):
+                            try:
+                                ai_response, source_info = reanalyze_image(key, question)
+                            except (KeyError, OSError, ValueError) as e:
+                                st.error(f"❌ Could not re-analyze this image: {e}")
+                            else:
+                                st.success("📝 Analysis Result:")
+                                st.write(ai_response)
+                                reanalyzed.append((question, ai_response, source_info, attachment))
+                    elif attachment['kind'] == "audio":
+                        st.audio(blob_store.read(key), format=attachment['mime'])
+                
+                if chat['type'] == 'bot' and 'voice_response' in chat and not chat.get('attachments'):
                     st.info("🎵 Voice response available")
+                
+                if chat.get('trace_id'):
+                    st.caption(f"🔎 Trace: `{chat['trace_id']}`")
+        
+        # Re-analyses join the conversation once the listing above is done
+        for question, ai_response, source_info, attachment in reanalyzed:
+            st.session_state.chat_history.append({
+                'type': 'user',
+                'content': f"[Re-analyze] {question}",
+                'timestamp': datetime.now(),
+                'trace_id': source_info.get('trace_id'),
+                'attachments': [attachment]
+            })
+            st.session_state.chat_history.append({
+                'type': 'bot',
+                'content': ai_response,
+                'timestamp': datetime.now(),
+                'sources': source_info,
+                'trace_id': source_info.get('trace_id')
+            })
     else:
         st.info("💭 No chat history yet. Start a conversation!")
 
@@ -505,6 +857,99 @@ elif selected == "ℹ️ Info":
     with status_col4:
         st.metric("🎤 Voice", "Ready", delta="Available")
     
+    with st.expander("🧠 Session Memory"):
+        memory_report = SessionUtils.get_memory_report()
+        st.write(
+            f"**Sessions:** {len(memory_report['sessions'])} | "
+            f"**In memory:** {memory_report['total_bytes'] / 1024:.1f} KB of {memory_report['global_limit'] / (1024 * 1024):.0f} MB | "
+            f"**Spills:** {memory_report['spills']} | **Evicted:** {memory_report['evicted_sessions']}"
+        )
+        st.dataframe(memory_report['sessions'], use_container_width=True)
+        if session_snapshots is not None:
+            snapshot_stats = session_snapshots.get_stats()
+            st.write(
+                f"**Snapshots:** {snapshot_stats['snapshots']} ({snapshot_stats['disk_bytes'] / 1024:.1f} KB, {snapshot_stats['codec']}) | "
+                f"**Restores:** {snapshot_stats['restores']} (p50 {snapshot_stats['restore_p50_ms']} ms)"
+            )
+    
+    with st.expander("🚦 Request Queue"):
+        scheduler_stats = request_scheduler.get_stats()
+        st.write(f"**Running:** {scheduler_stats['running']} of {scheduler_stats['max_concurrency']} upstream slots")
+        st.dataframe(
+            [{"class": name, **values} for name, values in scheduler_stats['classes'].items()],
+            use_container_width=True
+        )
+    
+    if profiler.enabled:
+        with st.expander("🔥 Profiler: Slowest Reruns"):
+            profiler_stats = profiler.get_stats()
+            st.write(
+                f"**Profiles:** {profiler_stats['profiles']} ({profiler_stats['written']} written to `{profiler_stats['directory']}`) | "
+                f"**Sampling:** every {profiler_stats['interval_ms']:.0f} ms, {profiler_stats['sample_us']} µs per sweep"
+            )
+            profile_kind = st.radio("Show", ["rerun", "request"], horizontal=True, key="profiler_kind")
+            slowest = profiler.slowest(profile_kind)
+            if slowest:
+                st.dataframe(slowest, use_container_width=True)
+                written = [p['file'] for p in slowest if p['file'] and os.path.exists(p['file'])]
+                if written:
+                    chosen = st.selectbox("Collapsed stacks", written, format_func=os.path.basename)
+                    with open(chosen, "rb") as f:
+                        st.download_button("⬇️ Download for flamegraph.pl / speedscope", f.read(), file_name=os.path.basename(chosen))
+            else:
+                st.info("No profiles recorded yet.")
+    
+    with st.expander("🚦 Warm-up"):
+        warmup_status = warmup.get_status()
+        st.write(
+            f"**State:** {warmup_status['state']} | **Time to ready:** {warmup_status['seconds']}s | "
+            f"**Worker:** {Config.WORKER_URL or 'standalone'}"
+        )
+        if warmup_status['steps']:
+            st.dataframe([{"step": name, **step} for name, step in warmup_status['steps'].items()], use_container_width=True)
+    
+    if blob_store:
+        with st.expander("📎 Attachments"):
+            blob_stats = blob_store.get_stats()
+            st.write(
+                f"**Stored:** {blob_stats['blobs']} blobs, {blob_stats['bytes'] / (1024 * 1024):.1f} of "
+                f"{blob_stats['max_bytes'] / (1024 * 1024):.0f} MB | **Deduplicated puts:** {blob_stats['deduplicated']} of {blob_stats['puts']} | "
+                f"**Evictions:** {blob_stats['evictions']}"
+            )
+            st.caption(f"Directory: `{blob_stats['directory']}` | Reads: {blob_stats['hits']} hits, {blob_stats['misses']} misses")
+    
+    with st.expander("📹 Camera Streams"):
+        camera_stats = capture_governor.get_stats()
+        st.write(
+            f"**Live streams:** {camera_stats['streams']} | **CPU cost:** {camera_stats['cpu_cost']:.2f} cores "
+            f"of {camera_stats['total_budget']:.2f} | **Per-stream budget:** {camera_stats['stream_budget']:.2f}"
+        )
+        if camera_stats['per_stream']:
+            st.dataframe(camera_stats['per_stream'], use_container_width=True)
+    
+    with st.expander("🎙️ Voice Latency"):
+        voice_stats = voice_pipeline.get_stats()
+        st.write(
+            f"**Prefetched:** {voice_stats['prefetched']} | **Hits:** {voice_stats['prefetch_hits']} | "
+            f"**Cancelled:** {voice_stats['prefetch_cancelled']}"
+        )
+        st.dataframe(
+            [{"mode": mode, **values} for mode, values in voice_stats['first_audio_latency'].items()],
+            use_container_width=True
+        )
+    
+    if shared_state:
+        with st.expander("🖧 Worker Cluster"):
+            cluster = shared_state.get_stats()
+            st.write(
+                f"**Workers reporting:** {len(cluster['workers'])} | "
+                f"**Cached responses:** {cluster['cache']['entries']} ({cluster['cache']['hits']} hits)"
+            )
+            st.dataframe(
+                [{"metric": name, **values} for name, values in cluster['metrics'].items()],
+                use_container_width=True
+            )
+    
     # App info
     st.markdown("---")
     st.markdown("### 👨‍💻 About")
@@ -517,6 +962,11 @@ elif selected == "ℹ️ Info":
     - **License**: MIT
     """)
 
+# Persist this run's new messages so a reload can restore them
+SessionUtils.save_snapshot()
+
+profiler.end(rerun_profile)
+
 # Footer
 st.markdown("---")
 st.markdown(
@@ -0,0 +1,321 @@
+"""Request tracing across the chat, voice and camera pipelines
+
+Spans nest through a context variable, so they follow asyncio tasks and
+``asyncio.to_thread`` automatically. Work handed to other threads or
+processes carries its parent explicitly: ``tracer.bind`` for queued jobs,
+``tracer.record_span`` for media worker timings measured in another
+process, and W3C ``traceparent`` headers between the Streamlit client and
+the AI server.
+
+Finished spans are batched and appended to TRACE_FILE as OTLP/JSON, one
+ExportTraceServiceRequest per line (the OpenTelemetry collector's file
+exporter format). Every trace gets an id even when it is not sampled for
+export, so chat history entries can always be tied to their trace.
+"""
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Any, Callable, Iterator, Optional
+from config import Config
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+class Span:
+    """One timed operation within a trace"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "kind", "start_ns", "end_ns", "attributes", "error", "sampled")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool, kind: int = SPAN_KIND_INTERNAL,
+                 attributes: Dict[str, Any] = None, start_ns: int = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.kind = kind
+        self.sampled = sampled
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = dict(attributes or {})
+        self.error: Optional[str] = None
+
+    def set(self, **attributes):
+        """Add attributes; None values are skipped"""
+        self.attributes.update({key: value for key, value in attributes.items() if value is not None})
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1}
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+class FileSpanExporter:
+    """Buffers finished spans and appends them to a file as OTLP/JSON lines"""
+
+    def __init__(self, path: str, max_bytes: int, batch_size: int = 256, flush_interval: float = 2.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: List[Span] = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"exported": 0, "dropped": 0}
+        atexit.register(self.flush)
+
+    def export(self, span: Span):
+        with self._lock:
+            if len(self._pending) >= self.batch_size * 20:
+                self.stats["dropped"] += 1
+                return
+            self._pending.append(span)
+            full = len(self._pending) >= self.batch_size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            spans, self._pending = self._pending, []
+        if not spans:
+            return
+        line = json.dumps({
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    {"key": "service.name", "value": {"stringValue": Config.TRACE_SERVICE_NAME}},
+                    {"key": "process.pid", "value": {"intValue": str(os.getpid())}}
+                ]},
+                "scopeSpans": [{"scope": {"name": "ai_chatbot.tracing"}, "spans": [span.to_otlp() for span in spans]}]
+            }]
+        }, default=str)
+        with self._write_lock:
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, f"{self.path}.1")
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+                self.stats["exported"] += len(spans)
+            except OSError:
+                self.stats["dropped"] += len(spans)
+
+class Tracer:
+    """Creates spans, tracks the current one per task/thread and exports finished spans"""
+
+    def __init__(self, enabled: bool = None, sample_ratio: float = None, exporter: FileSpanExporter = None):
+        self.enabled = Config.TRACING_ENABLED if enabled is None else enabled
+        self.sample_ratio = Config.TRACE_SAMPLE_RATIO if sample_ratio is None else sample_ratio
+        self.exporter = exporter or FileSpanExporter(Config.TRACE_FILE, Config.TRACE_MAX_BYTES)
+        self._current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+    def current_span(self) -> Optional[Span]:
+        return self._current.get()
+
+    def current_trace_id(self) -> Optional[str]:
+        span = self._current.get()
+        return span.trace_id if span is not None else None
+
+    def _new_span(self, name: str, parent: Optional[Span], kind: int, attributes: Dict[str, Any],
+                  traceparent: Optional[str] = None, start_ns: int = None) -> Span:
+        if parent is not None:
+            return Span(name, parent.trace_id, parent.span_id, parent.sampled, kind, attributes, start_ns)
+        match = _TRACEPARENT.match(traceparent or "")
+        if match:
+            trace_id, parent_id, flags = match.groups()
+            return Span(name, trace_id, parent_id, flags == "01", kind, attributes, start_ns)
+        return Span(name, f"{random.getrandbits(128):032x}", None, random.random() < self.sample_ratio, kind, attributes, start_ns)
+
+    def _finish(self, span: Span):
+        span.end_ns = time.time_ns()
+        if span.sampled:
+            self.exporter.export(span)
+
+    @contextmanager
+    def span(self, name: str, kind: int = SPAN_KIND_INTERNAL, traceparent: str = None, **attributes) -> Iterator[Optional[Span]]:
+        """Run the block as a child of the current span (or a new trace, continuing traceparent if given)"""
+
+        if not self.enabled:
+            yield None
+            return
+        span = self._new_span(name, self._current.get() if traceparent is None else None, kind, attributes, traceparent)
+        token = self._current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self._current.reset(token)
+            self._finish(span)
+
+    def start(self, name: str, kind: int = SPAN_KIND_INTERNAL, **attributes) -> Optional[Span]:
+        """Begin a child of the current span without making it current; pair with activate and end"""
+
+        if not self.enabled:
+            return None
+        return self._new_span(name, self._current.get(), kind, attributes)
+
+    @contextmanager
+    def activate(self, span: Optional[Span]) -> Iterator[Optional[Span]]:
+        """Make span current for the block only"""
+
+        if span is None:
+            yield None
+            return
+        token = self._current.set(span)
+        try:
+            yield span
+        finally:
+            self._current.reset(token)
+
+    def end(self, span: Optional[Span], error: str = None):
+        """Finish a span begun with start"""
+
+        if span is None:
+            return
+        if error:
+            span.error = error
+        self._finish(span)
+
+    def record_span(self, name: str, parent: Optional[Span], start_ns: int, end_ns: int, error: str = None, **attributes) -> Optional[Span]:
+        """Export an already-finished child of parent, timed elsewhere (e.g. in a worker process)"""
+
+        if not self.enabled or parent is None or not parent.sampled:
+            return None
+        span = self._new_span(name, parent, SPAN_KIND_INTERNAL, attributes, start_ns=start_ns)
+        span.end_ns = end_ns
+        span.error = error
+        self.exporter.export(span)
+        return span
+
+    def bind(self, job: Callable[..., Any]) -> Callable[..., Any]:
+        """Make a job queued for another task or thread (sync, or returning an awaitable) run under the current span"""
+
+        span = self._current.get()
+        if not self.enabled or span is None:
+            return job
+
+        def bound(*args, **kwargs):
+            token = self._current.set(span)
+            try:
+                result = job(*args, **kwargs)
+            finally:
+                self._current.reset(token)
+            if inspect.isawaitable(result):
+                return self._await_under(span, result)
+            return result
+        return bound
+
+    async def _await_under(self, span: Span, awaitable):
+        token = self._current.set(span)
+        try:
+            return await awaitable
+        finally:
+            self._current.reset(token)
+
+    def headers(self) -> Dict[str, str]:
+        """W3C trace context headers for an outgoing request"""
+
+        span = self._current.get()
+        return {"traceparent": span.traceparent} if span is not None else {}
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "sample_ratio": self.sample_ratio, "file": self.exporter.path, **self.exporter.stats}
+
+# Global tracer shared by every session in the process
+tracer = Tracer()
+
+def traced(name: str = None, kind: int = SPAN_KIND_INTERNAL):
+    """Wrap a function, coroutine function or async generator in a span"""
+
+    def decorator(func):
+        span_name = name or func.__qualname__
+        if not tracer.enabled:
+            return func
+
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def generator_wrapper(*args, **kwargs):
+                # Current only while the generator body runs: held across a yield, the span would
+                # leak into the consumer and be reset from another Context when it stops early
+                span = tracer.start(span_name, kind)
+                generator = func(*args, **kwargs)
+                error = None
+                try:
+                    while True:
+                        with tracer.activate(span):
+                            try:
+                                item = await generator.__anext__()
+                            except StopAsyncIteration:
+                                return
+                        yield item
+                except GeneratorExit:
+                    # The consumer stopped early; not an error
+                    raise
+                except BaseException as e:
+                    error = f"{type(e).__name__}: {e}"
+                    raise
+                finally:
+                    with tracer.activate(span):
+                        await generator.aclose()
+                    tracer.end(span, error)
+            return generator_wrapper
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with tracer.span(span_name, kind):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(span_name, kind):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -8,7 +8,19 @@ import json
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional, Tuple
 import hashlib
+import logging
 import os
+import secrets
+import sqlite3
+from collections import deque
+from config import Config
+from media_workers import media_pool, bgr_to_rgb, encode_jpeg, prepare_image, watermark
+from session_manager import session_manager
+from session_snapshots import SnapshotStore, session_snapshots
+from shared_state import shared_state
+from tracing import traced
+
+logger = logging.getLogger(__name__)
 
 class ChatUtils:
     """Utility functions for chat management"""
@@ -94,19 +106,28 @@ class ImageUtils:
     
     @staticmethod
     def resize_image(image: Image.Image, max_size: Tuple[int, int] = (800, 600)) -> Image.Image:
-        """Resize image while maintaining aspect ratio"""
+        """Fit image within max_size keeping aspect ratio, without mutating the input"""
+        
+        scale = min(max_size[0] / image.width, max_size[1] / image.height)
+        if scale >= 1:
+            return image
         
-        image.thumbnail(max_size, Image.Resampling.LANCZOS)
-        return image
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        # reducing_gap does a cheap integer reduce before the LANCZOS pass
+        return image.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
     
     @staticmethod
     def image_to_base64(image: Image.Image) -> str:
         """Convert PIL Image to base64 string"""
         
-        buffered = io.BytesIO()
-        image.save(buffered, format="JPEG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-        return img_str
+        jpeg = media_pool.run(encode_jpeg, image, quality=75)
+        return base64.b64encode(jpeg).decode()
+    
+    @staticmethod
+    def frame_to_image(frame: np.ndarray) -> Image.Image:
+        """Convert an OpenCV BGR frame to an RGB PIL Image in the media worker pool"""
+        
+        return Image.fromarray(media_pool.run(bgr_to_rgb, frame))
     
     @staticmethod
     def base64_to_image(base64_str: str) -> Image.Image:
@@ -122,44 +143,66 @@ class ImageUtils:
         if uploaded_file is None:
             return False
         
+        # Check file size before touching the image data
+        if uploaded_file.size > Config.MAX_FILE_SIZE:
+            return False
+        
         try:
-            image = Image.open(uploaded_file)
-            # Check file size (10MB max)
-            if uploaded_file.size > 10 * 1024 * 1024:
-                return False
-            return True
+            # Image.open only parses the header; pixels are not decoded here
+            with Image.open(uploaded_file) as image:
+                width, height = image.size
+            return width * height <= Config.MAX_IMAGE_PIXELS
         except Exception:
             return False
+        finally:
+            uploaded_file.seek(0)
     
+    @staticmethod
+    def prepare_image_bytes(data: bytes, max_size: Tuple[int, int] = (1024, 1024)) -> bytes:
+        """Decode, downscale and re-encode raw image bytes as JPEG for the model"""
+
+        return media_pool.run(prepare_image, data, max_size)
+
+    @staticmethod
+    def export_batch_results(results: List[Dict], format_type: str = "json") -> str:
+        """Export batch image analysis results"""
+
+        fields = ["name", "response", "error", "attempts", "elapsed"]
+
+        if format_type == "json":
+            return json.dumps([{field: result.get(field) for field in fields} for result in results], indent=2, default=str)
+
+        elif format_type == "csv":
+            import csv
+            output = io.StringIO()
+            writer = csv.writer(output)
+            writer.writerow([field.capitalize() for field in fields])
+            for result in results:
+                writer.writerow([result.get(field, "") for field in fields])
+            return output.getvalue()
+
+        return ""
+
     @staticmethod
     def add_image_watermark(image: Image.Image, text: str = "AI ChatBot Pro") -> Image.Image:
         """Add watermark to image"""
         
-        from PIL import ImageDraw, ImageFont
-        
-        watermarked = image.copy()
-        draw = ImageDraw.Draw(watermarked)
-        
-        # Try to use a font, fallback to default
-        try:
-            font = ImageFont.truetype("arial.ttf", 20)
-        except:
-            font = ImageFont.load_default()
-        
-        # Position watermark at bottom right
-        text_bbox = draw.textbbox((0, 0), text, font=font)
-        text_width = text_bbox[2] - text_bbox[0]
-        text_height = text_bbox[3] - text_bbox[1]
-        
-        margin = 10
-        x = image.width - text_width - margin
-        y = image.height - text_height - margin
+        return Image.fromarray(media_pool.run(watermark, image, text))
+
+class VoiceUtils:
+    """Utility functions for speech synthesis"""
+    
+    @staticmethod
+    @traced("text_to_speech")
+    def synthesize(text: str, lang: str = None, slow: bool = None) -> bytes:
+        """Convert text to MP3 speech with gTTS"""
         
-        # Add semi-transparent background
-        draw.rectangle([x-5, y-5, x+text_width+5, y+text_height+5], fill=(0, 0, 0, 128))
-        draw.text((x, y), text, fill=(255, 255, 255, 180), font=font)
+        from gtts import gTTS
         
-        return watermarked
+        tts = gTTS(text=text, lang=lang or Config.TTS_LANGUAGE, slow=Config.TTS_SLOW if slow is None else slow)
+        fp = io.BytesIO()
+        tts.write_to_fp(fp)
+        return fp.getvalue()
 
 class SessionUtils:
     """Utility functions for session management"""
@@ -168,8 +211,20 @@ class SessionUtils:
     def initialize_session():
         """Initialize session state variables"""
         
+        session_id = session_manager.current_session_id()
+        
+        history = st.session_state.get('chat_history')
+        if history is not None:
+            # Evicted while idle spills the history to disk; put it back under the memory caps
+            session_manager.adopt(session_id, history)
+        
+        if session_snapshots is not None and 'chat_history' not in st.session_state:
+            history = session_manager.create_history(session_id)
+            st.session_state.session_snapshot = session_snapshots.open(SessionUtils.get_snapshot_id(), history)
+            st.session_state.chat_history = history
+        
         defaults = {
-            'chat_history': [],
+            'chat_history': session_manager.create_history(session_id),
             'voice_enabled': False,
             'camera_active': False,
             'user_preferences': {
@@ -185,6 +240,38 @@ class SessionUtils:
         for key, value in defaults.items():
             if key not in st.session_state:
                 st.session_state[key] = value
+        
+        # Enforce memory caps and evict idle sessions on every rerun
+        session_manager.touch(session_id)
+        SessionUtils.save_snapshot()
+    
+    @staticmethod
+    def get_session_id() -> str:
+        """Streamlit's id for the current browser session"""
+        
+        return session_manager.current_session_id()
+    
+    @staticmethod
+    def get_snapshot_id() -> str:
+        """Persistent id of this conversation, kept in the ``sid`` URL parameter across reloads"""
+        
+        snapshot_id = st.query_params.get("sid")
+        if not SnapshotStore.valid_id(snapshot_id):
+            snapshot_id = secrets.token_urlsafe(16)
+            st.query_params["sid"] = snapshot_id
+        return snapshot_id
+    
+    @staticmethod
+    def save_snapshot():
+        """Append messages added since the last save to the session snapshot"""
+        
+        snapshot = st.session_state.get('session_snapshot')
+        if snapshot is None:
+            return
+        try:
+            snapshot.save()
+        except OSError as e:
+            logger.warning("session snapshot save failed: %s", e)
     
     @staticmethod
     def get_session_stats() -> Dict[str, Any]:
@@ -219,11 +306,19 @@ class SessionUtils:
     def cleanup_old_sessions():
         """Clean up old session data"""
         
+        session_manager.evict_idle()
+        
         if 'chat_history' in st.session_state:
-            # Keep only last 100 messages
-            max_messages = 100
+            # Keep only the last MAX_CHAT_HISTORY messages
+            max_messages = Config.MAX_CHAT_HISTORY
             if len(st.session_state.chat_history) > max_messages:
-                st.session_state.chat_history = st.session_state.chat_history[-max_messages:]
+                del st.session_state.chat_history[:-max_messages]
+    
+    @staticmethod
+    def get_memory_report() -> Dict[str, Any]:
+        """Get per-session memory usage across the process"""
+        
+        return session_manager.get_memory_report()
 
 class ValidationUtils:
     """Utility functions for validation"""
@@ -240,6 +335,20 @@ class ValidationUtils:
         
         return True
     
+    @staticmethod
+    def get_client_id() -> str:
+        """Client address forwarded by the proxy, else this session's id"""
+        
+        if not Config.BEHIND_PROXY:
+            # No proxy in front: the header is whatever the client sent, and would dodge the rate limit
+            return session_manager.current_session_id()
+        headers = getattr(getattr(st, "context", None), "headers", None) or {}
+        forwarded = headers.get("X-Forwarded-For", "")
+        if forwarded:
+            # Only the rightmost entry was added by a proxy; anything left of it is client-supplied
+            return forwarded.split(",")[-1].strip()
+        return session_manager.current_session_id()
+    
     @staticmethod
     def sanitize_filename(filename: str) -> str:
         """Sanitize filename for safe storage"""
@@ -257,28 +366,34 @@ class ValidationUtils:
     def check_rate_limit(user_id: str = "default", max_requests: int = 100, window_minutes: int = 60) -> bool:
         """Simple rate limiting check"""
         
-        # In production, use Redis or database for persistence
+        # Multi-worker deployments count requests in the shared SQLite store
+        if shared_state:
+            try:
+                return shared_state.rate_limiter.check(user_id, max_requests, window_minutes * 60)
+            except sqlite3.Error:
+                pass  # fall back to this session's own window
+        
         if 'rate_limits' not in st.session_state:
             st.session_state.rate_limits = {}
         
         now = datetime.now()
         window_start = now - timedelta(minutes=window_minutes)
         
+        # Bounded to max_requests entries, oldest first
         if user_id not in st.session_state.rate_limits:
-            st.session_state.rate_limits[user_id] = []
+            st.session_state.rate_limits[user_id] = deque(maxlen=max_requests)
+        request_times = st.session_state.rate_limits[user_id]
         
         # Clean old requests
-        st.session_state.rate_limits[user_id] = [
-            req_time for req_time in st.session_state.rate_limits[user_id]
-            if req_time > window_start
-        ]
+        while request_times and request_times[0] <= window_start:
+            request_times.popleft()
         
         # Check limit
-        if len(st.session_state.rate_limits[user_id]) >= max_requests:
+        if len(request_times) >= max_requests:
             return False
         
         # Add current request
-        st.session_state.rate_limits[user_id].append(now)
+        request_times.append(now)
         return True
 
 class PerformanceUtils:
@@ -297,7 +412,7 @@ class PerformanceUtils:
             
             # Store in session state for analytics
             if 'performance_metrics' not in st.session_state:
-                st.session_state.performance_metrics = []
+                st.session_state.performance_metrics = deque(maxlen=Config.PERFORMANCE_METRICS_MAX)
             
             st.session_state.performance_metrics.append({
                 'function': func.__name__,
@@ -305,6 +420,12 @@ class PerformanceUtils:
                 'timestamp': start_time
             })
             
+            if shared_state:
+                try:
+                    shared_state.metrics.record(f"{func.__name__}_seconds", response_time)
+                except sqlite3.Error:
+                    pass
+            
             return result
         return wrapper
     
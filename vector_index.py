@@ -0,0 +1,404 @@
+import atexit
+import hashlib
+import json
+import os
+import re
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import Dict, List, Any, Optional, Tuple
+import numpy as np
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; concurrent saves from several processes are then not merged safely
+    fcntl = None
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+class HashingEmbedder:
+    """Local text embedder using signed feature hashing of unigrams and bigrams"""
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def _features(self, text: str) -> List[int]:
+        """Hash tokens and bigrams of a text into signed bucket ids"""
+        tokens = _TOKEN_RE.findall(text.lower())
+        grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        return [zlib.crc32(gram.encode()) for gram in grams]
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Embed a batch of texts into L2-normalized float32 rows"""
+
+        rows, hashes = [], []
+        for row, text in enumerate(texts):
+            features = self._features(text)
+            rows.extend([row] * len(features))
+            hashes.extend(features)
+
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        if hashes:
+            hashes = np.asarray(hashes, dtype=np.uint32)
+            rows = np.asarray(rows, dtype=np.int64)
+            # Low bits pick the bucket, the top bit picks the sign
+            cols = (hashes % self.dim).astype(np.int64)
+            signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+            np.add.at(vectors, (rows, cols), signs)
+
+        return normalize_rows(vectors)
+
+    def embed(self, text: str) -> np.ndarray:
+        """Embed a single text"""
+        return self.embed_batch([text])[0]
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize rows, leaving all-zero rows untouched"""
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
+
+class VectorIndex:
+    """Append-only cosine-similarity index over a contiguous NumPy matrix
+
+    Search is exact brute force by default. Calling ``build_ivf`` trains a
+    coarse k-means quantizer so that ``search`` only scores the ``nprobe``
+    closest inverted lists, which is the path to approximate search once
+    the index grows past what a single matrix-vector product can serve.
+
+    Payloads may carry an ``owner``; ``search`` with an owner only scores
+    that owner's vectors, so one index can serve many users without
+    returning one user's snippets to another.
+    """
+
+    def __init__(self, dim: int, initial_capacity: int = 1024):
+        self.dim = dim
+        self._vectors = np.zeros((initial_capacity, dim), dtype=np.float32)
+        self._size = 0
+        self._payloads: List[Dict[str, Any]] = []
+        self._owners = np.zeros(initial_capacity, dtype=np.int32)  # 0 means no owner
+        self._owner_codes: Dict[str, int] = {}
+        self._lock = threading.RLock()
+
+        # Inverted-file (IVF) state, populated by build_ivf
+        self._centroids: Optional[np.ndarray] = None
+        self._assignments: Optional[np.ndarray] = None
+        self._lists: List[np.ndarray] = []
+        self._unlisted_from = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _ensure_capacity(self, extra: int):
+        """Grow the backing matrix geometrically"""
+
+        needed = self._size + extra
+        if needed <= len(self._vectors):
+            return
+        capacity = max(needed, len(self._vectors) * 2)
+        grown = np.zeros((capacity, self.dim), dtype=np.float32)
+        grown[:self._size] = self._vectors[:self._size]
+        self._vectors = grown
+        owners = np.zeros(capacity, dtype=np.int32)
+        owners[:self._size] = self._owners[:self._size]
+        self._owners = owners
+
+    def _owner_code(self, owner: Optional[str]) -> int:
+        if owner is None:
+            return 0
+        return self._owner_codes.setdefault(str(owner), len(self._owner_codes) + 1)
+
+    def add_batch(self, vectors: np.ndarray, payloads: List[Dict[str, Any]]):
+        """Append a batch of vectors with their payloads"""
+
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if len(vectors) != len(payloads):
+            raise ValueError("vectors and payloads must have the same length")
+        if not len(vectors):
+            return
+
+        vectors = normalize_rows(vectors)
+        with self._lock:
+            self._ensure_capacity(len(vectors))
+            self._vectors[self._size:self._size + len(vectors)] = vectors
+            self._owners[self._size:self._size + len(vectors)] = [self._owner_code(p.get("owner")) for p in payloads]
+            self._size += len(vectors)
+            self._payloads.extend(payloads)
+            if self._centroids is not None:
+                self._assign_pending()
+
+    def build_ivf(self, n_lists: int = 256, n_iter: int = 10, sample_size: int = 20000, seed: int = 0):
+        """Train a spherical k-means coarse quantizer for approximate search"""
+
+        with self._lock:
+            data = self._vectors[:self._size]
+            n_lists = min(n_lists, self._size)
+            if n_lists < 2:
+                return
+
+            rng = np.random.default_rng(seed)
+            sample = data[rng.choice(self._size, size=min(sample_size, self._size), replace=False)]
+            centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+
+            for _ in range(n_iter):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, sample)
+                empty = np.bincount(labels, minlength=n_lists) == 0
+                sums[empty] = centroids[empty]
+                centroids = normalize_rows(sums)
+
+            self._centroids = centroids
+            self._assignments = np.empty(0, dtype=np.int32)
+            self._unlisted_from = 0
+            self._assign_pending()
+
+    def _assign_pending(self):
+        """Assign vectors added since the last assignment to inverted lists"""
+
+        new = self._vectors[self._unlisted_from:self._size]
+        labels = np.argmax(new @ self._centroids.T, axis=1).astype(np.int32)
+        self._assignments = np.concatenate([self._assignments, labels])
+        self._unlisted_from = self._size
+
+        order = np.argsort(self._assignments, kind="stable")
+        bounds = np.searchsorted(self._assignments[order], np.arange(len(self._centroids) + 1))
+        self._lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self._centroids))]
+
+    def search(self, query: np.ndarray, k: int = 5, nprobe: Optional[int] = None, owner: str = None) -> List[Tuple[float, Dict[str, Any]]]:
+        """Return the top-k (score, payload) pairs for a query vector, only among owner's vectors if given"""
+
+        with self._lock:
+            if not self._size:
+                return []
+            code = None
+            if owner is not None:
+                code = self._owner_codes.get(str(owner))
+                if code is None:
+                    return []
+
+            query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+
+            if nprobe and self._centroids is not None:
+                probes = np.argpartition(-(self._centroids @ query), min(nprobe, len(self._centroids)) - 1)[:nprobe]
+                candidates = np.concatenate([self._lists[p] for p in probes])
+                if not len(candidates):
+                    return []
+                scores = self._vectors[candidates] @ query
+                owners = self._owners[candidates]
+            else:
+                candidates = None
+                scores = self._vectors[:self._size] @ query
+                owners = self._owners[:self._size]
+
+            if code is not None:
+                scores = np.where(owners == code, scores, -np.inf)
+                k = min(k, int(np.count_nonzero(owners == code)))
+                if not k:
+                    return []
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            ids = candidates[top] if candidates is not None else top
+            return [(float(scores[t]), self._payloads[i]) for t, i in zip(top, ids)]
+
+    def save(self, path: str):
+        """Persist vectors and payloads to a compressed .npz file, replacing it atomically"""
+
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with self._lock:
+            with open(temp_path, "wb") as f:
+                np.savez_compressed(
+                    f,
+                    vectors=self._vectors[:self._size],
+                    payloads=np.array(json.dumps(self._payloads))
+                )
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "VectorIndex":
+        """Load an index previously written by save"""
+
+        with np.load(path) as data:
+            vectors = data["vectors"]
+            payloads = json.loads(str(data["payloads"]))
+        index = cls(vectors.shape[1], initial_capacity=max(len(vectors), 1024))
+        index.add_batch(vectors, payloads)
+        return index
+
+@contextmanager
+def _file_lock(path: str):
+    """Hold an exclusive lock on path + ".lock" across processes where fcntl exists"""
+
+    if fcntl is None:
+        yield
+        return
+    with open(f"{path}.lock", "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def _file_version(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+class ConversationMemory:
+    """Incremental retrieval memory over chat messages and uploaded documents
+
+    Every message and document chunk is owned by the user that added it,
+    and ``retrieve`` only returns the requesting user's own snippets. With
+    RAG_INDEX_PATH set, the index is loaded at start and saved after each
+    indexed document and at exit. Several processes (Streamlit workers, the
+    AI server) may share the path: a save takes the file lock, merges in
+    entries others saved since this process last read the file, then writes.
+    """
+
+    def __init__(self, config: Dict[str, Any] = None):
+        self.config = config or Config.get_rag_config()
+        self.embedder = HashingEmbedder(self.config["dim"])
+        self._disk_version = None  # (mtime_ns, size) of the file when last read or written here
+        self.index = self._load_index()
+        self._seen = {payload["key"] for payload in self.index._payloads}
+        self._pending: List[Tuple[str, Dict[str, Any]]] = []
+        self._lock = threading.Lock()
+        if self.config.get("index_path"):
+            atexit.register(self.save)
+
+    def _load_index(self) -> VectorIndex:
+        """Load the persisted index if configured, else start empty"""
+
+        path = self.config.get("index_path")
+        if path:
+            try:
+                version = _file_version(path)
+                index = VectorIndex.load(path)
+                self._disk_version = version
+                return index
+            except (OSError, ValueError, KeyError):
+                pass
+        return VectorIndex(self.config["dim"])
+
+    @staticmethod
+    def message_key(msg: Dict, user_id: str) -> str:
+        """Stable key identifying one user's chat message"""
+
+        raw = f"{user_id}|{msg.get('type')}|{msg.get('timestamp')}|{msg.get('content')}"
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def _enqueue(self, key: str, text: str, payload: Dict[str, Any]):
+        """Queue a text for the next batched embedding flush"""
+
+        if key in self._seen or not text.strip():
+            return
+        self._seen.add(key)
+        self._pending.append((text, dict(payload, key=key, text=text)))
+        if len(self._pending) >= self.config["batch_size"]:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        """Embed and index all pending texts in one vectorized batch"""
+
+        if not self._pending:
+            return
+        texts = [text for text, _ in self._pending]
+        payloads = [payload for _, payload in self._pending]
+        self._pending = []
+        self.index.add_batch(self.embedder.embed_batch(texts), payloads)
+
+    def flush(self):
+        """Index any pending texts"""
+
+        with self._lock:
+            self._flush_locked()
+            if self.config.get("approximate") and self.index._centroids is None and len(self.index) >= self.config["ivf_lists"] * 40:
+                self.index.build_ivf(self.config["ivf_lists"])
+
+    def add_messages(self, messages: List[Dict], user_id: str):
+        """Queue a user's chat messages that have not been indexed yet"""
+
+        with self._lock:
+            for msg in messages:
+                content = msg.get('content')
+                if not isinstance(content, str):
+                    continue
+                self._enqueue(self.message_key(msg, user_id), content, {
+                    "kind": "message",
+                    "owner": user_id,
+                    "role": msg.get('type'),
+                    "timestamp": str(msg.get('timestamp', ''))
+                })
+
+    def add_document(self, text: str, source: str, user_id: str) -> int:
+        """Split a user's document into chunks and queue them; returns the chunk count"""
+
+        size = self.config["chunk_size"]
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        with self._lock:
+            for n, chunk in enumerate(chunks):
+                key = hashlib.sha1(f"{user_id}|{source}|{n}|{chunk}".encode()).hexdigest()
+                self._enqueue(key, chunk, {"kind": "document", "owner": user_id, "source": source, "chunk": n})
+        return len(chunks)
+
+    def retrieve(self, query: str, user_id: str, k: int = None, exclude: List[str] = None) -> List[Dict[str, Any]]:
+        """Return the top-k snippets from user_id's own messages and documents relevant to a query"""
+
+        self.flush()
+        k = k or self.config["top_k"]
+        exclude = set(exclude or [])
+        nprobe = self.config["ivf_nprobe"] if self.config.get("approximate") else None
+
+        results = []
+        for score, payload in self.index.search(self.embedder.embed(query), k + len(exclude), nprobe=nprobe, owner=user_id):
+            if score < self.config["min_score"] or payload["key"] in exclude:
+                continue
+            results.append(dict(payload, score=round(score, 4)))
+            if len(results) >= k:
+                break
+        return results
+
+    def save(self):
+        """Merge entries other processes saved, then persist the index to the configured path"""
+
+        self.flush()
+        path = self.config.get("index_path")
+        if not path:
+            return
+        try:
+            with _file_lock(path), self._lock:
+                self._merge_saved(path)
+                self.index.save(path)
+                self._disk_version = _file_version(path)
+        except OSError:
+            # Retrieval memory is best-effort; the next save retries
+            pass
+
+    def _merge_saved(self, path: str):
+        """Add entries in the saved file that this process has not seen (file lock and _lock held)"""
+
+        version = _file_version(path)
+        if version is None or version == self._disk_version:
+            return
+        try:
+            saved = VectorIndex.load(path)
+        except (ValueError, KeyError):
+            return  # unreadable; this save replaces it
+        new = [i for i, payload in enumerate(saved._payloads) if payload["key"] not in self._seen]
+        if new:
+            self.index.add_batch(saved._vectors[np.asarray(new)], [saved._payloads[i] for i in new])
+            self._seen.update(saved._payloads[i]["key"] for i in new)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get memory index statistics"""
+
+        return {
+            "vectors": len(self.index),
+            "pending": len(self._pending),
+            "approximate": self.index._centroids is not None
+        }
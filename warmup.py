@@ -0,0 +1,266 @@
+"""Background warm-up at process start, and the readiness it reports
+
+Without warm-up the first request after a deploy pays for module imports,
+the media worker processes starting, the first TLS handshake upstream and an
+empty cache. ``WarmUp.start`` runs those costs on a daemon thread instead:
+
+1. modules: import Config.WARMUP_MODULES and initialize image codecs
+2. media_pool: start the worker processes with a tiny JPEG encode and WAV decode
+3. upstream: open WARMUP_CONNECTIONS keep-alive connections in AIService's pool
+4. caches: load the persisted hot set into the shared response cache and the
+   image result cache
+5. synthetic_request: one local image analysis and one low-priority request
+   through AIService
+6. any steps registered with ``add_step`` before start
+
+A failed step is recorded and skipped; the process is ready once every step
+has run. Readiness shows in ``AIService.get_system_status`` and, when
+WORKER_URL and SHARED_STATE_PATH are set, is published to shared state where
+proxy.py holds new clients until a worker is ready. After that the hot set
+is saved every WARMUP_HOT_SET_INTERVAL seconds and at exit.
+"""
+import asyncio
+import atexit
+import importlib
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import wave
+from typing import Dict, List, Any, Callable, Optional, Tuple
+import numpy as np
+from PIL import Image
+from config import Config
+from media_workers import media_pool, decode_wav, encode_jpeg
+from shared_state import shared_state
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+def _silent_wav(seconds: float = 0.1, rate: int = 16000) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b"\x00\x00" * int(rate * seconds))
+    return buffer.getvalue()
+
+class WarmUp:
+    """Runs warm-up steps once per process and tracks readiness"""
+
+    def __init__(self,
+                 enabled: bool = None,
+                 hot_set_path: str = None,
+                 hot_set_size: int = None,
+                 worker_url: str = None):
+        self.enabled = Config.WARMUP_ENABLED if enabled is None else enabled
+        self.hot_set_path = hot_set_path or Config.WARMUP_HOT_SET_PATH
+        self.hot_set_size = hot_set_size or Config.WARMUP_HOT_SET_SIZE
+        self.worker_url = Config.WORKER_URL if worker_url is None else worker_url
+
+        self.service = None
+        self.state = "idle"  # idle -> warming -> ready
+        self.steps: Dict[str, Dict[str, Any]] = {}
+        self.started_at: Optional[float] = None
+        self.ready_seconds: Optional[float] = None
+        self._extra_steps: List[Tuple[str, Callable[[], Any]]] = []
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def add_step(self, name: str, fn: Callable[[], Any]):
+        """Register an extra step; only steps added before start() run"""
+        self._extra_steps.append((name, fn))
+
+    def start(self, service) -> bool:
+        """Begin warming up ``service`` (an AIService) in the background; later calls do nothing"""
+
+        with self._lock:
+            if self._thread is not None or self.ready:
+                return False
+            self.service = service
+            self.started_at = time.time()
+            if not self.enabled:
+                self.state = "ready"
+                self.ready_seconds = 0.0
+                self._ready.set()
+                self._publish()
+                return False
+            self.state = "warming"
+            self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+            self._thread.start()
+        atexit.register(self.save_hot_set)
+        return True
+
+    def wait(self, timeout: float = None) -> bool:
+        """Block until ready; False if the timeout passed first"""
+        return self._ready.wait(timeout)
+
+    def _run(self):
+        self._publish()
+        steps = [
+            ("modules", self._import_modules),
+            ("media_pool", self._start_media_pool),
+            ("upstream", self._open_upstream),
+            ("caches", self._prime_caches),
+            ("synthetic_request", self._synthetic_request)
+        ] + self._extra_steps
+
+        with tracer.span("warmup", worker=self.worker_url or None):
+            for name, fn in steps:
+                self._run_step(name, fn)
+        self.ready_seconds = time.time() - self.started_at
+        self.state = "ready"
+        self._ready.set()
+        logger.info("warm-up finished in %.2fs: %s", self.ready_seconds,
+                    ", ".join(f"{name} {step['status']}" for name, step in self.steps.items()))
+        self._maintain()
+
+    def _run_step(self, name: str, fn: Callable[[], Any]):
+        start = time.perf_counter()
+        try:
+            with tracer.span(f"warmup.{name}"):
+                detail = fn()
+            status = "skipped" if isinstance(detail, str) and detail.startswith("skipped") else "ok"
+        except Exception as e:
+            logger.warning("warm-up step %s failed: %s", name, e)
+            status, detail = "failed", f"{type(e).__name__}: {e}"
+        self.steps[name] = {"status": status, "ms": round((time.perf_counter() - start) * 1000, 1), "detail": detail}
+        self._publish()
+
+    def _import_modules(self) -> str:
+        missing = []
+        for module in Config.WARMUP_MODULES:
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                missing.append(module)
+        Image.init()  # registers every PIL format plugin up front
+        import cv2
+        cv2.imencode(".jpg", np.zeros((8, 8, 3), np.uint8))
+        return f"missing: {', '.join(missing)}" if missing else "all imported"
+
+    def _start_media_pool(self) -> str:
+        media_pool.run(encode_jpeg, np.zeros((16, 16, 3), np.uint8))
+        media_pool.run(decode_wav, _silent_wav())
+        return f"{media_pool.workers} workers"
+
+    def _open_upstream(self) -> str:
+        """Open keep-alive connections in the pool AIService's upstream calls use"""
+
+        if not self.service.openai_available:
+            return "skipped: no API key (demo mode)"
+        import openai
+        url = f"{openai.api_base.rstrip('/')}/models"
+        headers = {"Authorization": f"Bearer {openai.api_key}"}
+        errors = []
+
+        def connect():
+            try:
+                self.service.upstream_session.get(url, headers=headers, timeout=10).close()
+            except Exception as e:
+                errors.append(e)
+
+        # Concurrent requests, so each one opens its own connection
+        threads = [threading.Thread(target=connect) for _ in range(max(1, Config.WARMUP_CONNECTIONS))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if len(errors) == len(threads):
+            raise errors[0]
+        return f"{len(threads) - len(errors)} connections"
+
+    def _prime_caches(self) -> str:
+        try:
+            with open(self.hot_set_path, encoding="utf-8") as f:
+                hot_set = json.load(f)
+        except FileNotFoundError:
+            return "skipped: no hot set saved yet"
+
+        primed = []
+        if shared_state and hot_set.get("responses"):
+            primed.append(f"{shared_state.cache.prime(hot_set['responses'])} responses")
+        if self.service.image_cache and hot_set.get("images"):
+            primed.append(f"{self.service.image_cache.load(hot_set['images'])} image results")
+        return ", ".join(primed) or "skipped: nothing to prime"
+
+    def _synthetic_request(self) -> str:
+        if self.service.image_analyzer:
+            self.service.image_analyzer.analyze(Image.new("RGB", (64, 64), (128, 128, 128)))
+        if not Config.WARMUP_SYNTHETIC_REQUEST:
+            return "skipped: WARMUP_SYNTHETIC_REQUEST is off"
+        response, sources = asyncio.run(self.service.get_ai_response(
+            Config.WARMUP_PROMPT, include_sources=False, priority="batch", user_id="warmup", record=False
+        ))
+        if sources.get("error"):
+            raise RuntimeError(sources["error"])
+        return "answered"
+
+    def _maintain(self):
+        """Heartbeat readiness to shared state and save the hot set periodically"""
+
+        last_save = time.monotonic()
+        while True:
+            time.sleep(Config.WARMUP_HEARTBEAT_INTERVAL)
+            self._publish()
+            if time.monotonic() - last_save >= Config.WARMUP_HOT_SET_INTERVAL:
+                last_save = time.monotonic()
+                self.save_hot_set()
+
+    def save_hot_set(self):
+        """Persist the most-hit cache entries for the next process to prime from"""
+
+        if self.service is None:
+            return
+        hot_set = {"saved": time.time(), "responses": [], "images": []}
+        try:
+            if shared_state:
+                hot_set["responses"] = shared_state.cache.hot_entries(self.hot_set_size)
+            if self.service.image_cache:
+                hot_set["images"] = self.service.image_cache.hot_entries(self.hot_set_size)
+        except sqlite3.Error:
+            return
+        if not hot_set["responses"] and not hot_set["images"]:
+            return
+
+        temp_path = f"{self.hot_set_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.hot_set_path)), exist_ok=True)
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(hot_set, f, default=str)
+            os.replace(temp_path, self.hot_set_path)
+        except OSError as e:
+            logger.warning("could not save hot set: %s", e)
+
+    def _publish(self):
+        if not (shared_state and self.worker_url):
+            return
+        try:
+            shared_state.workers.publish(self.worker_url, self.ready, self.get_status())
+        except sqlite3.Error:
+            # The proxy keeps its last view; the next heartbeat retries
+            pass
+
+    def get_status(self) -> Dict[str, Any]:
+        """Readiness, time to ready and per-step results"""
+
+        return {
+            "ready": self.ready,
+            "state": self.state,
+            "pid": os.getpid(),
+            "seconds": round(self.ready_seconds if self.ready_seconds is not None
+                             else time.time() - self.started_at, 2) if self.started_at else None,
+            "steps": dict(self.steps)
+        }
+
+# Global warm-up; started by streamlit_app.py and ai_server.py
+warmup = WarmUp()